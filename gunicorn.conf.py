@@ -0,0 +1,36 @@
+import gc
+import os
+import shutil
+import tempfile
+
+# Каталог для метрик prometheus_client в многопроцессном режиме; задаётся до импорта приложения
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'netta-metrics'))
+
+# Приложение собирается один раз в мастере, воркеры получают его через fork (copy-on-write)
+wsgi_app = 'netta:create_app()'
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    # Объекты, созданные при загрузке, убираем из поля зрения сборщика мусора:
+    # иначе его проходы трогают страницы и копируют их в каждый воркер
+    if server.cfg.preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # Соединения с БД, открытые в мастере, воркерам не достаются
+    from netta import app, db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
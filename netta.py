@@ -1,18 +1,77 @@
-from flask import Flask, render_template_string, request, redirect, url_for, flash
+from flask import Flask, request, redirect, url_for, flash, jsonify, abort, send_from_directory, g, session, has_request_context, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from markupsafe import escape
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client import Counter as PrometheusCounter
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import configure_mappers
+from urllib.parse import parse_qsl, unquote, urlsplit
+from datetime import datetime, timedelta
+from functools import wraps
+from collections import Counter, OrderedDict, namedtuple
+import atexit
+import base64
+import bisect
+import click
+import fcntl
+import hashlib
+import heapq
+import json
+import math
 import os
+import pickle
 import random
+import re
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
 
 # ============ ИНИЦИАЛИЗАЦИЯ ============
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'netta-mega-secret-key-2026')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///netta.db').replace('postgres://', 'postgresql://', 1)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MEDIA_MAX_BYTES', 20 * 1024 * 1024)) + 64 * 1024
 
-db = SQLAlchemy(app)
+# Реплики для чтения: DATABASE_REPLICA_URLS="postgresql://...,postgresql://..."
+REPLICA_BINDS = {
+    f'replica_{i}': url.strip().replace('postgres://', 'postgresql://', 1)
+    for i, url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(','))
+    if url.strip()
+}
+REPLICA_PIN_SECONDS = float(os.environ.get('REPLICA_PIN_SECONDS', 5))
+LAST_SEEN_RESOLUTION = 60
+app.config['SQLALCHEMY_BINDS'] = dict(REPLICA_BINDS)
+
+class RoutingSession(FlaskSession):
+    # GET-запросы читают с реплик; запись, flush и всё после записи — с основной БД
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and REPLICA_BINDS and has_request_context():
+            if self._flushing or (clause is not None and not clause.is_select):
+                g.use_primary = True
+            elif reads_from_replica():
+                return db.engines[random.choice(list(REPLICA_BINDS))]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def reads_from_replica():
+    return (
+        request.method in ('GET', 'HEAD')
+        and not g.get('use_primary')
+        and session.get('primary_until', 0) <= time.time()
+    )
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -26,12 +85,23 @@ class User(UserMixin, db.Model):
     full_name = db.Column(db.String(100))
     bio = db.Column(db.Text, default='Исследователь вселенной Netta 🌌')
     avatar_color = db.Column(db.String(7), default='#7c3aed')
+    cover_color = db.Column(db.String(7), default='#5b21b6')
     level = db.Column(db.Integer, default=1)
+    xp = db.Column(db.Integer, default=0)
     coins = db.Column(db.Integer, default=100)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
     posts_count = db.Column(db.Integer, default=0)
     friends_count = db.Column(db.Integer, default=0)
+    # Изменение полей индекса подсказок (см. UsernameIndex) — по нему индекс догружает только изменённых
+    profile_updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_users_level_rank', 'level', 'id'),
+        db.Index('ix_users_xp_rank', 'xp', 'id'),
+        db.Index('ix_users_coins_rank', 'coins', 'id'),
+        db.Index('ix_users_profile_updated', 'profile_updated_at', 'id'),
+    )
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -46,9 +116,108 @@ class Post(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     likes_count = db.Column(db.Integer, default=0)
     comments_count = db.Column(db.Integer, default=0)
+    shares_count = db.Column(db.Integer, default=0)
+    views_count = db.Column(db.Integer, default=0)
+    unique_viewers = db.Column(db.Integer, default=0)
+    viewers_hll = db.Column(db.LargeBinary)
+    media_type = db.Column(db.String(20))
+    media_url = db.Column(db.String(500))
+    media_variants = db.Column(db.String(50))
+    poll_data = db.Column(db.Text)
+    privacy = db.Column(db.String(20), default='public')
+    location = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
+    # Время правки поста. Служебные UPDATE (счётчики, балл, разметка) передают updated_at=updated_at,
+    # иначе onupdate сдвинет его и пост станет «изменённым» для ETag и выгрузки
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    hot_score = db.Column(db.Float)
+    content_html = db.Column(db.Text)
+    content_html_version = db.Column(db.Integer)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+    geohash_cell = db.Column(db.String(12))
     author = db.relationship('User', backref='user_posts')
+    
+    __table_args__ = (
+        db.Index('ix_posts_created', 'created_at', 'id'),
+        db.Index('ix_posts_privacy_created', 'privacy', 'created_at', 'id'),
+        db.Index('ix_posts_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_posts_privacy_hot', 'privacy', 'hot_score', 'id'),
+        db.Index('ix_posts_user_hot', 'user_id', 'hot_score', 'id'),
+        db.Index('ix_posts_user_privacy_created', 'user_id', 'privacy', 'created_at', 'id'),
+        db.Index('ix_posts_user_privacy_hot', 'user_id', 'privacy', 'hot_score', 'id'),
+        db.Index('ix_posts_geohash_cell_created', 'geohash_cell', 'created_at', 'id'),
+    )
+
+class Comment(db.Model):
+    __tablename__ = 'comments'
+    id = db.Column(db.Integer, primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    likes_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    author = db.relationship('User', backref='user_comments')
+    
+    __table_args__ = (
+        db.Index('ix_comments_post_created', 'post_id', 'created_at'),
+        db.Index('ix_comments_user_id', 'user_id', 'id'),
+    )
+
+class Friendship(db.Model):
+    __tablename__ = 'friendships'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    friend_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    status = db.Column(db.String(20), default='pending')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User', foreign_keys=[user_id], backref='sent_friendships')
+    friend = db.relationship('User', foreign_keys=[friend_id], backref='received_friendships')
+
+    __table_args__ = (
+        db.Index('uq_friendships_pair', 'user_id', 'friend_id', unique=True),
+        db.Index('ix_friendships_friend_status', 'friend_id', 'status'),
+        # Одна строка на пару в любом направлении: из встречных заявок, пришедших одновременно, пройдёт одна
+        db.Index(
+            'uq_friendships_unordered',
+            db.case((user_id < friend_id, user_id), else_=friend_id),
+            db.case((user_id < friend_id, friend_id), else_=user_id),
+            unique=True
+        ),
+    )
+
+class Message(db.Model):
+    __tablename__ = 'messages'
+    id = db.Column(db.Integer, primary_key=True)
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    is_read = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
+    receiver = db.relationship('User', foreign_keys=[receiver_id], backref='received_messages')
+    
+    __table_args__ = (
+        db.Index('ix_messages_receiver_created', 'receiver_id', 'created_at'),
+        db.Index('ix_messages_sender_created', 'sender_id', 'created_at'),
+    )
+
+class Notification(db.Model):
+    __tablename__ = 'notifications'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    type = db.Column(db.String(50))
+    content = db.Column(db.Text)
+    reference_id = db.Column(db.Integer)
+    is_read = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User', backref='user_notifications')
+    
+    __table_args__ = (
+        db.Index('ix_notifications_user_created', 'user_id', 'created_at'),
+        db.Index('ix_notifications_read_created', 'is_read', 'created_at', 'id'),
+    )
 
 class Like(db.Model):
     __tablename__ = 'likes'
@@ -56,667 +225,739 @@ class Like(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User', backref='user_likes')
+    post = db.relationship('Post', backref='post_likes')
+    
+    __table_args__ = (
+        db.Index('ix_likes_user_post', 'user_id', 'post_id'),
+        db.Index('ix_likes_post', 'post_id'),
+    )
+
+class PollOption(db.Model):
+    __tablename__ = 'poll_options'
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, default=0)
+    text = db.Column(db.String(200), nullable=False)
+    votes_count = db.Column(db.Integer, default=0, nullable=False)
+
+class PollVote(db.Model):
+    __tablename__ = 'poll_votes'
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    option_id = db.Column(db.Integer, db.ForeignKey('poll_options.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('uq_poll_votes_post_user', 'post_id', 'user_id', unique=True),
+    )
+
+class XpEvent(db.Model):
+    __tablename__ = 'xp_events'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    xp = db.Column(db.Integer, default=0, nullable=False)
+    coins = db.Column(db.Integer, default=0, nullable=False)
+    reason = db.Column(db.String(50))
+    reference_id = db.Column(db.Integer)
+    # Только у начального баланса (reason='opening'): уровень до журнала
+    level = db.Column(db.Integer)
+    idempotency_key = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    applied_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_xp_events_pending', 'applied_at', 'id'),
+        db.Index('uq_xp_events_idempotency_key', 'idempotency_key', unique=True),
+    )
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100))
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text)
+    idempotency_key = db.Column(db.String(200))
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at', 'id'),
+        db.Index('ix_jobs_kind_status', 'kind', 'status', 'run_at'),
+        db.Index('uq_jobs_idempotency_key', 'idempotency_key', unique=True),
+    )
+
+# Архив: те же колонки, что в горячих таблицах; на Postgres — помесячные партиции по created_at
+class PostArchive(db.Model):
+    __tablename__ = 'posts_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    likes_count = db.Column(db.Integer, default=0)
+    comments_count = db.Column(db.Integer, default=0)
+    shares_count = db.Column(db.Integer, default=0)
+    views_count = db.Column(db.Integer, default=0)
+    unique_viewers = db.Column(db.Integer, default=0)
+    viewers_hll = db.Column(db.LargeBinary)
+    media_type = db.Column(db.String(20))
+    media_url = db.Column(db.String(500))
+    media_variants = db.Column(db.String(50))
+    poll_data = db.Column(db.Text)
+    privacy = db.Column(db.String(20), default='public')
+    location = db.Column(db.String(200))
+    updated_at = db.Column(db.DateTime)
+    content_html = db.Column(db.Text)
+    content_html_version = db.Column(db.Integer)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+    geohash_cell = db.Column(db.String(12))
+    archived_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+    author = db.relationship('User')
+    
+    __table_args__ = (
+        db.Index('ix_posts_archive_user_created_id', 'user_id', 'created_at', 'id'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+class LikeArchive(db.Model):
+    __tablename__ = 'likes_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    post_id = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+    
+    __table_args__ = (
+        db.Index('ix_likes_archive_user_post_id', 'user_id', 'post_id', 'id'),
+        db.Index('ix_likes_archive_post', 'post_id'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+class CommentArchive(db.Model):
+    __tablename__ = 'comments_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    post_id = db.Column(db.Integer, nullable=False)
+    likes_count = db.Column(db.Integer, default=0)
+    archived_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+    
+    __table_args__ = (
+        db.Index('ix_comments_archive_post_created', 'post_id', 'created_at'),
+        db.Index('ix_comments_archive_user_id', 'user_id', 'id'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+class NotificationArchive(db.Model):
+    __tablename__ = 'notifications_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    type = db.Column(db.String(50))
+    content = db.Column(db.Text)
+    reference_id = db.Column(db.Integer)
+    is_read = db.Column(db.Boolean, default=False)
+    archived_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+    
+    __table_args__ = (
+        db.Index('ix_notifications_archive_user_created', 'user_id', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-# ============ HTML ШАБЛОНЫ ============
-BASE_STYLE = '''
-<style>
-    :root {
-        --purple-neon: #bf00ff;
-        --purple-deep: #7c3aed;
-        --purple-light: #a855f7;
-        --purple-dark: #5b21b6;
-        --space-bg: #0a0a1a;
-        --card-bg: rgba(20, 15, 40, 0.9);
-        --gradient: linear-gradient(135deg, #7c3aed 0%, #bf00ff 100%);
-    }
-    * { margin: 0; padding: 0; box-sizing: border-box; }
-    body {
-        font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-        background: var(--space-bg);
-        color: white;
-        min-height: 100vh;
-    }
-    .container { max-width: 1200px; margin: 0 auto; padding: 0 1rem; }
-    .header {
-        background: rgba(10, 5, 25, 0.95);
-        border-bottom: 2px solid var(--purple-deep);
-        padding: 1rem 0;
-        position: sticky;
-        top: 0;
-        z-index: 1000;
-        backdrop-filter: blur(10px);
-    }
-    .navbar {
-        display: flex;
-        justify-content: space-between;
-        align-items: center;
-    }
-    .logo {
-        display: flex;
-        align-items: center;
-        gap: 10px;
-        text-decoration: none;
-        font-size: 1.5rem;
-        font-weight: 800;
-        color: white;
-    }
-    .logo-icon {
-        width: 40px;
-        height: 40px;
-        background: var(--gradient);
-        border-radius: 10px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-size: 1.5rem;
-        font-weight: 900;
-        color: white;
-        animation: pulse 2s infinite;
-    }
-    @keyframes pulse {
-        0%, 100% { box-shadow: 0 0 20px var(--purple-neon); }
-        50% { box-shadow: 0 0 40px var(--purple-neon); }
-    }
-    .auth-container {
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        min-height: 100vh;
-        padding: 2rem;
-        background: var(--space-bg);
-        background-image: 
-            radial-gradient(circle at 20% 80%, rgba(124, 58, 237, 0.15) 0%, transparent 40%),
-            radial-gradient(circle at 80% 20%, rgba(168, 85, 247, 0.1) 0%, transparent 40%);
-    }
-    .auth-card {
-        background: var(--card-bg);
-        border: 2px solid rgba(124, 58, 237, 0.3);
-        border-radius: 20px;
-        padding: 3rem;
-        width: 100%;
-        max-width: 500px;
-        box-shadow: 0 20px 40px rgba(0, 0, 0, 0.3);
-    }
-    .auth-title {
-        text-align: center;
-        margin-bottom: 2rem;
-        font-size: 2rem;
-        background: var(--gradient);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-    }
-    .form-group { margin-bottom: 1.5rem; }
-    .form-control {
-        width: 100%;
-        padding: 1rem;
-        background: rgba(255, 255, 255, 0.05);
-        border: 2px solid rgba(124, 58, 237, 0.3);
-        border-radius: 10px;
-        color: white;
-        font-size: 1rem;
-        transition: 0.3s;
-    }
-    .form-control:focus {
-        outline: none;
-        border-color: var(--purple-neon);
-        box-shadow: 0 0 20px rgba(191, 0, 255, 0.3);
-    }
-    .btn-primary {
-        width: 100%;
-        padding: 1rem;
-        background: var(--gradient);
-        border: none;
-        border-radius: 10px;
-        color: white;
-        font-weight: 600;
-        font-size: 1rem;
-        cursor: pointer;
-        transition: 0.3s;
-    }
-    .btn-primary:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 10px 30px rgba(191, 0, 255, 0.3);
-    }
-    .auth-links {
-        text-align: center;
-        margin-top: 2rem;
-        color: #a855f7;
-    }
-    .auth-link {
-        color: var(--purple-light);
-        text-decoration: none;
-        font-weight: 500;
-    }
-    .auth-link:hover { text-decoration: underline; }
-    .flash-message {
-        padding: 1rem;
-        margin-bottom: 1rem;
-        border-radius: 10px;
-        text-align: center;
-        animation: slideIn 0.3s ease-out;
-    }
-    @keyframes slideIn {
-        from { transform: translateY(-20px); opacity: 0; }
-        to { transform: translateY(0); opacity: 1; }
-    }
-    .flash-success {
-        background: rgba(16, 185, 129, 0.2);
-        border: 1px solid #10b981;
-    }
-    .flash-error {
-        background: rgba(239, 68, 68, 0.2);
-        border: 1px solid #ef4444;
-    }
-    .main-layout {
-        display: grid;
-        grid-template-columns: 250px 1fr 300px;
-        gap: 2rem;
-        padding: 2rem 0;
-    }
-    @media (max-width: 992px) {
-        .main-layout {
-            grid-template-columns: 1fr;
-        }
-    }
-    .card {
-        background: var(--card-bg);
-        border: 2px solid rgba(124, 58, 237, 0.3);
-        border-radius: 15px;
-        padding: 1.5rem;
-        margin-bottom: 1.5rem;
-        backdrop-filter: blur(10px);
-    }
-    .user-avatar {
-        width: 50px;
-        height: 50px;
-        border-radius: 50%;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-weight: bold;
-        font-size: 1.2rem;
-        border: 2px solid var(--purple-light);
-    }
-    .post-editor {
-        width: 100%;
-        min-height: 100px;
-        padding: 1rem;
-        background: rgba(255, 255, 255, 0.05);
-        border: 2px solid rgba(124, 58, 237, 0.3);
-        border-radius: 10px;
-        color: white;
-        margin-bottom: 1rem;
-        resize: vertical;
-    }
-    .btn {
-        padding: 0.8rem 2rem;
-        background: var(--gradient);
-        border: none;
-        border-radius: 10px;
-        color: white;
-        font-weight: 600;
-        cursor: pointer;
-        transition: 0.3s;
-    }
-    .btn:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 5px 20px rgba(191, 0, 255, 0.3);
-    }
-    .nav-icon {
-        width: 40px;
-        height: 40px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        background: rgba(124, 58, 237, 0.1);
-        border: 2px solid rgba(124, 58, 237, 0.3);
-        border-radius: 50%;
-        color: #a855f7;
-        text-decoration: none;
-        transition: 0.3s;
-    }
-    .nav-icon:hover {
-        background: rgba(124, 58, 237, 0.2);
-        transform: translateY(-3px);
-    }
-    .badge {
-        position: absolute;
-        top: -5px;
-        right: -5px;
-        background: var(--gradient);
-        color: white;
-        font-size: 0.7rem;
-        font-weight: bold;
-        min-width: 18px;
-        height: 18px;
-        border-radius: 9px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-    }
-</style>
-'''
-
-LOGIN_HTML = f'''<!DOCTYPE html>
+LOGIN_HTML = '''<!DOCTYPE html>
 <html lang="ru">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>🌌 Netta | Вход в метавселенную</title>
-    {BASE_STYLE}
+    <title>Netta | Вход</title>
+    <style>
+        :root {
+            --purple-neon: #bf00ff;
+            --purple-deep: #7c3aed;
+            --purple-light: #a855f7;
+            --purple-dark: #5b21b6;
+            --space-bg: #0a0a1a;
+            --card-bg: rgba(20, 15, 40, 0.9);
+        }
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body {
+            font-family: 'Segoe UI', sans-serif;
+            background: var(--space-bg);
+            color: white;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            min-height: 100vh;
+            padding: 20px;
+        }
+        .auth-card {
+            background: var(--card-bg);
+            border: 2px solid #7c3aed;
+            border-radius: 20px;
+            padding: 3rem;
+            width: 100%;
+            max-width: 500px;
+        }
+        .logo {
+            display: flex;
+            align-items: center;
+            gap: 10px;
+            font-size: 2rem;
+            font-weight: 800;
+            margin-bottom: 2rem;
+            justify-content: center;
+        }
+        .logo-icon {
+            width: 40px;
+            height: 40px;
+            background: linear-gradient(135deg, #7c3aed, #bf00ff);
+            border-radius: 10px;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            font-size: 1.5rem;
+            font-weight: 900;
+            color: white;
+        }
+        .auth-title {
+            text-align: center;
+            margin-bottom: 2rem;
+            font-size: 1.8rem;
+            background: linear-gradient(45deg, #7c3aed, #a855f7);
+            -webkit-background-clip: text;
+            -webkit-text-fill-color: transparent;
+        }
+        .form-group {
+            margin-bottom: 1.5rem;
+        }
+        .form-control {
+            width: 100%;
+            padding: 1rem;
+            background: rgba(255, 255, 255, 0.05);
+            border: 2px solid rgba(124, 58, 237, 0.3);
+            border-radius: 10px;
+            color: white;
+            font-size: 1rem;
+        }
+        .btn-primary {
+            width: 100%;
+            padding: 1rem;
+            background: linear-gradient(135deg, #7c3aed, #5b21b6);
+            border: none;
+            border-radius: 10px;
+            color: white;
+            font-weight: 600;
+            font-size: 1rem;
+            cursor: pointer;
+        }
+        .auth-switch {
+            text-align: center;
+            margin-top: 2rem;
+            color: #d1d5db;
+        }
+        .auth-link {
+            color: #a855f7;
+            text-decoration: none;
+        }
+        .flash-message {
+            padding: 1rem;
+            margin-bottom: 1rem;
+            border-radius: 10px;
+            text-align: center;
+        }
+        .flash-success {
+            background: rgba(16, 185, 129, 0.2);
+            border: 1px solid #10b981;
+        }
+        .flash-error {
+            background: rgba(239, 68, 68, 0.2);
+            border: 1px solid #ef4444;
+        }
+    </style>
 </head>
 <body>
-    <div class="auth-container">
-        <div class="auth-card">
-            <div style="text-align: center; margin-bottom: 2rem;">
-                <div class="logo" style="justify-content: center;">
-                    <div class="logo-icon">N</div>
-                    <div style="font-size: 2rem; font-weight: 900; background: linear-gradient(45deg, #a855f7, #ffffff); -webkit-background-clip: text; -webkit-text-fill-color: transparent;">etta</div>
-                </div>
-            </div>
-            
-            <h1 class="auth-title">ВОЙТИ В МЕТАВСЕЛЕННУЮ</h1>
-            
-            {% with messages = get_flashed_messages(with_categories=true) %}
-                {% if messages %}
-                    {% for category, message in messages %}
-                        <div class="flash-message flash-{{ category }}">
-                            {{ message }}
-                        </div>
-                    {% endfor %}
-                {% endif %}
-            {% endwith %}
-            
-            <form method="POST" action="/login">
-                <div class="form-group">
-                    <input type="text" name="username" class="form-control" required placeholder="👤 Имя пользователя или Email">
-                </div>
-                
-                <div class="form-group">
-                    <input type="password" name="password" class="form-control" required placeholder="🔒 Пароль">
-                </div>
-                
-                <button type="submit" class="btn-primary">
-                    🚀 ПРОДОЛЖИТЬ ПУТЕШЕСТВИЕ
-                </button>
-            </form>
+    <div class="auth-card">
+        <div class="logo">
+            <div class="logo-icon">N</div>
+            <span>Netta</span>
+        </div>
+        
+        <h1 class="auth-title">ВОЙТИ В NETTA</h1>
+        
+        {% with messages = get_flashed_messages(with_categories=true) %}
+            {% if messages %}
+                {% for category, message in messages %}
+                    <div class="flash-message flash-{{ category }}">
+                        {{ message }}
+                    </div>
+                {% endfor %}
+            {% endif %}
+        {% endwith %}
+        
+        <form method="POST" action="/login">
+            <div class="form-group">
+                <input type="text" name="username" class="form-control" required placeholder="👤 Имя пользователя или Email">
+            </div>
             
-            <div class="auth-links">
-                Еще нет аккаунта? <a href="/register" class="auth-link">✨ СОЗДАТЬ АККАУНТ</a>
+            <div class="form-group">
+                <input type="password" name="password" class="form-control" required placeholder="🔒 Пароль">
             </div>
+            
+            <button type="submit" class="btn-primary">🚀 ВОЙТИ</button>
+        </form>
+        
+        <div class="auth-switch">
+            Нет аккаунта? <a href="/register" class="auth-link">Создать</a>
         </div>
     </div>
 </body>
 </html>'''
 
-REGISTER_HTML = f'''<!DOCTYPE html>
+REGISTER_HTML = '''<!DOCTYPE html>
 <html lang="ru">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>🌌 Netta | Стать частью вселенной</title>
-    {BASE_STYLE}
+    <title>Netta | Регистрация</title>
+    <style>
+        :root {
+            --purple-neon: #bf00ff;
+            --purple-deep: #7c3aed;
+            --purple-light: #a855f7;
+            --purple-dark: #5b21b6;
+            --space-bg: #0a0a1a;
+            --card-bg: rgba(20, 15, 40, 0.9);
+        }
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body {
+            font-family: 'Segoe UI', sans-serif;
+            background: var(--space-bg);
+            color: white;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            min-height: 100vh;
+            padding: 20px;
+        }
+        .auth-card {
+            background: var(--card-bg);
+            border: 2px solid #7c3aed;
+            border-radius: 20px;
+            padding: 3rem;
+            width: 100%;
+            max-width: 500px;
+        }
+        .logo {
+            display: flex;
+            align-items: center;
+            gap: 10px;
+            font-size: 2rem;
+            font-weight: 800;
+            margin-bottom: 2rem;
+            justify-content: center;
+        }
+        .logo-icon {
+            width: 40px;
+            height: 40px;
+            background: linear-gradient(135deg, #7c3aed, #bf00ff);
+            border-radius: 10px;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            font-size: 1.5rem;
+            font-weight: 900;
+            color: white;
+        }
+        .auth-title {
+            text-align: center;
+            margin-bottom: 2rem;
+            font-size: 1.8rem;
+            background: linear-gradient(45deg, #7c3aed, #a855f7);
+            -webkit-background-clip: text;
+            -webkit-text-fill-color: transparent;
+        }
+        .form-group {
+            margin-bottom: 1.5rem;
+        }
+        .form-control {
+            width: 100%;
+            padding: 1rem;
+            background: rgba(255, 255, 255, 0.05);
+            border: 2px solid rgba(124, 58, 237, 0.3);
+            border-radius: 10px;
+            color: white;
+            font-size: 1rem;
+        }
+        .btn-primary {
+            width: 100%;
+            padding: 1rem;
+            background: linear-gradient(135deg, #7c3aed, #5b21b6);
+            border: none;
+            border-radius: 10px;
+            color: white;
+            font-weight: 600;
+            font-size: 1rem;
+            cursor: pointer;
+        }
+        .auth-switch {
+            text-align: center;
+            margin-top: 2rem;
+            color: #d1d5db;
+        }
+        .auth-link {
+            color: #a855f7;
+            text-decoration: none;
+        }
+        .flash-message {
+            padding: 1rem;
+            margin-bottom: 1rem;
+            border-radius: 10px;
+            text-align: center;
+        }
+        .flash-success {
+            background: rgba(16, 185, 129, 0.2);
+            border: 1px solid #10b981;
+        }
+        .flash-error {
+            background: rgba(239, 68, 68, 0.2);
+            border: 1px solid #ef4444;
+        }
+    </style>
 </head>
 <body>
-    <div class="auth-container">
-        <div class="auth-card">
-            <div style="text-align: center; margin-bottom: 2rem;">
-                <div class="logo" style="justify-content: center;">
-                    <div class="logo-icon">N</div>
-                    <div style="font-size: 2rem; font-weight: 900; background: linear-gradient(45deg, #a855f7, #ffffff); -webkit-background-clip: text; -webkit-text-fill-color: transparent;">etta</div>
-                </div>
+    <div class="auth-card">
+        <div class="logo">
+            <div class="logo-icon">N</div>
+            <span>Netta</span>
+        </div>
+        
+        <h1 class="auth-title">СОЗДАТЬ АККАУНТ</h1>
+        
+        {% with messages = get_flashed_messages(with_categories=true) %}
+            {% if messages %}
+                {% for category, message in messages %}
+                    <div class="flash-message flash-{{ category }}">
+                        {{ message }}
+                    </div>
+                {% endfor %}
+            {% endif %}
+        {% endwith %}
+        
+        <form method="POST" action="/register">
+            <div class="form-group">
+                <input type="text" name="username" class="form-control" required placeholder="👤 Имя пользователя">
             </div>
             
-            <h1 class="auth-title">СТАТЬ ЧАСТЬЮ ВСЕЛЕННОЙ</h1>
+            <div class="form-group">
+                <input type="email" name="email" class="form-control" required placeholder="📧 Email адрес">
+            </div>
             
-            {% with messages = get_flashed_messages(with_categories=true) %}
-                {% if messages %}
-                    {% for category, message in messages %}
-                        <div class="flash-message flash-{{ category }}">
-                            {{ message }}
-                        </div>
-                    {% endfor %}
-                {% endif %}
-            {% endwith %}
+            <div class="form-group">
+                <input type="password" name="password" class="form-control" required placeholder="🔒 Пароль">
+            </div>
             
-            <form method="POST" action="/register">
-                <div class="form-group">
-                    <input type="text" name="username" class="form-control" required placeholder="👤 Имя пользователя">
-                </div>
-                
-                <div class="form-group">
-                    <input type="email" name="email" class="form-control" required placeholder="📧 Email адрес">
-                </div>
-                
-                <div class="form-group">
-                    <input type="password" name="password" class="form-control" required placeholder="🔒 Пароль">
-                </div>
-                
-                <div class="form-group">
-                    <input type="password" name="confirm_password" class="form-control" required placeholder="🔁 Подтвердите пароль">
-                </div>
-                
-                <div class="form-group">
-                    <input type="text" name="full_name" class="form-control" placeholder="🌟 Ваше имя (необязательно)">
-                </div>
-                
-                <button type="submit" class="btn-primary">
-                    🪐 СОЗДАТЬ ПРОСТРАНСТВО
-                </button>
-            </form>
+            <div class="form-group">
+                <input type="password" name="confirm_password" class="form-control" required placeholder="🔁 Подтвердите пароль">
+            </div>
             
-            <div class="auth-links">
-                Уже есть аккаунт? <a href="/login" class="auth-link">← ВЕРНУТЬСЯ К ВХОДУ</a>
+            <div class="form-group">
+                <input type="text" name="full_name" class="form-control" placeholder="🌟 Ваше имя (необязательно)">
             </div>
+            
+            <button type="submit" class="btn-primary">🚀 СОЗДАТЬ АККАУНТ</button>
+        </form>
+        
+        <div class="auth-switch">
+            Уже есть аккаунт? <a href="/login" class="auth-link">Войти</a>
         </div>
     </div>
 </body>
 </html>'''
 
-# ============ МАРШРУТЫ ============
-@app.route('/')
-def index():
-    if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
-        
-        # Получаем посты
-        posts = Post.query.order_by(Post.created_at.desc()).limit(20).all()
-        
-        # Получаем лайки пользователя
-        liked_posts = [like.post_id for like in current_user.user_likes]
-        
-        # Генерируем HTML для постов
-        posts_html = ''
-        for post in posts:
-            is_liked = post.id in liked_posts
-            posts_html += f'''
-            <div class="card" style="transition: 0.3s;" onmouseover="this.style.borderColor='var(--purple-neon)';" onmouseout="this.style.borderColor='rgba(124, 58, 237, 0.3)';">
-                <div style="display: flex; align-items: center; margin-bottom: 1rem;">
-                    <div class="user-avatar" style="background: {post.author.avatar_color}; margin-right: 1rem;">
-                        {post.author.username[0].upper()}
-                    </div>
-                    <div>
-                        <div style="font-weight: bold; display: flex; align-items: center; gap: 0.5rem;">
-                            {post.author.full_name or post.author.username}
-                            <span style="background: var(--gradient); color: white; padding: 0.2rem 0.6rem; border-radius: 10px; font-size: 0.8rem;">
-                                Ур. {post.author.level}
-                            </span>
-                        </div>
-                        <div style="color: #9ca3af; font-size: 0.9rem;">
-                            {post.created_at.strftime('%d %b в %H:%M')}
-                        </div>
-                    </div>
-                </div>
-                
-                <div style="margin-bottom: 1rem; line-height: 1.6;">
-                    {post.content}
-                </div>
-                
-                <div style="display: flex; gap: 2rem; color: #9ca3af;">
-                    <form method="POST" action="/like/{post.id}" style="display: inline;">
-                        <button type="submit" style="background: none; border: none; color: {'var(--purple-neon)' if is_liked else 'inherit'}; cursor: pointer; display: flex; align-items: center; gap: 0.5rem;">
-                            <i class="fas fa-heart"></i> {post.likes_count}
-                        </button>
-                    </form>
-                    <span style="display: flex; align-items: center; gap: 0.5rem;">
-                        <i class="fas fa-comment"></i> {post.comments_count}
-                    </span>
-                </div>
-            </div>
-            '''
-        
-        # Возвращаем полную HTML страницу
-        return f'''
-        <!DOCTYPE html>
-        <html lang="ru">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>🌌 Netta | Космическая лента</title>
-            {BASE_STYLE}
-            <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-        </head>
-        <body>
-            <!-- ШАПКА -->
-            <header class="header">
-                <div class="container">
-                    <nav class="navbar">
-                        <a href="/" class="logo">
-                            <div class="logo-icon">N</div>
-                            <div style="font-size: 1.5rem; font-weight: 900; background: linear-gradient(45deg, #a855f7, #ffffff); -webkit-background-clip: text; -webkit-text-fill-color: transparent;">etta</div>
-                        </a>
-                        
-                        <div style="display: flex; gap: 1rem; align-items: center;">
-                            <a href="#" class="nav-icon" title="Уведомления" style="position: relative;">
-                                <i class="fas fa-bell"></i>
-                                <span class="badge">3</span>
-                            </a>
-                            
-                            <a href="#" class="nav-icon" title="Сообщения" style="position: relative;">
-                                <i class="fas fa-comments"></i>
-                                <span class="badge">5</span>
-                            </a>
-                            
-                            <a href="/logout" class="nav-icon" title="Выйти">
-                                <i class="fas fa-sign-out-alt"></i>
-                            </a>
-                        </div>
-                    </nav>
-                </div>
-            </header>
-            
-            <!-- ОСНОВНОЙ КОНТЕНТ -->
-            <main class="container">
-                <div class="main-layout">
-                    <!-- ЛЕВЫЙ САЙДБАР -->
-                    <aside>
-                        <div class="card">
-                            <div style="text-align: center;">
-                                <div class="user-avatar" style="margin: 0 auto 1rem; background: {current_user.avatar_color}; width: 80px; height: 80px; font-size: 2rem;">
-                                    {current_user.username[0].upper()}
-                                </div>
-                                <h3 style="margin-bottom: 0.5rem;">{current_user.full_name or current_user.username}</h3>
-                                <p style="color: var(--purple-light); margin-bottom: 1rem;">@{current_user.username}</p>
-                                
-                                <div style="display: flex; justify-content: center; gap: 1rem; margin-bottom: 1rem;">
-                                    <div style="text-align: center;">
-                                        <div style="font-size: 1.2rem; font-weight: bold;">{current_user.posts_count}</div>
-                                        <div style="font-size: 0.8rem; color: #9ca3af;">Постов</div>
-                                    </div>
-                                    <div style="text-align: center;">
-                                        <div style="font-size: 1.2rem; font-weight: bold;">{current_user.friends_count}</div>
-                                        <div style="font-size: 0.8rem; color: #9ca3af;">Друзей</div>
-                                    </div>
-                                    <div style="text-align: center;">
-                                        <div style="font-size: 1.2rem; font-weight: bold;">{current_user.level}</div>
-                                        <div style="font-size: 0.8rem; color: #9ca3af;">Уровень</div>
-                                    </div>
-                                </div>
-                            </div>
-                        </div>
-                        
-                        <div class="card">
-                            <h3 style="margin-bottom: 1rem; color: var(--purple-light);">
-                                <i class="fas fa-rocket"></i> Навигация
-                            </h3>
-                            <div style="display: flex; flex-direction: column; gap: 0.5rem;">
-                                <a href="#" style="color: white; text-decoration: none; padding: 0.8rem; border-radius: 10px; transition: 0.3s;" onmouseover="this.style.background='rgba(124, 58, 237, 0.1)';" onmouseout="this.style.background='transparent';">
-                                    <i class="fas fa-compass"></i> Исследовать
-                                </a>
-                                <a href="#" style="color: white; text-decoration: none; padding: 0.8rem; border-radius: 10px; transition: 0.3s;" onmouseover="this.style.background='rgba(124, 58, 237, 0.1)';" onmouseout="this.style.background='transparent';">
-                                    <i class="fas fa-users"></i> Сообщества
-                                </a>
-                                <a href="#" style="color: white; text-decoration: none; padding: 0.8rem; border-radius: 10px; transition: 0.3s;" onmouseover="this.style.background='rgba(124, 58, 237, 0.1)';" onmouseout="this.style.background='transparent';">
-                                    <i class="fas fa-gamepad"></i> Игры
-                                </a>
-                                <a href="#" style="color: white; text-decoration: none; padding: 0.8rem; border-radius: 10px; transition: 0.3s;" onmouseover="this.style.background='rgba(124, 58, 237, 0.1)';" onmouseout="this.style.background='transparent';">
-                                    <i class="fas fa-cog"></i> Настройки
-                                </a>
-                            </div>
-                        </div>
-                    </aside>
-                    
-                    <!-- ЦЕНТРАЛЬНАЯ ЛЕНТА -->
-                    <section>
-                        <!-- СОЗДАНИЕ ПОСТА -->
-                        <div class="card">
-                            <form method="POST" action="/create_post">
-                                <div style="display: flex; align-items: center; margin-bottom: 1rem;">
-                                    <div class="user-avatar" style="background: {current_user.avatar_color}; margin-right: 1rem;">
-                                        {current_user.username[0].upper()}
-                                    </div>
-                                    <div>
-                                        <div style="font-weight: bold;">{current_user.full_name or current_user.username}</div>
-                                        <select style="background: rgba(255, 255, 255, 0.05); border: 1px solid rgba(124, 58, 237, 0.3); color: white; padding: 0.3rem; border-radius: 5px; font-size: 0.8rem;">
-                                            <option>🌍 Публичный</option>
-                                            <option>👥 Только друзья</option>
-                                            <option>🔒 Только я</option>
-                                        </select>
-                                    </div>
-                                </div>
-                                
-                                <textarea name="content" class="post-editor" placeholder="🌌 Что происходит в вашей вселенной, {current_user.username}?"></textarea>
-                                
-                                <div style="display: flex; justify-content: space-between; align-items: center;">
-                                    <div style="display: flex; gap: 1rem;">
-                                        <button type="button" style="background: none; border: none; color: #a855f7; font-size: 1.2rem; cursor: pointer;" title="Добавить фото">
-                                            <i class="fas fa-image"></i>
-                                        </button>
-                                        <button type="button" style="background: none; border: none; color: #a855f7; font-size: 1.2rem; cursor: pointer;" title="Добавить видео">
-                                            <i class="fas fa-video"></i>
-                                        </button>
-                                        <button type="button" style="background: none; border: none; color: #a855f7; font-size: 1.2rem; cursor: pointer;" title="Добавить эмоцию">
-                                            <i class="fas fa-smile"></i>
-                                        </button>
-                                    </div>
-                                    <button type="submit" class="btn">
-                                        <i class="fas fa-paper-plane"></i> Опубликовать
-                                    </button>
-                                </div>
-                            </form>
-                        </div>
-                        
-                        <!-- ПОСТЫ -->
-                        {posts_html}
-                    </section>
-                    
-                    <!-- ПРАВАЯ КОЛОНКА -->
-                    <aside>
-                        <!-- ОНЛАЙН ДРУЗЬЯ -->
-                        <div class="card">
-                            <h3 style="margin-bottom: 1rem; color: var(--purple-light);">
-                                <i class="fas fa-satellite"></i> В сети сейчас
-                            </h3>
-                            <div style="display: flex; flex-direction: column; gap: 0.8rem;">
-                                <div style="display: flex; align-items: center; gap: 0.8rem; padding: 0.5rem; border-radius: 10px; transition: 0.3s;" onmouseover="this.style.background='rgba(124, 58, 237, 0.1)';" onmouseout="this.style.background='transparent';">
-                                    <div class="user-avatar" style="background: #a855f7; width: 40px; height: 40px; border: 2px solid #10b981;">
-                                        C
-                                    </div>
-                                    <div>
-                                        <div style="font-weight: bold;">Космонавт</div>
-                                        <div style="font-size: 0.8rem; color: #10b981;">
-                                            <i class="fas fa-circle" style="font-size: 0.6rem;"></i> Онлайн
-                                        </div>
-                                    </div>
-                                </div>
-                                <div style="display: flex; align-items: center; gap: 0.8rem; padding: 0.5rem; border-radius: 10px; transition: 0.3s;" onmouseover="this.style.background='rgba(124, 58, 237, 0.1)';" onmouseout="this.style.background='transparent';">
-                                    <div class="user-avatar" style="background: #7c3aed; width: 40px; height: 40px; border: 2px solid #10b981;">
-                                        З
-                                    </div>
-                                    <div>
-                                        <div style="font-weight: bold;">Звездочёт</div>
-                                        <div style="font-size: 0.8rem; color: #10b981;">
-                                            <i class="fas fa-circle" style="font-size: 0.6rem;"></i> Онлайн
-                                        </div>
-                                    </div>
-                                </div>
-                            </div>
-                        </div>
-                        
-                        <!-- ТРЕНДЫ -->
-                        <div class="card">
-                            <h3 style="margin-bottom: 1rem; color: var(--purple-light);">
-                                <i class="fas fa-fire"></i> Тренды вселенной
-                            </h3>
-                            <div style="display: flex; flex-direction: column; gap: 0.8rem;">
-                                <div style="padding: 0.8rem; background: rgba(255, 255, 255, 0.03); border-radius: 10px; transition: 0.3s;" onmouseover="this.style.background='rgba(124, 58, 237, 0.1)';">
-                                    <div style="font-weight: bold; color: var(--purple-light);">#NettaLaunch</div>
-                                    <div style="font-size: 0.9rem; color: #9ca3af;">1.2K постов</div>
-                                </div>
-                                <div style="padding: 0.8rem; background: rgba(255, 255, 255, 0.03); border-radius: 10px; transition: 0.3s;" onmouseover="this.style.background='rgba(124, 58, 237, 0.1)';">
-                                    <div style="font-weight: bold; color: var(--purple-light);">#ФиолетоваяВселенная</div>
-                                    <div style="font-size: 0.9rem; color: #9ca3af;">856 постов</div>
-                                </div>
-                            </div>
-                        </div>
-                    </aside>
-                </div>
-            </main>
-            
-            <!-- ФУТЕР -->
-            <footer style="text-align: center; padding: 2rem; color: rgba(255, 255, 255, 0.5); border-top: 1px solid rgba(124, 58, 237, 0.2);">
-                <div style="max-width: 1200px; margin: 0 auto;">
-                    <div style="margin-bottom: 1rem;">
-                        <span style="color: var(--purple-light); font-weight: bold;">Netta</span> 
-                        — Социальная сеть нового поколения 🌌
-                    </div>
-                    <div style="font-size: 0.9rem;">
-                        © 2026 Netta Universe. Все права защищены.
-                    </div>
-                </div>
-            </footer>
-            
-            <script>
-                // Анимация лайков
-                document.addEventListener('DOMContentLoaded', function() {{
-                    document.querySelectorAll('form[action^="/like/"] button').forEach(button => {{
-                        button.addEventListener('click', function(e) {{
-                            setTimeout(() => {{
-                                const heart = document.createElement('div');
-                                heart.innerHTML = '❤️';
-                                heart.style.position = 'fixed';
-                                heart.style.fontSize = '2rem';
-                                heart.style.color = '#bf00ff';
-                                heart.style.zIndex = '10000';
-                                heart.style.pointerEvents = 'none';
-                                
-                                const rect = button.getBoundingClientRect();
-                                heart.style.left = (rect.left + rect.width/2 - 16) + 'px';
-                                heart.style.top = (rect.top - 32) + 'px';
-                                
-                                document.body.appendChild(heart);
-                                
-                                heart.animate([
-                                    {{ transform: 'translateY(0) scale(1)', opacity: 1 }},
-                                    {{ transform: 'translateY(-100px) scale(1.5)', opacity: 0 }}
-                                ], {{
-                                    duration: 800,
-                                    easing: 'cubic-bezier(0.4, 0, 0.2, 1)'
-                                }}).onfinish = () => heart.remove();
-                            }}, 100);
-                        }});
-                    }});
-                }});
-            </script>
-        </body>
-        </html>
-        '''
-    
-    return LOGIN_HTML
-
-@app.route('/login', methods=['GET', 'POST'])
-def login():
+INDEX_HTML = '''<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Netta | Главная</title>
+    <style>
+        :root {
+            --purple-neon: #bf00ff;
+            --purple-deep: #7c3aed;
+            --purple-light: #a855f7;
+            --purple-dark: #5b21b6;
+            --space-bg: #0a0a1a;
+            --card-bg: rgba(20, 15, 40, 0.9);
+        }
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body {
+            font-family: 'Segoe UI', sans-serif;
+            background: var(--space-bg);
+            color: white;
+        }
+        .header {
+            background: rgba(10, 5, 25, 0.95);
+            border-bottom: 2px solid #7c3aed;
+            padding: 1rem 0;
+        }
+        .container {
+            max-width: 1200px;
+            margin: 0 auto;
+            padding: 0 1rem;
+        }
+        .navbar {
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+        }
+        .logo {
+            display: flex;
+            align-items: center;
+            gap: 10px;
+            font-size: 1.5rem;
+            font-weight: 800;
+            color: white;
+            text-decoration: none;
+        }
+        .logo-icon {
+            width: 40px;
+            height: 40px;
+            background: linear-gradient(135deg, #7c3aed, #bf00ff);
+            border-radius: 10px;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            font-size: 1.5rem;
+            font-weight: 900;
+            color: white;
+        }
+        .main-layout {
+            display: grid;
+            grid-template-columns: 250px 1fr 300px;
+            gap: 2rem;
+            padding: 2rem 0;
+        }
+        .card {
+            background: var(--card-bg);
+            border: 2px solid rgba(124, 58, 237, 0.3);
+            border-radius: 15px;
+            padding: 1.5rem;
+            margin-bottom: 1.5rem;
+        }
+        .post-content a, .hashtag, .mention {
+            color: #a855f7;
+            text-decoration: none;
+            word-break: break-word;
+        }
+        .post-editor {
+            width: 100%;
+            min-height: 100px;
+            padding: 1rem;
+            background: rgba(255, 255, 255, 0.05);
+            border: 2px solid rgba(124, 58, 237, 0.3);
+            border-radius: 10px;
+            color: white;
+            margin-bottom: 1rem;
+        }
+        .btn {
+            padding: 0.8rem 2rem;
+            background: linear-gradient(135deg, #7c3aed, #5b21b6);
+            border: none;
+            border-radius: 10px;
+            color: white;
+            font-weight: 600;
+            cursor: pointer;
+        }
+        .user-avatar {
+            width: 50px;
+            height: 50px;
+            border-radius: 50%;
+            background: {{ current_user.avatar_color }};
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            font-weight: bold;
+            font-size: 1.2rem;
+        }
+    </style>
+</head>
+<body>
+    <header class="header">
+        <div class="container">
+            <nav class="navbar">
+                <a href="/" class="logo">
+                    <div class="logo-icon">N</div>
+                    <span>Netta</span>
+                </a>
+                <div>
+                    <a href="/logout" style="color: #a855f7; text-decoration: none;">Выйти</a>
+                </div>
+            </nav>
+        </div>
+    </header>
+
+    <main class="container">
+        <div class="main-layout">
+            <aside>
+                <div class="card">
+                    <div style="text-align: center;">
+                        <div class="user-avatar" style="margin: 0 auto 1rem;">
+                            {{ current_user.username[0]|upper }}
+                        </div>
+                        <h3>{{ current_user.full_name or current_user.username }}</h3>
+                        <p style="color: #a855f7;">@{{ current_user.username }}</p>
+                        <p>Уровень: {{ current_user.level }}</p>
+                        <p>Монеты: {{ current_user.coins }}</p>
+                        <p><a href="/leaderboard" style="color: #a855f7;">🏆 Рейтинг</a></p>
+                    </div>
+                </div>
+            </aside>
+
+            <section>
+                <div class="card">
+                    <form method="POST" action="/create_post" enctype="multipart/form-data">
+                        <textarea name="content" class="post-editor" placeholder="Что нового?"></textarea>
+                        <input type="file" name="media" accept="image/*,video/mp4,video/webm" style="margin-bottom: 1rem; color: #a855f7;">
+                        <select name="privacy" style="background: rgba(255, 255, 255, 0.05); border: 1px solid rgba(124, 58, 237, 0.3); color: white; padding: 0.3rem; border-radius: 5px; margin-bottom: 1rem;">
+                            <option value="public">🌍 Публичный</option>
+                            <option value="friends">👥 Только друзья</option>
+                            <option value="private">🔒 Только я</option>
+                        </select>
+                        <textarea name="poll_options" class="post-editor" style="min-height: 60px;" placeholder="Опрос: варианты ответа, по одному на строку (необязательно)"></textarea>
+                        <button type="submit" class="btn">Опубликовать</button>
+                    </form>
+                </div>
+
+                <div class="card" style="display: flex; gap: 1.5rem;">
+                    {% for value, label in (('new', '🕒 Новое'), ('hot', '🔥 Горячее')) %}
+                    <a href="{{ '/?tab=hot' if value == 'hot' else '/' }}" style="color: {{ '#bf00ff' if tab == value else '#a855f7' }}; text-decoration: none; font-weight: {{ 'bold' if tab == value else 'normal' }};">{{ label }}</a>
+                    {% endfor %}
+                </div>
+
+                {{ posts_html|safe }}
+            </section>
+
+            <aside>
+                {{ suggestions_html|safe }}
+                <div class="card">
+                    <h3>Онлайн сейчас</h3>
+                    <p>Друзья в сети скоро здесь</p>
+                </div>
+                <div class="card">
+                    <h3>Тренды</h3>
+                    <p>#NettaLaunch</p>
+                    <p>#ФиолетоваяВселенная</p>
+                </div>
+            </aside>
+        </div>
+    </main>
+</body>
+</html>'''
+
+# ============ СТРАНИЦЫ ============
+PAGES = {'login': LOGIN_HTML, 'register': REGISTER_HTML, 'index': INDEX_HTML}
+# Страницы без пользовательских данных: без флеш-сообщений отдаются один раз отрисованными
+STATIC_PAGES = ('login', 'register')
+_page_templates = {}
+_prerendered_pages = {}
+
+def page_template(name):
+    # Компиляция шаблона один раз на процесс (при --preload — один раз в мастере)
+    template = _page_templates.get(name)
+    if template is None:
+        template = _page_templates[name] = app.jinja_env.from_string(PAGES[name])
+    return template
+
+def render_page(name, **context):
+    static = name in STATIC_PAGES and not session.get('_flashes')
+    if static and name in _prerendered_pages:
+        return _prerendered_pages[name]
+    
+    app.update_template_context(context)
+    html = page_template(name).render(context)
+    if static:
+        _prerendered_pages[name] = html
+    return html
+
+@app.route('/')
+def index():
+    if current_user.is_authenticated:
+        # last_seen пишем не чаще раза в минуту, чтобы просмотр ленты обычно оставался только чтением
+        if not current_user.last_seen or (datetime.utcnow() - current_user.last_seen).total_seconds() > LAST_SEEN_RESOLUTION:
+            current_user.last_seen = datetime.utcnow()
+            db.session.commit()
+        
+        # «Горячее» — чтение диапазона по индексу hot_score, без подсчёта баллов на запрос
+        tab = 'hot' if request.args.get('tab') == 'hot' else 'new'
+        if tab == 'hot':
+            posts = feed_query(current_user.id, limit=10, order='hot').all()
+        else:
+            posts = home_feed(current_user.id, limit=10)
+        liked_posts = liked_post_ids(current_user.id, [post.id for post in posts])
+        view_counter.record([post.id for post in posts], current_user.id)
+        polls = load_polls([post.id for post in posts], current_user.id)
+        
+        posts_html = ''.join([f'''
+                        <div class="card">
+                            <div style="display: flex; align-items: center; margin-bottom: 1rem;">
+                                <div class="user-avatar" style="background: {post.author.avatar_color}; margin-right: 1rem;">
+                                    {escape(post.author.username[0].upper())}
+                                </div>
+                                <div>
+                                    <div style="font-weight: bold;">{escape(post.author.full_name or post.author.username)}</div>
+                                    <div style="color: #9ca3af; font-size: 0.9rem;">
+                                        {post.created_at.strftime('%d %b в %H:%M')}
+                                    </div>
+                                </div>
+                            </div>
+                            <div class="post-content" style="margin-bottom: 1rem;">
+                                {post_html(post)}
+                            </div>
+                            {media_html(post)}
+                            {poll_html(post.id, polls)}
+                            <div>
+                                <form method="POST" action="/like/{post.id}" style="display: inline;">
+                                    <button type="submit" style="background: none; border: none; color: {'#bf00ff' if post.id in liked_posts else 'white'}; cursor: pointer;">
+                                        ❤️ {post.likes_count}
+                                    </button>
+                                </form>
+                                <span style="margin-left: 1rem;">💬 {post.comments_count}</span>
+                                <span style="margin-left: 1rem;">👁 {post.views_count or 0}</span>
+                            </div>
+                        </div>
+                        ''' for post in posts])
+        return render_page('index', posts_html=posts_html, suggestions_html=friend_suggestions_html(current_user.id), tab=tab)
+    
+    return render_page('login')
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
     if current_user.is_authenticated:
         return redirect('/')
     
     if request.method == 'POST':
-        username = request.form.get('username', '')
-        password = request.form.get('password', '')
+        username = request.form['username']
+        password = request.form['password']
         
         user = User.query.filter((User.username == username) | (User.email == username)).first()
         
@@ -724,12 +965,12 @@ def login():
             user.last_seen = datetime.utcnow()
             db.session.commit()
             login_user(user)
-            flash('Добро пожаловать в метавселенную Netta! 🌌', 'success')
+            flash('Добро пожаловать в Netta!', 'success')
             return redirect('/')
         else:
-            flash('Неверные данные. Попробуйте снова.', 'error')
+            flash('Неверный логин или пароль', 'error')
     
-    return LOGIN_HTML
+    return render_page('login')
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -737,915 +978,3671 @@ def register():
         return redirect('/')
     
     if request.method == 'POST':
-        username = request.form.get('username', '')
-        email = request.form.get('email', '')
-        password = request.form.get('password', '')
-        confirm_password = request.form.get('confirm_password', '')
+        username = request.form['username']
+        email = request.form['email']
+        password = request.form['password']
+        confirm_password = request.form['confirm_password']
         full_name = request.form.get('full_name', '')
         
-        # Валидация
-        if not username or not email or not password:
-            flash('Заполните все обязательные поля', 'error')
-            return REGISTER_HTML
-        
         if password != confirm_password:
             flash('Пароли не совпадают', 'error')
-            return REGISTER_HTML
+            return render_page('register')
         
         if User.query.filter_by(username=username).first():
-            flash('Это имя пользователя уже занято', 'error')
-            return REGISTER_HTML
+            flash('Имя пользователя уже занято', 'error')
+            return render_page('register')
         
         if User.query.filter_by(email=email).first():
-            flash('Этот email уже используется', 'error')
-            return REGISTER_HTML
-        
-        if len(password) < 6:
-            flash('Пароль должен быть минимум 6 символов', 'error')
-            return REGISTER_HTML
+            flash('Email уже используется', 'error')
+            return render_page('register')
         
-        # Создание пользователя
         colors = ['#7c3aed', '#a855f7', '#bf00ff', '#5b21b6', '#8b5cf6']
         
         user = User(
             username=username,
             email=email,
             full_name=full_name,
-            avatar_color=random.choice(colors)
+            avatar_color=random.choice(colors),
+            cover_color=random.choice(colors)
         )
         user.set_password(password)
         
-        try:
-            db.session.add(user)
-            db.session.commit()
-            flash('Ваше пространство создано! Добро пожаловать в Netta! 🚀', 'success')
-            return redirect('/login')
-        except Exception as e:
-            db.session.rollback()
-            flash('Ошибка при создании аккаунта. Попробуйте снова.', 'error')
+        db.session.add(user)
+        db.session.commit()
+        update_leaderboards([user])
+        username_index.add(user)
+        
+        flash('Аккаунт создан! Войдите в систему', 'success')
+        return redirect('/login')
     
-    return REGISTER_HTML
+    return render_page('register')
 
 @app.route('/logout')
 @login_required
 def logout():
     logout_user()
-    flash('Вы покинули вселенную Netta. Возвращайтесь скорее! 👋', 'success')
+    flash('Вы вышли из системы', 'success')
     return redirect('/login')
 
+def publish_post(user, content, privacy='public', poll_options=(), upload=None, media_url='', coordinates=None, location=''):
+    if privacy not in PRIVACY_LEVELS:
+        privacy = 'public'
+    
+    post = Post(
+        content=content,
+        content_html=render_content(content),
+        content_html_version=CONTENT_RENDERER_VERSION,
+        user_id=user.id,
+        privacy=privacy,
+        location=location.strip()[:200] or None
+    )
+    if coordinates:
+        post.latitude, post.longitude = coordinates
+        post.geohash = geohash_encode(*coordinates)
+        post.geohash_cell = post.geohash[:GEOHASH_CELL_PRECISION]
+    attach_media(post, upload, media_url)
+    db.session.add(post)
+    if len(poll_options) >= 2:
+        db.session.flush()
+        create_poll(post.id, poll_options)
+    
+    mentioned = username_index.resolve(extract_mentions(content))
+    if mentioned:
+        db.session.flush()
+        job_queue.enqueue('mentions', {
+            'post_id': post.id,
+            'author_id': user.id,
+            'author': user.username,
+            'privacy': privacy,
+            'user_ids': sorted(set(mentioned.values())),
+        })
+    if post.media_type == 'image':
+        db.session.flush()
+        job_queue.enqueue('media_variants', {'post_id': post.id})
+    job_queue.enqueue('user_counters', {'user_id': user.id})
+    db.session.commit()
+    if post.privacy == 'public':
+        hot_feed.invalidate()
+    job_queue.notify()
+    return post
+
+def toggle_like(post, user):
+    existing_like = Like.query.filter_by(user_id=user.id, post_id=post.id).first()
+    
+    # В запросе — только сам лайк; счётчик, опыт и уведомление делают фоновые задачи
+    if existing_like:
+        db.session.delete(existing_like)
+        liked = False
+    else:
+        db.session.add(Like(user_id=user.id, post_id=post.id))
+        # Опыт за лайк — один раз на пару (пользователь, пост): снять и поставить лайк снова не выгодно
+        award(user.id, xp=5, reason='like', reference_id=post.id, key=f'like-xp:{user.id}:{post.id}')
+        if post.user_id != user.id:
+            job_queue.enqueue('notify', {
+                'user_id': post.user_id,
+                'type': 'like',
+                'content': f'@{user.username} оценил ваш пост',
+                'reference_id': post.id,
+            }, key=f'like-notify:{user.id}:{post.id}')
+        liked = True
+    
+    job_queue.enqueue('post_counters', {'post_id': post.id})
+    db.session.commit()
+    job_queue.notify()
+    xp_ledger.notify()
+    return liked
+
 @app.route('/create_post', methods=['POST'])
 @login_required
 def create_post():
     content = request.form.get('content', '')
-    
     if content.strip():
-        post = Post(
-            content=content,
-            user_id=current_user.id
-        )
-        current_user.posts_count += 1
-        
         try:
-            db.session.add(post)
-            db.session.commit()
-            flash('Ваш пост запущен в космос! 🌠', 'success')
-        except:
-            db.session.rollback()
-            flash('Ошибка при публикации поста', 'error')
+            coordinates = parse_coordinates(request.form.get('latitude'), request.form.get('longitude'))
+        except ValueError:
+            flash('Некорректные координаты', 'error')
+            return redirect('/')
+        try:
+            publish_post(
+                current_user,
+                content,
+                privacy=request.form.get('privacy', 'public'),
+                poll_options=parse_poll_options(request.form.get('poll_options', '')),
+                upload=request.files.get('media'),
+                media_url=request.form.get('media_url', ''),
+                coordinates=coordinates,
+                location=request.form.get('location', '')
+            )
+        except MediaTooLarge:
+            flash('Файл слишком большой', 'error')
+            return redirect('/')
+        except ValueError:
+            flash('Неподдерживаемый формат файла', 'error')
+            return redirect('/')
+        flash('Пост опубликован!', 'success')
     
     return redirect('/')
 
 @app.route('/like/<int:post_id>', methods=['POST'])
 @login_required
 def like_post(post_id):
-    post = Post.query.get(post_id)
-    
+    post = visible_post(post_id, current_user.id)
     if post:
-        # Проверяем, не лайкал ли уже
-        existing_like = Like.query.filter_by(
-            user_id=current_user.id,
-            post_id=post_id
-        ).first()
-        
-        if existing_like:
-            # Удаляем лайк
-            db.session.delete(existing_like)
-            post.likes_count = max(0, post.likes_count - 1)
-        else:
-            # Добавляем лайк
-            like = Like(user_id=current_user.id, post_id=post_id)
-            db.session.add(like)
-            post.likes_count += 1
-        
-        try:
-            db.session.commit()
-        except:
-            db.session.rollback()
+        toggle_like(post, current_user)
     
     return redirect('/')
 
-@app.errorhandler(404)
-def not_found(error):
-    return '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>404 - Netta</title>
-        <style>
-            body {
-                background: #0a0a1a;
-                color: white;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                height: 100vh;
-                margin: 0;
-                text-align: center;
-                font-family: 'Segoe UI', sans-serif;
-            }
-            h1 {
-                font-size: 8rem;
-                margin: 0;
-                background: linear-gradient(45deg, #7c3aed, #bf00ff);
-                -webkit-background-clip: text;
-                -webkit-text-fill-color: transparent;
-            }
-            .btn {
-                display: inline-block;
-                margin-top: 2rem;
-                padding: 1rem 2rem;
-                background: linear-gradient(135deg, #7c3aed, #5b21b6);
-                color: white;
-                text-decoration: none;
-                border-radius: 15px;
-                font-weight: bold;
-            }
-        </style>
-    </head>
-    <body>
-        <div>
-            <h1>404</h1>
-            <h2>Потерялись в космосе</h2>
-            <p>Эта планета еще не открыта</p>
-            <a href="/" class="btn">🚀 Вернуться на Землю</a>
-        </div>
-    </body>
-    </html>
-    ''', 404
+# ============ КЭШ ============
+class RespError(Exception):
+    pass
 
-# Запуск приложения
-if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        
-        # Создаем тестовых пользователей если их нет
-        if not User.query.first():
-            colors = ['#7c3aed', '#a855f7', '#bf00ff', '#5b21b6']
-            
-            test_users = [
-                ('admin', 'admin@netta.com', 'admin123', 'Администратор Вселенной'),
-                ('cosmos', 'cosmos@netta.com', 'cosmos123', 'Космический Путешественник'),
-                ('nebula', 'nebula@netta.com', 'nebula123', 'Туманность Андромеды'),
-                ('stardust', 'stardust@netta.com', 'stardust123', 'Звездная Пыль')
-            ]
-            
-            for i, (username, email, password, full_name) in enumerate(test_users):
-                user = User(
-                    username=username,
-                    email=email,
-                    full_name=full_name,
-                    avatar_color=colors[i % len(colors)],
-                    level=random.randint(2, 10),
-                    coins=random.randint(100, 1000)
-                )
-                user.set_password(password)
-                db.session.add(user)
-            
-            # Создаем тестовые посты
-            post_contents = [
-                'Привет всем! Это новая социальная сеть Netta! 🌌',
-                'Кто уже успел исследовать новые функции? 🚀',
-                'Фиолетовый - цвет бесконечности и тайн вселенной! 🟣',
-                'Сегодня достиг нового уровня в системе прокачки! 🎉',
-                'Объявляю конкурс на лучший космический пост!',
-                'Создал сообщество для исследователей космоса. Присоединяйтесь!',
-                'Новый дизайн просто космический! Крутые анимации!',
-                'Купил премиум статус за монеты. Очень круто! 💜',
-                'Кто хочет вместе пройти квест на новой планете?',
-                'Заметил баг? Пишите в поддержку! Мы все исправим!'
-            ]
-            
-            users = User.query.all()
-            for i, content in enumerate(post_contents):
-                author = users[i % len(users)]
-                post = Post(
-                    content=content,
-                    user_id=author.id,
-                    likes_count=random.randint(5, 50),
-                    comments_count=random.randint(0, 20),
-                    created_at=datetime.utcnow()
-                )
-                db.session.add(post)
-                author.posts_count += 1
-            
-            db.session.commit()
-            print("✅ Netta успешно запущена!")
-            print("👤 Тестовые пользователи созданы:")
-            for user in User.query.all():
-                print(f"   {user.username} / {user.email} / пароль из списка выше")
-    
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)           self.coins += 50
-        return self.level
+class RespClient:
+    # Минимальный клиент протокола Redis (RESP2) без внешних зависимостей; соединение на поток
+    def __init__(self, host='localhost', port=6379, db=0, password=None, username=None, use_ssl=False, verify=True, timeout=5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.username = username
+        self.use_ssl = use_ssl
+        self.verify = verify
+        self.timeout = timeout
+        self._pid = os.getpid()
+        self._local = threading.local()
 
-class Post(db.Model):
-    __tablename__ = 'posts'
-    id = db.Column(db.Integer, primary_key=True)
-    content = db.Column(db.Text, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    likes_count = db.Column(db.Integer, default=0)
-    comments_count = db.Column(db.Integer, default=0)
-    shares_count = db.Column(db.Integer, default=0)
-    views_count = db.Column(db.Integer, default=0)
-    media_type = db.Column(db.String(20))
-    media_url = db.Column(db.String(500))
-    poll_data = db.Column(db.Text)
-    privacy = db.Column(db.String(20), default='public')
-    location = db.Column(db.String(200))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    author = db.relationship('User', backref='user_posts')
+    @classmethod
+    def from_url(cls, url):
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query))
+        return cls(
+            host=parts.hostname or 'localhost',
+            port=parts.port or 6379,
+            db=int(parts.path.strip('/') or 0),
+            password=unquote(parts.password) if parts.password else None,
+            username=unquote(parts.username) if parts.username else None,
+            use_ssl=parts.scheme == 'rediss',
+            verify=query.get('ssl_cert_reqs', 'required') != 'none'
+        )
 
-class Comment(db.Model):
-    __tablename__ = 'comments'
-    id = db.Column(db.Integer, primary_key=True)
-    content = db.Column(db.Text, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
-    likes_count = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    author = db.relationship('User', backref='user_comments')
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self.use_ssl:
+            context = ssl.create_default_context()
+            if not self.verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            sock = context.wrap_socket(sock, server_hostname=self.host)
+        reader = sock.makefile('rb')
+        connection = (sock, reader)
+        if self.password:
+            self._call(connection, ['AUTH', self.username, self.password] if self.username else ['AUTH', self.password])
+        if self.db:
+            self._call(connection, ['SELECT', self.db])
+        return connection
 
-class Friendship(db.Model):
-    __tablename__ = 'friendships'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    friend_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    status = db.Column(db.String(20), default='pending')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user = db.relationship('User', foreign_keys=[user_id], backref='sent_friendships')
-    friend = db.relationship('User', foreign_keys=[friend_id], backref='received_friendships')
+    def _state(self):
+        # После fork (gunicorn --preload) сокеты мастера не используем: у процесса свои соединения
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._local = threading.local()
+        return self._local
 
-class Message(db.Model):
-    __tablename__ = 'messages'
-    id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    content = db.Column(db.Text, nullable=False)
-    is_read = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
-    receiver = db.relationship('User', foreign_keys=[receiver_id], backref='received_messages')
+    def close(self):
+        state = self._state()
+        connection = getattr(state, 'connection', None)
+        state.connection = None
+        if connection:
+            connection[0].close()
 
-class Notification(db.Model):
-    __tablename__ = 'notifications'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    type = db.Column(db.String(50))
-    content = db.Column(db.Text)
-    reference_id = db.Column(db.Integer)
-    is_read = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user = db.relationship('User', backref='user_notifications')
+    def command(self, *args):
+        # Один повтор на новом соединении: сервер мог закрыть простаивающее
+        for attempt in range(2):
+            state = self._state()
+            connection = getattr(state, 'connection', None)
+            try:
+                if connection is None:
+                    connection = state.connection = self.connect()
+                return self._call(connection, args)
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
 
-class Like(db.Model):
-    __tablename__ = 'likes'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user = db.relationship('User', backref='user_likes')
-    post = db.relationship('Post', backref='post_likes')
+    def _call(self, connection, args):
+        connection[0].sendall(self.encode(args))
+        return self.read_reply(connection[1])
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+    @staticmethod
+    def encode(args):
+        chunks = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            chunks.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(chunks)
 
-LOGIN_HTML = '''<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Netta | Вход</title>
-    <style>
-        :root {
-            --purple-neon: #bf00ff;
-            --purple-deep: #7c3aed;
-            --purple-light: #a855f7;
-            --purple-dark: #5b21b6;
-            --space-bg: #0a0a1a;
-            --card-bg: rgba(20, 15, 40, 0.9);
-        }
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body {
-            font-family: 'Segoe UI', sans-serif;
-            background: var(--space-bg);
-            color: white;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            min-height: 100vh;
-            padding: 20px;
-        }
-        .auth-card {
-            background: var(--card-bg);
-            border: 2px solid #7c3aed;
-            border-radius: 20px;
-            padding: 3rem;
-            width: 100%;
-            max-width: 500px;
-        }
-        .logo {
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            font-size: 2rem;
-            font-weight: 800;
-            margin-bottom: 2rem;
-            justify-content: center;
-        }
-        .logo-icon {
-            width: 40px;
-            height: 40px;
-            background: linear-gradient(135deg, #7c3aed, #bf00ff);
-            border-radius: 10px;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            font-size: 1.5rem;
-            font-weight: 900;
-            color: white;
-        }
-        .auth-title {
-            text-align: center;
-            margin-bottom: 2rem;
-            font-size: 1.8rem;
-            background: linear-gradient(45deg, #7c3aed, #a855f7);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-        }
-        .form-group {
-            margin-bottom: 1.5rem;
-        }
-        .form-control {
-            width: 100%;
-            padding: 1rem;
-            background: rgba(255, 255, 255, 0.05);
-            border: 2px solid rgba(124, 58, 237, 0.3);
-            border-radius: 10px;
-            color: white;
-            font-size: 1rem;
-        }
-        .btn-primary {
-            width: 100%;
-            padding: 1rem;
-            background: linear-gradient(135deg, #7c3aed, #5b21b6);
-            border: none;
-            border-radius: 10px;
-            color: white;
-            font-weight: 600;
-            font-size: 1rem;
-            cursor: pointer;
-        }
-        .auth-switch {
-            text-align: center;
-            margin-top: 2rem;
-            color: #d1d5db;
-        }
-        .auth-link {
-            color: #a855f7;
-            text-decoration: none;
-        }
-        .flash-message {
-            padding: 1rem;
-            margin-bottom: 1rem;
-            border-radius: 10px;
-            text-align: center;
-        }
-        .flash-success {
-            background: rgba(16, 185, 129, 0.2);
-            border: 1px solid #10b981;
-        }
-        .flash-error {
-            background: rgba(239, 68, 68, 0.2);
-            border: 1px solid #ef4444;
-        }
-    </style>
-</head>
-<body>
-    <div class="auth-card">
-        <div class="logo">
-            <div class="logo-icon">N</div>
-            <span>Netta</span>
-        </div>
+    @classmethod
+    def read_reply(cls, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError('Соединение с Redis закрыто')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RespError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [cls.read_reply(reader) for _ in range(length)]
+        raise RespError(f'Неизвестный ответ: {line!r}')
+
+    def subscribe(self, channel, callback):
+        # Отдельное соединение в фоновом потоке; после разрыва callback(None): сообщения могли потеряться
+        def listen():
+            while True:
+                try:
+                    sock, reader = self.connect()
+                    sock.settimeout(None)
+                    sock.sendall(self.encode(['SUBSCRIBE', channel]))
+                    while True:
+                        reply = self.read_reply(reader)
+                        if reply[0] == b'message':
+                            callback(reply[2].decode())
+                except Exception as e:
+                    app.logger.warning('Подписка на %s прервана: %s', channel, e)
+                callback(None)
+                time.sleep(1)
+        threading.Thread(target=listen, name=f'subscribe-{channel}', daemon=True).start()
+
+class MemoryBackend:
+    # LRU в памяти процесса: у каждого воркера своя копия
+    shared = False
+    broadcasts = False
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._fills = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] and entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl if ttl else 0, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def counter(self, key):
+        return self.get(key) or 0
+
+    def incr(self, key):
+        with self._lock:
+            value = (self._entries.pop(key, (0, 0))[1] or 0) + 1
+            self._entries[key] = (0, value)
+            return value
+
+    def acquire(self, key, ttl):
+        with self._lock:
+            expires = self._fills.get(key)
+            if expires and expires > time.monotonic():
+                return None
+            self._fills[key] = time.monotonic() + ttl
+            return key
+
+    def release(self, key, token):
+        with self._lock:
+            self._fills.pop(key, None)
+
+    def publish(self, channel, message):
+        for callback in self._subscribers:
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers.append(callback)
+
+class FileBackend:
+    # Каталог, общий для воркеров одной машины (например, /dev/shm); запись через os.replace атомарна
+    shared = True
+    broadcasts = False
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires and expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((time.time() + ttl if ttl else 0, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def counter(self, key):
+        return self.get(key) or 0
+
+    def incr(self, key):
+        # Счётчик версий под файловой блокировкой, чтобы два воркера не получили одно значение
+        with open(self._path(key) + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            value = (self.get(key) or 0) + 1
+            self.set(key, value)
+            return value
+
+    def acquire(self, key, ttl):
+        # Блокировка заполнения — файл, созданный с O_EXCL; файл старше ttl остался от упавшего воркера
+        path = self._path(key) + '.fill'
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path
+            except FileExistsError:
+                try:
+                    if os.path.getmtime(path) + ttl > time.time():
+                        return None
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return None
+
+    def release(self, key, token):
+        try:
+            os.remove(token)
+        except FileNotFoundError:
+            pass
+
+    def publish(self, channel, message):
+        pass
+
+    def subscribe(self, channel, callback):
+        pass
+
+REDIS_RELEASE_SCRIPT = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end return 0"
+
+class RedisBackend:
+    # Общий кэш всех машин; удаления рассылаются через pub/sub
+    shared = True
+    broadcasts = True
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        data = self.client.command('GET', key)
+        return None if data is None else pickle.loads(data)
+
+    def set(self, key, value, ttl=None):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if ttl:
+            self.client.command('SET', key, data, 'PX', max(1, int(ttl * 1000)))
+        else:
+            self.client.command('SET', key, data)
+
+    def delete(self, key):
+        self.client.command('DEL', key)
+
+    def counter(self, key):
+        return int(self.client.command('GET', key) or 0)
+
+    def incr(self, key):
+        return self.client.command('INCR', key)
+
+    def acquire(self, key, ttl):
+        # SET NX PX: блокировку берёт один воркер на все машины, после падения она истекает сама
+        token = f'{os.getpid()}-{random.getrandbits(32):08x}'
+        if self.client.command('SET', f'{key}:fill', token, 'NX', 'PX', max(1, int(ttl * 1000))) is None:
+            return None
+        return token
+
+    def release(self, key, token):
+        # Удаляем только свою блокировку: чужая могла появиться, если наша истекла во время загрузки
+        self.client.command('EVAL', REDIS_RELEASE_SCRIPT, 1, f'{key}:fill', token)
+
+    def publish(self, channel, message):
+        self.client.command('PUBLISH', channel, message)
+
+    def subscribe(self, channel, callback):
+        self.client.subscribe(channel, callback)
+
+class Cache:
+    # Ключ: префикс:пространство:версия:ключ. invalidate() увеличивает версию пространства,
+    # и старые записи становятся недостижимы во всех воркерах сразу
+    def __init__(self, backend, prefix='netta', local_size=1000, version_ttl=None, fill_timeout=30):
+        self.backend = backend
+        self.prefix = prefix
+        self.channel = f'{prefix}:invalidate'
+        # Ближний кэш в памяти имеет смысл только там, где удаления рассылаются всем воркерам
+        self.local = MemoryBackend(local_size) if backend.broadcasts else None
+        if version_ttl is None:
+            version_ttl = 30 if backend.broadcasts else (1 if backend.shared else 0)
+        self.version_ttl = version_ttl
+        # Сколько держится блокировка заполнения, если её владелец так и не записал значение
+        self.fill_timeout = fill_timeout
+        self._versions = {}
+        self._fill_locks = {}
+        self._lock = threading.Lock()
+        self._subscribed_pid = None
+        self._ensure_subscribed()
+
+    def _ensure_subscribed(self):
+        # Поток подписки не переживает fork: каждый воркер подписывается заново
+        if self._subscribed_pid == os.getpid():
+            return
+        with self._lock:
+            if self._subscribed_pid == os.getpid():
+                return
+            self._subscribed_pid = os.getpid()
+            self._versions.clear()
+            if self.local is not None:
+                self.local.clear()
+            self.backend.subscribe(self.channel, self._on_message)
+
+    def version(self, namespace):
+        self._ensure_subscribed()
+        cached = self._versions.get(namespace)
+        if cached and time.monotonic() - cached[1] < self.version_ttl:
+            return cached[0]
+        version = self.backend.counter(f'{self.prefix}:{namespace}:version')
+        self._versions[namespace] = (version, time.monotonic())
+        return version
+
+    def key(self, namespace, key, version=None):
+        if version is None:
+            version = self.version(namespace)
+        return f'{self.prefix}:{namespace}:{version}:{key}'
+
+    def get(self, namespace, key, version=None):
+        full_key = self.key(namespace, key, version)
+        if self.local is not None:
+            value = self.local.get(full_key)
+            if value is not None:
+                return value
+        value = self.backend.get(full_key)
+        if value is not None and self.local is not None:
+            self.local.set(full_key, value, self.version_ttl)
+        return value
+
+    def set(self, namespace, key, value, ttl=None, version=None):
+        full_key = self.key(namespace, key, version)
+        self.backend.set(full_key, value, ttl)
+        if self.local is not None:
+            self.local.set(full_key, value, min(ttl or self.version_ttl, self.version_ttl))
+
+    def delete(self, namespace, key):
+        full_key = self.key(namespace, key)
+        self.backend.delete(full_key)
+        if self.local is not None:
+            self.local.delete(full_key)
+        self.backend.publish(self.channel, f'key {full_key}')
+
+    def key_version(self, namespace, key):
+        # Версия отдельного ключа читается из бэкенда без локального кэша: таких версий столько же,
+        # сколько ключей, и держать их в памяти процесса нельзя
+        return self.backend.counter(f'{self.prefix}:{namespace}:{key}:version')
+
+    def bump(self, namespace, key):
+        return self.backend.incr(f'{self.prefix}:{namespace}:{key}:version')
+
+    def invalidate(self, namespace):
+        version = self.backend.incr(f'{self.prefix}:{namespace}:version')
+        self._versions[namespace] = (version, time.monotonic())
+        self.backend.publish(self.channel, f'namespace {namespace} {version}')
+
+    def get_or_set(self, namespace, key, loader, ttl=None):
+        # Версия фиксируется до загрузки: если пространство сбросили во время запроса,
+        # результат запишется под старой версией и читателям не достанется
+        version = self.version(namespace)
+        value = self.get(namespace, key, version)
+        if value is not None:
+            record_cache(namespace, hits=1)
+            return value
         
-        <h1 class="auth-title">ВОЙТИ В NETTA</h1>
+        # Промахи в одном процессе ждут одну локальную блокировку; запись о ней живёт,
+        # пока есть ожидающие, и удаляется последним
+        with self._lock:
+            entry = self._fill_locks.setdefault((namespace, key), [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                return self._fill(namespace, key, loader, ttl)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._fill_locks[(namespace, key)]
+
+    def _fill(self, namespace, key, loader, ttl):
+        # Между процессами загрузку выполняет владелец блокировки в бэкенде, остальные ждут его значения
+        version = self.version(namespace)
+        full_key = self.key(namespace, key, version)
+        while True:
+            value = self.get(namespace, key, version)
+            if value is not None:
+                record_cache(namespace, hits=1)
+                return value
+            token = self.backend.acquire(full_key, self.fill_timeout)
+            if token is not None:
+                break
+            time.sleep(0.05)
         
-        {% with messages = get_flashed_messages(with_categories=true) %}
-            {% if messages %}
-                {% for category, message in messages %}
-                    <div class="flash-message flash-{{ category }}">
-                        {{ message }}
-                    </div>
-                {% endfor %}
-            {% endif %}
-        {% endwith %}
+        try:
+            value = self.get(namespace, key, version)
+            if value is not None:
+                record_cache(namespace, hits=1)
+                return value
+            record_cache(namespace, misses=1)
+            value = loader()
+            self.set(namespace, key, value, ttl, version)
+            return value
+        finally:
+            self.backend.release(full_key, token)
+
+    def _on_message(self, message):
+        if message is None:
+            self._versions.clear()
+            if self.local is not None:
+                self.local.clear()
+            return
         
-        <form method="POST" action="/login">
-            <div class="form-group">
-                <input type="text" name="username" class="form-control" required placeholder="👤 Имя пользователя или Email">
-            </div>
-            
-            <div class="form-group">
-                <input type="password" name="password" class="form-control" required placeholder="🔒 Пароль">
-            </div>
-            
-            <button type="submit" class="btn-primary">🚀 ВОЙТИ</button>
-        </form>
+        kind, _, rest = message.partition(' ')
+        if kind == 'namespace':
+            namespace, _, version = rest.rpartition(' ')
+            cached = self._versions.get(namespace)
+            if not cached or cached[0] < int(version):
+                self._versions[namespace] = (int(version), time.monotonic())
+        elif kind == 'key' and self.local is not None:
+            self.local.delete(rest)
+
+def make_cache():
+    # CACHE_URL: memory:// (по умолчанию), file:///dev/shm/netta-cache, redis://host:6379/0
+    url = os.environ.get('CACHE_URL', 'memory://')
+    if url.startswith(('redis://', 'rediss://')):
+        backend = RedisBackend(RespClient.from_url(url))
+    elif url.startswith('file://'):
+        backend = FileBackend(urlsplit(url).path)
+    else:
+        backend = MemoryBackend(int(os.environ.get('CACHE_MAX_ENTRIES', 10000)))
+    return Cache(backend)
+
+cache = make_cache()
+
+# ============ ОГРАНИЧЕНИЕ ЧАСТОТЫ ============
+# Группа -> ((область, токенов в секунду, ёмкость корзины), ...)
+RATE_LIMITS = {
+    'post': (('user', 10 / 60, 5), ('ip', 30 / 60, 15)),
+    'like': (('user', 1, 30), ('ip', 5, 100)),
+    'register': (('ip', 5 / 3600, 3),),
+    'friend': (('user', 20 / 60, 10),),
+    'vote': (('user', 1, 10),),
+    'upload': (('user', 10 / 60, 5),),
+}
+RATE_LIMITED_ENDPOINTS = {
+    'create_post': 'post',
+    'api_create_post': 'post',
+    'like_post': 'like',
+    'api_like': 'like',
+    'register': 'register',
+    'friend_request': 'friend',
+    'poll_vote': 'vote',
+    'media_upload': 'upload',
+}
+RATE_LIMITED = PrometheusCounter('netta_rate_limited_total', 'Отклонённые лимитом запросы', ['group', 'scope'])
+
+class MemoryBucketStore:
+    # Корзины в памяти процесса; каждый воркер gunicorn считает отдельно
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after == 0, retry_after
+
+class RedisBucketStore:
+    # Общие корзины для всех воркеров; атомарность обеспечивает Lua-скрипт
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local now = redis.call('TIME')
+    now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local retry_ms = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        retry_ms = math.ceil((1 - tokens) / rate * 1000)
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return retry_ms
+    """
+
+    def __init__(self, client, prefix='netta:rl:'):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key, rate, capacity):
+        retry_ms = int(self.client.command('EVAL', self.SCRIPT, 1, self.prefix + key, rate, capacity))
+        return retry_ms == 0, retry_ms / 1000
+
+def make_bucket_store():
+    url = os.environ.get('RATE_LIMIT_REDIS_URL')
+    if url:
+        return RedisBucketStore(RespClient.from_url(url))
+    return MemoryBucketStore()
+
+rate_limit_store = make_bucket_store()
+
+def client_ip():
+    # За роутером Heroku адрес клиента — последний в X-Forwarded-For
+    forwarded = request.headers.get('X-Forwarded-For')
+    return forwarded.split(',')[-1].strip() if forwarded else request.remote_addr
+
+@app.before_request
+def enforce_rate_limits():
+    group = RATE_LIMITED_ENDPOINTS.get(request.endpoint)
+    if group is None or request.method in ('GET', 'HEAD'):
+        return
+    
+    # Пользователя берём из cookie сессии, без обращения к БД
+    user_id = session.get('_user_id')
+    for scope, rate, capacity in RATE_LIMITS[group]:
+        if scope == 'user' and not user_id:
+            continue
+        key = f'{group}:{scope}:{user_id if scope == "user" else client_ip()}'
+        try:
+            allowed, retry_after = rate_limit_store.take(key, rate, capacity)
+        except Exception as e:
+            app.logger.warning('Лимитер недоступен: %s', e)
+            return
         
-        <div class="auth-switch">
-            Нет аккаунта? <a href="/register" class="auth-link">Создать</a>
-        </div>
-    </div>
-</body>
-</html>'''
+        if not allowed:
+            RATE_LIMITED.labels(group, scope).inc()
+            headers = {'Retry-After': str(max(1, math.ceil(retry_after)))}
+            if request.path.startswith('/api/'):
+                return jsonify({'error': 'rate limited', 'retry_after': math.ceil(retry_after)}), 429, headers
+            return 'Слишком много запросов. Попробуйте позже.', 429, headers
 
-REGISTER_HTML = '''<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Netta | Регистрация</title>
-    <style>
-        :root {
-            --purple-neon: #bf00ff;
-            --purple-deep: #7c3aed;
-            --purple-light: #a855f7;
-            --purple-dark: #5b21b6;
-            --space-bg: #0a0a1a;
-            --card-bg: rgba(20, 15, 40, 0.9);
-        }
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body {
-            font-family: 'Segoe UI', sans-serif;
-            background: var(--space-bg);
-            color: white;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            min-height: 100vh;
-            padding: 20px;
-        }
-        .auth-card {
-            background: var(--card-bg);
-            border: 2px solid #7c3aed;
-            border-radius: 20px;
-            padding: 3rem;
-            width: 100%;
-            max-width: 500px;
-        }
-        .logo {
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            font-size: 2rem;
-            font-weight: 800;
-            margin-bottom: 2rem;
-            justify-content: center;
-        }
-        .logo-icon {
-            width: 40px;
-            height: 40px;
-            background: linear-gradient(135deg, #7c3aed, #bf00ff);
-            border-radius: 10px;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            font-size: 1.5rem;
-            font-weight: 900;
-            color: white;
-        }
-        .auth-title {
-            text-align: center;
-            margin-bottom: 2rem;
-            font-size: 1.8rem;
-            background: linear-gradient(45deg, #7c3aed, #a855f7);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-        }
-        .form-group {
-            margin-bottom: 1.5rem;
-        }
-        .form-control {
-            width: 100%;
-            padding: 1rem;
-            background: rgba(255, 255, 255, 0.05);
-            border: 2px solid rgba(124, 58, 237, 0.3);
-            border-radius: 10px;
-            color: white;
-            font-size: 1rem;
-        }
-        .btn-primary {
-            width: 100%;
-            padding: 1rem;
-            background: linear-gradient(135deg, #7c3aed, #5b21b6);
-            border: none;
-            border-radius: 10px;
-            color: white;
-            font-weight: 600;
-            font-size: 1rem;
-            cursor: pointer;
-        }
-        .auth-switch {
-            text-align: center;
-            margin-top: 2rem;
-            color: #d1d5db;
-        }
-        .auth-link {
-            color: #a855f7;
-            text-decoration: none;
-        }
-        .flash-message {
-            padding: 1rem;
-            margin-bottom: 1rem;
-            border-radius: 10px;
-            text-align: center;
-        }
-        .flash-success {
-            background: rgba(16, 185, 129, 0.2);
-            border: 1px solid #10b981;
-        }
-        .flash-error {
-            background: rgba(239, 68, 68, 0.2);
-            border: 1px solid #ef4444;
-        }
-    </style>
-</head>
-<body>
-    <div class="auth-card">
-        <div class="logo">
-            <div class="logo-icon">N</div>
-            <span>Netta</span>
+# ============ РЕПЛИКИ ============
+@app.after_request
+def pin_writer_to_primary(response):
+    # После своей записи пользователь несколько секунд читает с основной БД (read-your-writes)
+    if REPLICA_BINDS and (request.method not in ('GET', 'HEAD') or g.get('use_primary')):
+        session['primary_until'] = time.time() + REPLICA_PIN_SECONDS
+    return response
+
+# ============ ВИДИМОСТЬ ПОСТОВ ============
+PRIVACY_LEVELS = ('public', 'friends', 'private')
+
+def is_friend_of(viewer_id, author_id):
+    # Полусоединение с friendships: EXISTS по уникальному индексу пары
+    return db.exists().where(
+        Friendship.status == 'accepted',
+        db.or_(
+            db.and_(Friendship.user_id == viewer_id, Friendship.friend_id == author_id),
+            db.and_(Friendship.user_id == author_id, Friendship.friend_id == viewer_id)
+        )
+    )
+
+def visible_to(viewer_id, model=Post):
+    return db.or_(
+        model.privacy == 'public',
+        model.user_id == viewer_id,
+        db.and_(model.privacy == 'friends', is_friend_of(viewer_id, model.user_id))
+    )
+
+def accepted_friend_ids(user_id):
+    # Друзья для проверки доступа — всегда из БД (индексы пары и (friend_id, status)). Кэш friend_graph
+    # может отставать на TTL в других воркерах и годится только для ранжирования и подсказок
+    rows = db.session.query(Friendship.user_id, Friendship.friend_id).filter(
+        Friendship.status == 'accepted',
+        db.or_(Friendship.user_id == user_id, Friendship.friend_id == user_id)
+    ).all()
+    return {friend_id if sender_id == user_id else sender_id for sender_id, friend_id in rows}
+
+def can_view(post, viewer_id, friend_ids):
+    # То же правило, что visible_to, для уже загруженных строк; friend_ids — из accepted_friend_ids
+    return post.privacy == 'public' or post.user_id == viewer_id or (post.privacy == 'friends' and post.user_id in friend_ids)
+
+def feed_query(viewer_id, limit=10, before=None, public=True, order='new'):
+    # Каждая ветка читает свой индекс ((privacy, created_at) или (user_id, created_at),
+    # для order='hot' — те же с hot_score) не дальше limit строк; объединение и сортировка — в том же запросе.
+    # Посты «для друзей» читаем от списка друзей зрителя, а не перебором всех таких постов в системе
+    sort_key = Post.hot_score if order == 'hot' else Post.created_at
+    
+    def branch(*criteria):
+        query = db.select(Post.id).where(*criteria)
+        if before:
+            query = query.where(db.or_(
+                sort_key < before[0],
+                db.and_(sort_key == before[0], Post.id < before[1])
+            ))
+        return db.select(query.order_by(sort_key.desc(), Post.id.desc()).limit(limit).subquery())
+    
+    branches = [branch(Post.user_id == viewer_id, Post.privacy != 'public')]
+    friend_ids = sorted(accepted_friend_ids(viewer_id))
+    if friend_ids:
+        # Диапазоны индекса (user_id, privacy, ...) по каждому другу; сортируются только их посты «для друзей».
+        # Без статистики планировщик SQLite предпочёл бы упорядоченный (privacy, ...) — её собирает run_migrations
+        branches.append(branch(Post.user_id.in_(friend_ids), Post.privacy == 'friends'))
+    if public:
+        branches.insert(0, branch(Post.privacy == 'public'))
+    visible = db.union_all(*branches).subquery()
+    
+    return Post.query.options(db.joinedload(Post.author)).join(visible, Post.id == visible.c.id).order_by(
+        sort_key.desc(), Post.id.desc()
+    ).limit(limit)
+
+def visible_post(post_id, viewer_id):
+    return Post.query.filter(Post.id == post_id, visible_to(viewer_id)).first()
+
+def liked_post_ids(user_id, post_ids, archived=()):
+    if not post_ids:
+        return set()
+    liked = {post_id for post_id, in db.session.query(Like.post_id).filter(
+        Like.user_id == user_id, Like.post_id.in_(post_ids)
+    )}
+    if archived:
+        liked.update(post_id for post_id, in db.session.query(LikeArchive.post_id).filter(
+            LikeArchive.user_id == user_id, LikeArchive.post_id.in_(archived)
+        ))
+    return liked
+
+# ============ ГОРЯЧАЯ ЛЕНТА ============
+PostSnapshot = namedtuple('PostSnapshot', [
+    'id', 'user_id', 'content', 'content_html', 'content_html_version', 'privacy', 'media_type', 'media_url',
+    'media_variants', 'likes_count', 'comments_count', 'views_count', 'created_at', 'author'
+])
+AuthorSnapshot = namedtuple('AuthorSnapshot', ['id', 'username', 'full_name', 'avatar_color'])
+
+class HotFeed:
+    # Общая для всех пользователей верхушка публичной ленты: неизменяемые снимки постов и авторов
+    def __init__(self, size=50, ttl=10):
+        self.size = size
+        self.ttl = ttl
+
+    def key(self):
+        # Версия рендерера в ключе: после выкладки общий кэш не отдаст снимки старого формата
+        return f'{self.size}:r{CONTENT_RENDERER_VERSION}'
+
+    def invalidate(self):
+        cache.invalidate('hot_feed')
+
+    def invalidate_posts(self, post_ids):
+        # Окно упорядочено по created_at: лайк не вводит пост в окно и не выводит из него,
+        # поэтому сбрасываем только окно, где есть изменённые посты; прочие счётчики догонит ttl
+        cached = cache.get('hot_feed', self.key())
+        if cached is not None and not {post.id for post in cached}.isdisjoint(post_ids):
+            self.invalidate()
+
+    def get(self):
+        return cache.get_or_set('hot_feed', self.key(), self._load, ttl=self.ttl)
+
+    def _load(self):
+        return tuple(self._snapshot(post) for post in Post.query.options(db.joinedload(Post.author)).filter(
+            Post.privacy == 'public'
+        ).order_by(Post.created_at.desc(), Post.id.desc()).limit(self.size))
+
+    def _snapshot(self, post):
+        author = post.author
+        return PostSnapshot(
+            id=post.id,
+            user_id=post.user_id,
+            content=post.content,
+            content_html=post_html(post),
+            content_html_version=CONTENT_RENDERER_VERSION,
+            privacy=post.privacy,
+            media_type=post.media_type,
+            media_url=post.media_url,
+            media_variants=post.media_variants,
+            likes_count=post.likes_count or 0,
+            comments_count=post.comments_count or 0,
+            views_count=post.views_count or 0,
+            created_at=post.created_at,
+            author=AuthorSnapshot(author.id, author.username, author.full_name, author.avatar_color)
+        )
+
+hot_feed = HotFeed(size=int(os.environ.get('HOT_FEED_SIZE', 50)), ttl=float(os.environ.get('HOT_FEED_TTL', 10)))
+
+def home_feed(viewer_id, limit=10):
+    # Публичная часть из общего кэша, запросом — только посты друзей и собственные непубличные
+    if limit > hot_feed.size:
+        return feed_query(viewer_id, limit=limit).all()
+    
+    posts = list(hot_feed.get()[:limit]) + feed_query(viewer_id, limit=limit, public=False).all()
+    posts.sort(key=lambda post: (post.created_at, post.id), reverse=True)
+    return posts[:limit]
+
+# ============ ГРАФ ДРУЗЕЙ ============
+class FriendGraph:
+    # Списки смежности в общем кэше: user_id -> frozenset друзей. У каждого пользователя своя версия
+    # в ключе; invalidate() увеличивает её, и список, прочитанный из БД до сброса, запишется
+    # под старой версией и читателям не достанется
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+
+    def _load(self, user_ids):
+        # Версии фиксируются до чтения из БД, как в cache.get_or_set
+        version = cache.version('friend_graph')
+        keys = {user_id: self.key(user_id) for user_id in user_ids}
+        result = {}
+        missing = []
+        for user_id in user_ids:
+            friends = cache.get('friend_graph', keys[user_id], version)
+            if friends is None:
+                missing.append(user_id)
+            else:
+                result[user_id] = friends
+        record_cache('friend_graph', hits=len(result), misses=len(missing))
+        
+        if missing:
+            fetched = {user_id: set() for user_id in missing}
+            # Одним запросом на пачку пользователей, без self-join
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = db.session.query(Friendship.user_id, Friendship.friend_id).filter(
+                    Friendship.status == 'accepted',
+                    db.or_(Friendship.user_id.in_(chunk), Friendship.friend_id.in_(chunk))
+                ).all()
+                for user_id, friend_id in rows:
+                    if user_id in fetched:
+                        fetched[user_id].add(friend_id)
+                    if friend_id in fetched:
+                        fetched[friend_id].add(user_id)
+            
+            for user_id, friends in fetched.items():
+                friends = frozenset(friends)
+                cache.set('friend_graph', keys[user_id], friends, self.ttl, version)
+                result[user_id] = friends
+        
+        return result
+
+    def key(self, user_id):
+        user_version = cache.key_version('friend_graph', user_id)
+        return f'{user_id}:{user_version}'
+
+    def friends(self, user_id):
+        return self._load([user_id])[user_id]
+
+    def cached(self, user_id):
+        # Без загрузки из БД: None, если списка нет в кэше
+        return cache.get('friend_graph', self.key(user_id))
+
+    def invalidate(self, *user_ids):
+        # Старую запись удаляем сразу, чтобы не занимала память до конца ttl
+        for user_id in user_ids:
+            cache.delete('friend_graph', self.key(user_id))
+            cache.bump('friend_graph', user_id)
+
+    def mutual(self, user_id, other_id):
+        adjacency = self._load([user_id, other_id])
+        return adjacency[user_id] & adjacency[other_id]
+
+    def suggestions(self, user_id, limit=5, exclude=()):
+        # Друзья друзей, ранжированные по числу общих друзей
+        friends = self.friends(user_id)
+        if not friends:
+            return []
+        
+        overlap = Counter()
+        for friend_friends in self._load(list(friends)).values():
+            overlap.update(friend_friends)
+        
+        for skip_id in friends | set(exclude) | {user_id}:
+            overlap.pop(skip_id, None)
+        
+        ranked = sorted(overlap.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+friend_graph = FriendGraph(ttl=int(os.environ.get('FRIEND_GRAPH_TTL', 300)))
+
+def friendship_between(user_id, other_id):
+    return Friendship.query.filter(db.or_(
+        db.and_(Friendship.user_id == user_id, Friendship.friend_id == other_id),
+        db.and_(Friendship.user_id == other_id, Friendship.friend_id == user_id)
+    ))
+
+def pending_friend_ids(user_id):
+    rows = db.session.query(Friendship.user_id, Friendship.friend_id).filter(
+        Friendship.status == 'pending',
+        db.or_(Friendship.user_id == user_id, Friendship.friend_id == user_id)
+    ).all()
+    return {friend_id if sender_id == user_id else sender_id for sender_id, friend_id in rows}
+
+def change_friends_count(user_ids, delta):
+    # Атомарное обновление счётчика в SQL, без read-modify-write в Python
+    query = User.query.filter(User.id.in_(user_ids))
+    if delta < 0:
+        query = query.filter(User.friends_count > 0)
+    query.update({User.friends_count: User.friends_count + delta}, synchronize_session=False)
+
+def accept_friendship(friendship_id, user_id, other_id):
+    # Условный UPDATE: при гонке двух подтверждений счётчики увеличит только одно
+    accepted = Friendship.query.filter_by(id=friendship_id, status='pending').update(
+        {Friendship.status: 'accepted'}, synchronize_session=False
+    )
+    if accepted:
+        change_friends_count([user_id, other_id], 1)
+    return accepted
+
+def suggested_friends(user_id, limit=5):
+    ranked = friend_graph.suggestions(user_id, limit=limit, exclude=pending_friend_ids(user_id))
+    if not ranked:
+        return []
+    
+    users = {user.id: user for user in User.query.filter(User.id.in_([suggested_id for suggested_id, _ in ranked]))}
+    return [(users[suggested_id], mutual) for suggested_id, mutual in ranked if suggested_id in users]
+
+def friend_suggestions_html(user_id, limit=5):
+    suggested = suggested_friends(user_id, limit)
+    if not suggested:
+        return ''
+    
+    items = ''.join([f'''
+                            <div style="display: flex; justify-content: space-between; align-items: center; margin-top: 0.8rem;">
+                                <div>
+                                    <div style="font-weight: bold;">{escape(user.full_name or user.username)}</div>
+                                    <div style="color: #9ca3af; font-size: 0.8rem;">Общих друзей: {mutual}</div>
+                                </div>
+                                <form method="POST" action="/friends/request/{user.id}">
+                                    <button type="submit" class="btn" style="padding: 0.4rem 0.8rem;">+</button>
+                                </form>
+                            </div>''' for user, mutual in suggested])
+    return f'''<div class="card">
+                            <h3>Возможно, вы знакомы</h3>{items}
+                        </div>'''
+
+@app.route('/friends/request/<int:user_id>', methods=['POST'])
+@login_required
+def friend_request(user_id):
+    if user_id == current_user.id or not User.query.get(user_id):
+        flash('Пользователь не найден', 'error')
+        return redirect('/')
+    
+    existing = friendship_between(current_user.id, user_id).first()
+    
+    try:
+        if existing is None:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(Friendship(user_id=current_user.id, friend_id=user_id))
+            except IntegrityError:
+                # Встречная заявка записана между проверкой и вставкой — обрабатываем её как существующую
+                existing = friendship_between(current_user.id, user_id).first()
+        
+        if existing is None:
+            db.session.commit()
+            flash('Заявка в друзья отправлена', 'success')
+        elif existing.status == 'pending' and existing.user_id == user_id:
+            # Встречная заявка — сразу принимаем
+            accept_friendship(existing.id, current_user.id, user_id)
+            db.session.commit()
+            friend_graph.invalidate(current_user.id, user_id)
+            flash('Теперь вы друзья!', 'success')
+        elif existing.status == 'accepted':
+            flash('Вы уже друзья', 'error')
+        else:
+            flash('Заявка уже отправлена', 'error')
+    except Exception:
+        db.session.rollback()
+        flash('Ошибка при отправке заявки', 'error')
+    
+    return redirect('/')
+
+@app.route('/friends/accept/<int:user_id>', methods=['POST'])
+@login_required
+def friend_accept(user_id):
+    pending = Friendship.query.filter_by(user_id=user_id, friend_id=current_user.id, status='pending').first()
+    
+    if pending:
+        try:
+            accept_friendship(pending.id, current_user.id, user_id)
+            db.session.commit()
+            friend_graph.invalidate(current_user.id, user_id)
+            flash('Теперь вы друзья!', 'success')
+        except Exception:
+            db.session.rollback()
+            flash('Ошибка при принятии заявки', 'error')
+    else:
+        flash('Заявка не найдена', 'error')
+    
+    return redirect('/')
+
+@app.route('/friends/remove/<int:user_id>', methods=['POST'])
+@login_required
+def friend_remove(user_id):
+    # Удаляет друга, отменяет свою заявку или отклоняет входящую
+    try:
+        removed = friendship_between(current_user.id, user_id).filter(
+            Friendship.status == 'accepted'
+        ).delete(synchronize_session=False)
+        if removed:
+            change_friends_count([current_user.id, user_id], -1)
+        friendship_between(current_user.id, user_id).delete(synchronize_session=False)
+        db.session.commit()
+        friend_graph.invalidate(current_user.id, user_id)
+        flash('Удалено из друзей' if removed else 'Заявка отменена', 'success')
+    except Exception:
+        db.session.rollback()
+        flash('Ошибка при удалении из друзей', 'error')
+    
+    return redirect('/')
+
+@app.route('/friends/mutual/<int:user_id>')
+@login_required
+def friends_mutual(user_id):
+    mutual_ids = friend_graph.mutual(current_user.id, user_id)
+    users = User.query.filter(User.id.in_(mutual_ids)).all() if mutual_ids else []
+    return jsonify({
+        'count': len(mutual_ids),
+        'users': [{'id': user.id, 'username': user.username, 'full_name': user.full_name} for user in users]
+    })
+
+@app.route('/friends/suggestions')
+@login_required
+def friends_suggestions():
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify({
+        'users': [
+            {'id': user.id, 'username': user.username, 'full_name': user.full_name, 'mutual': mutual}
+            for user, mutual in suggested_friends(current_user.id, limit)
+        ]
+    })
+
+# ============ ПРОСМОТРЫ ============
+class HyperLogLog:
+    # Приблизительный подсчёт уникальных значений: 2^precision однобайтовых регистров
+    def __init__(self, precision=10, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is not None and len(registers) == self.size:
+            self.registers = bytearray(registers)
+        else:
+            self.registers = bytearray(self.size)
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Поправка для малых значений (linear counting)
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+class ViewCounter:
+    # Копит показы в памяти и периодически сбрасывает в БД агрегированными дельтами
+    def __init__(self, flush_interval=10, max_pending=5000, precision=10):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.precision = precision
+        self._views = Counter()
+        self._viewers = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker_pid = None
+
+    def record(self, post_ids, viewer_id):
+        with self._lock:
+            for post_id in post_ids:
+                self._views[post_id] += 1
+                self._viewers.setdefault(post_id, set()).add(viewer_id)
+            pending = len(self._views)
+        
+        self._ensure_worker()
+        if pending >= self.max_pending:
+            self._wake.set()
+
+    def _ensure_worker(self):
+        # Поток запускается лениво в каждом процессе (после fork у gunicorn)
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, name='view-counter', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                app.logger.warning('Не удалось сохранить просмотры: %s', e)
+
+    def _restore(self, views, viewers):
+        with self._lock:
+            self._views.update(views)
+            for post_id, viewer_ids in viewers.items():
+                self._viewers.setdefault(post_id, set()).update(viewer_ids)
+
+    def flush(self):
+        with self._lock:
+            views, viewers = self._views, self._viewers
+            self._views, self._viewers = Counter(), {}
+        
+        if not views:
+            return 0
+        
+        posts_table = Post.__table__
+        try:
+            post_ids = sorted(views)
+            for start in range(0, len(post_ids), 500):
+                chunk = post_ids[start:start + 500]
+                
+                # Один UPDATE на пачку: views_count + CASE id WHEN ... THEN delta END
+                db.session.query(Post).filter(Post.id.in_(chunk)).update({
+                    Post.views_count: db.func.coalesce(Post.views_count, 0)
+                    + db.case({post_id: views[post_id] for post_id in chunk}, value=Post.id, else_=0),
+                    Post.updated_at: Post.updated_at
+                }, synchronize_session=False)
+                
+                rows = db.session.query(Post.id, Post.viewers_hll).filter(
+                    Post.id.in_(chunk)
+                ).with_for_update().all()
+                
+                sketches = []
+                for post_id, stored in rows:
+                    sketch = HyperLogLog(self.precision, stored)
+                    for viewer_id in viewers.get(post_id, ()):
+                        sketch.add(viewer_id)
+                    sketches.append({'post_id': post_id, 'hll': sketch.to_bytes(), 'estimate': sketch.count()})
+                
+                if sketches:
+                    db.session.execute(
+                        posts_table.update()
+                        .where(posts_table.c.id == db.bindparam('post_id'))
+                        .values(
+                            viewers_hll=db.bindparam('hll'), unique_viewers=db.bindparam('estimate'),
+                            updated_at=posts_table.c.updated_at
+                        ),
+                        sketches
+                    )
+            
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._restore(views, viewers)
+            raise
+        
+        return len(views)
+
+view_counter = ViewCounter(
+    flush_interval=float(os.environ.get('VIEW_FLUSH_INTERVAL', 10)),
+    max_pending=int(os.environ.get('VIEW_FLUSH_MAX_PENDING', 5000))
+)
+
+@atexit.register
+def flush_views_on_exit():
+    try:
+        with app.app_context():
+            view_counter.flush()
+    except Exception:
+        pass
+
+# ============ ОПРОСЫ ============
+POLL_MAX_OPTIONS = 10
+
+def parse_poll_options(raw):
+    options = []
+    for line in (raw or '').splitlines():
+        line = line.strip()[:200]
+        if line and line not in options:
+            options.append(line)
+    return options[:POLL_MAX_OPTIONS]
+
+def load_polls(post_ids, user_id):
+    # Два запроса на всю страницу: варианты и голоса текущего пользователя
+    if not post_ids:
+        return {}, {}
+    
+    options = {}
+    for option in PollOption.query.filter(PollOption.post_id.in_(post_ids)).order_by(PollOption.post_id, PollOption.position):
+        options.setdefault(option.post_id, []).append(option)
+    
+    voted = {}
+    if options:
+        voted = dict(db.session.query(PollVote.post_id, PollVote.option_id).filter(
+            PollVote.user_id == user_id, PollVote.post_id.in_(list(options))
+        ).all())
+    
+    return options, voted
+
+def poll_results(options):
+    total = sum(option.votes_count or 0 for option in options)
+    return total, [
+        (option, round(100 * (option.votes_count or 0) / total) if total else 0)
+        for option in options
+    ]
+
+def poll_json(post_id, polls):
+    options, voted = polls
+    if post_id not in options:
+        return None
+    
+    total, results = poll_results(options[post_id])
+    return {
+        'post_id': post_id,
+        'total': total,
+        'voted_option_id': voted.get(post_id),
+        'options': [
+            {'id': option.id, 'text': option.text, 'votes': option.votes_count or 0, 'percent': percent}
+            for option, percent in results
+        ]
+    }
+
+def poll_html(post_id, polls):
+    options, voted = polls
+    if post_id not in options:
+        return ''
+    
+    total, results = poll_results(options[post_id])
+    voted_option = voted.get(post_id)
+    rows = ''
+    for option, percent in results:
+        color = '#bf00ff' if option.id == voted_option else 'rgba(124, 58, 237, 0.3)'
+        label = f'{escape(option.text)} — {percent}% ({option.votes_count or 0})'
+        if voted_option:
+            rows += f'<div style="padding: 0.5rem; margin-bottom: 0.4rem; border: 1px solid {color}; border-radius: 8px; background: linear-gradient(90deg, rgba(124, 58, 237, 0.3) {percent}%, transparent {percent}%);">{label}</div>'
+        else:
+            rows += f'''<form method="POST" action="/poll/{post_id}/vote/{option.id}" style="margin-bottom: 0.4rem;">
+                                    <button type="submit" style="width: 100%; text-align: left; padding: 0.5rem; background: none; border: 1px solid {color}; border-radius: 8px; color: white; cursor: pointer;">{escape(option.text)}</button>
+                                </form>'''
+    return f'<div style="margin-bottom: 1rem;">{rows}<div style="color: #9ca3af; font-size: 0.8rem;">Голосов: {total}</div></div>'
+
+def create_poll(post_id, option_texts):
+    db.session.add_all([
+        PollOption(post_id=post_id, position=position, text=text)
+        for position, text in enumerate(option_texts)
+    ])
+
+@app.route('/poll/<int:post_id>/vote/<int:option_id>', methods=['POST'])
+@login_required
+def poll_vote(post_id, option_id):
+    if not visible_post(post_id, current_user.id) or not PollOption.query.filter_by(id=option_id, post_id=post_id).first():
+        flash('Вариант не найден', 'error')
+        return redirect('/')
+    
+    try:
+        # Один голос на пользователя гарантирует уникальный индекс, счётчик растёт атомарно в SQL
+        db.session.add(PollVote(post_id=post_id, option_id=option_id, user_id=current_user.id))
+        db.session.flush()
+        PollOption.query.filter_by(id=option_id).update(
+            {PollOption.votes_count: PollOption.votes_count + 1}, synchronize_session=False
+        )
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash('Вы уже проголосовали', 'error')
+    
+    return redirect('/')
+
+@app.route('/poll/<int:post_id>')
+@login_required
+def poll_view(post_id):
+    if not visible_post(post_id, current_user.id):
+        return jsonify({'error': 'not found'}), 404
+    
+    options, voted = load_polls([post_id], current_user.id)
+    if post_id not in options:
+        return jsonify({'error': 'not found'}), 404
+    
+    return jsonify(poll_json(post_id, (options, voted)))
+
+@app.cli.command('migrate-polls')
+def migrate_polls():
+    # Переносит старые опросы из Post.poll_data (JSON) в poll_options
+    migrated = 0
+    for post in Post.query.filter(Post.poll_data.isnot(None)).yield_per(500):
+        if PollOption.query.filter_by(post_id=post.id).first():
+            continue
+        try:
+            data = json.loads(post.poll_data)
+        except ValueError:
+            continue
+        
+        raw_options = data.get('options', []) if isinstance(data, dict) else data
+        for position, raw in enumerate(raw_options[:POLL_MAX_OPTIONS]):
+            text = raw.get('text', '') if isinstance(raw, dict) else str(raw)
+            votes = raw.get('votes', 0) if isinstance(raw, dict) else 0
+            if text.strip():
+                db.session.add(PollOption(post_id=post.id, position=position, text=text.strip()[:200], votes_count=int(votes or 0)))
+        migrated += 1
+    
+    db.session.commit()
+    print(f'Перенесено опросов: {migrated}')
+
+# ============ МЕДИА ============
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media'))
+MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES', 20 * 1024 * 1024))
+MEDIA_CHUNK_SIZE = 64 * 1024
+MEDIA_CACHE_SECONDS = 365 * 24 * 3600
+MEDIA_TYPES = {
+    'image/jpeg': ('jpg', 'image'),
+    'image/png': ('png', 'image'),
+    'image/gif': ('gif', 'image'),
+    'image/webp': ('webp', 'image'),
+    'video/mp4': ('mp4', 'video'),
+    'video/webm': ('webm', 'video'),
+}
+MEDIA_KINDS = dict(MEDIA_TYPES.values())
+MEDIA_VARIANTS = {'thumb': 320, 'web': 1280}
+MEDIA_NAME_RE = re.compile(r'^[0-9a-f]{64}(\.thumb|\.web)?\.(jpg|png|gif|webp|mp4|webm)$')
+
+class MediaTooLarge(Exception):
+    pass
+
+def sniff_media_type(head):
+    # Тип определяем по сигнатуре файла, а не по заголовкам клиента
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:8] == b'ftyp':
+        return 'video/mp4'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm'
+    return None
+
+def media_path(name):
+    return os.path.join(MEDIA_ROOT, name[:2], name)
+
+def save_media(stream):
+    # Пишем поток кусками во временный файл, считая sha256 на лету; имя файла = хэш
+    os.makedirs(MEDIA_ROOT, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    content_type = None
+    fd, tmp_path = tempfile.mkstemp(dir=MEDIA_ROOT, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(MEDIA_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if content_type is None:
+                    content_type = sniff_media_type(chunk)
+                    if content_type is None:
+                        raise ValueError('unsupported media type')
+                size += len(chunk)
+                if size > MEDIA_MAX_BYTES:
+                    raise MediaTooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+        
+        if content_type is None:
+            raise ValueError('empty upload')
+        
+        extension, kind = MEDIA_TYPES[content_type]
+        name = f'{digest.hexdigest()}.{extension}'
+        path = media_path(name)
+        if os.path.exists(path):
+            # Такой файл уже загружали — дубликат не храним
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    
+    return name, kind
+
+def render_media_variants(path):
+    # Выполняется в обработчике задач; готовые варианты не пересоздаются
+    from PIL import Image
+    
+    base = path.rsplit('.', 1)[0]
+    with Image.open(path) as image:
+        for variant, max_side in MEDIA_VARIANTS.items():
+            target = f'{base}.{variant}.jpg'
+            if os.path.exists(target):
+                continue
+            resized = image.convert('RGB')
+            resized.thumbnail((max_side, max_side))
+            tmp_target = f'{target}.tmp'
+            resized.save(tmp_target, 'JPEG', quality=85, optimize=True, progressive=True)
+            os.replace(tmp_target, target)
+
+def media_html(post):
+    if not post.media_url:
+        return ''
+    
+    if post.media_type == 'video':
+        return f'<video src="{post.media_url}" controls preload="metadata" style="width: 100%; border-radius: 10px; margin-bottom: 1rem;"></video>'
+    
+    # Наличие вариантов записывает задача media_variants — при рендере на диск не смотрим
+    src = post.media_url
+    if 'web' in (post.media_variants or '').split(','):
+        src = f'{post.media_url.rsplit(".", 1)[0]}.web.jpg'
+    return f'<img src="{src}" loading="lazy" alt="" style="width: 100%; border-radius: 10px; margin-bottom: 1rem;">'
+
+def attach_media(post, upload=None, media_url=''):
+    # Файл из формы (multipart) или ссылка на уже загруженный через /media/upload
+    if upload and upload.filename:
+        name, kind = save_media(upload.stream)
+    else:
+        name = (media_url or '').rsplit('/', 1)[-1]
+        match = MEDIA_NAME_RE.match(name)
+        if not match or match.group(1) or not os.path.exists(media_path(name)):
+            return
+        kind = MEDIA_KINDS[match.group(2)]
+    
+    post.media_type = kind
+    post.media_url = f'/media/{name}'
+
+@app.route('/media/upload', methods=['POST'])
+@login_required
+def media_upload():
+    if request.content_length and request.content_length > MEDIA_MAX_BYTES:
+        return jsonify({'error': 'too large'}), 413
+    
+    try:
+        name, kind = save_media(request.stream)
+    except MediaTooLarge:
+        return jsonify({'error': 'too large'}), 413
+    except ValueError:
+        return jsonify({'error': 'unsupported media type'}), 415
+    
+    return jsonify({'url': f'/media/{name}', 'media_type': kind}), 201
+
+@app.route('/media/<name>')
+def media_file(name):
+    if not MEDIA_NAME_RE.match(name):
+        abort(404)
+    
+    # Имена неизменяемы (хэш содержимого), поэтому кэшируем навсегда; Range обрабатывает send_file
+    response = send_from_directory(os.path.join(MEDIA_ROOT, name[:2]), name, conditional=True, max_age=MEDIA_CACHE_SECONDS)
+    response.headers['Cache-Control'] = f'public, max-age={MEDIA_CACHE_SECONDS}, immutable'
+    return response
+
+# ============ РЕЙТИНГИ ============
+class Leaderboard:
+    # Топ-N по одной колонке и гистограмма для «моего места» в общем кэше. Изменение, которое задевает
+    # топ, сбрасывает его пространство во всех воркерах; пересборка — один запрос по индексу (column, id)
+    def __init__(self, column, size=100, ttl=300, bucket_width=1, histogram_ttl=300):
+        self.column = column
+        self.size = size
+        self.ttl = ttl
+        self.bucket_width = bucket_width
+        self.histogram_ttl = histogram_ttl
+        self.namespace = f'leaderboard:{column.key}'
+        # Гистограмма — отдельное пространство: GROUP BY по всем пользователям не повторяем из-за топа
+        self.histogram_namespace = f'leaderboard_histogram:{column.key}'
+
+    def _load(self):
+        rows = db.session.query(User.id, User.username, User.full_name, User.avatar_color, self.column).order_by(
+            self.column.desc(), User.id.desc()
+        ).limit(self.size).all()
+        return tuple(
+            (value or 0, {'id': user_id, 'username': username, 'full_name': full_name, 'avatar_color': avatar_color})
+            for user_id, username, full_name, avatar_color, value in rows
+        )
+
+    def _rows(self):
+        return cache.get_or_set(self.namespace, self.size, self._load, ttl=self.ttl)
+
+    def top(self, limit=None):
+        return [(position, value, user) for position, (value, user) in enumerate(self._rows()[:limit or self.size], start=1)]
+
+    def update(self, users):
+        # Сброс, если кто-то из users уже в топе или теперь обгоняет последнего в полном топе
+        rows = cache.get(self.namespace, self.size)
+        if rows is None:
+            return
+        
+        in_top = {user['id'] for _, user in rows}
+        last = (rows[-1][0], rows[-1][1]['id']) if len(rows) == self.size else None
+        for user in users:
+            if user.id in in_top or last is None or (getattr(user, self.column.key) or 0, user.id) > last:
+                cache.invalidate(self.namespace)
+                return
+
+    def invalidate(self):
+        cache.invalidate(self.namespace)
+        cache.invalidate(self.histogram_namespace)
+
+    def _load_histogram(self):
+        bucket = (self.column // self.bucket_width).label('bucket')
+        rows = db.session.query(bucket, db.func.count(User.id)).group_by(bucket).all()
+        return {int(bucket or 0): count for bucket, count in rows}
+
+    def rank(self, user):
+        # Точное место, если пользователь в топе, иначе оценка по гистограмме; второй элемент — признак точности
+        for position, (_, cached) in enumerate(self._rows(), start=1):
+            if cached['id'] == user.id:
+                return position, True
+        
+        value = getattr(user, self.column.key) or 0
+        histogram = cache.get_or_set(self.histogram_namespace, self.bucket_width, self._load_histogram, ttl=self.histogram_ttl)
+        own_bucket = value // self.bucket_width
+        above = sum(count for bucket, count in histogram.items() if bucket > own_bucket)
+        within = histogram.get(own_bucket, 0)
+        
+        share_above = ((own_bucket + 1) * self.bucket_width - 1 - value) / self.bucket_width
+        return above + int(within * share_above) + 1, False
+
+LEADERBOARD_TTL = int(os.environ.get('LEADERBOARD_TTL', 300))
+LEADERBOARDS = {
+    'level': ('Уровень', Leaderboard(User.level, ttl=LEADERBOARD_TTL, bucket_width=1)),
+    'xp': ('Опыт', Leaderboard(User.xp, ttl=LEADERBOARD_TTL, bucket_width=100)),
+    'coins': ('Монеты', Leaderboard(User.coins, ttl=LEADERBOARD_TTL, bucket_width=100)),
+}
+
+def update_leaderboards(users):
+    for _, leaderboard in LEADERBOARDS.values():
+        leaderboard.update(users)
+
+@app.route('/leaderboard')
+@app.route('/leaderboard/<board>')
+@login_required
+def leaderboard(board='level'):
+    if board not in LEADERBOARDS:
+        abort(404)
+    
+    title, ranking = LEADERBOARDS[board]
+    position, exact = ranking.rank(current_user)
+    
+    tabs = ''.join([
+        f'<a href="/leaderboard/{key}" style="color: {"#bf00ff" if key == board else "#a855f7"}; margin-right: 1rem;">{name}</a>'
+        for key, (name, _) in LEADERBOARDS.items()
+    ])
+    rows = ''.join([f'''
+            <tr style="{'color: #bf00ff; font-weight: bold;' if user['id'] == current_user.id else ''}">
+                <td style="padding: 0.5rem;">{rank}</td>
+                <td style="padding: 0.5rem;">{escape(user['full_name'] or user['username'])} <span style="color: #9ca3af;">@{escape(user['username'])}</span></td>
+                <td style="padding: 0.5rem; text-align: right;">{value}</td>
+            </tr>''' for rank, value, user in ranking.top(50)])
+    
+    return f'''
+    <!DOCTYPE html>
+    <html lang="ru">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Netta | Рейтинг</title>
+        <style>
+            body {{ background: #0a0a1a; color: white; font-family: 'Segoe UI', sans-serif; margin: 0; padding: 2rem; }}
+            .card {{ max-width: 700px; margin: 0 auto; background: rgba(20, 15, 40, 0.9); border: 2px solid rgba(124, 58, 237, 0.3); border-radius: 15px; padding: 1.5rem; }}
+            table {{ width: 100%; border-collapse: collapse; }}
+            a {{ text-decoration: none; }}
+        </style>
+    </head>
+    <body>
+        <div class="card">
+            <a href="/" style="color: #a855f7;">← На главную</a>
+            <h2 style="margin: 1rem 0;">Рейтинг: {title}</h2>
+            <div style="margin-bottom: 1rem;">{tabs}</div>
+            <p style="color: #9ca3af; margin-bottom: 1rem;">Ваше место: {'' if exact else '≈'}{position}</p>
+            <table>{rows}</table>
         </div>
+    </body>
+    </html>
+    '''
+
+# ============ ОПЫТ И МОНЕТЫ ============
+XP_PER_LEVEL = 100
+LEVEL_UP_COINS = 50
+
+def level_for_xp(xp):
+    return (xp or 0) // XP_PER_LEVEL + 1
+
+def award(user_id, xp=0, coins=0, reason=None, reference_id=None, key=None):
+    # Только запись в журнал: строка users не блокируется в транзакции запроса
+    event = XpEvent(user_id=user_id, xp=xp, coins=coins, reason=reason, reference_id=reference_id, idempotency_key=key)
+    if key is None:
+        db.session.add(event)
+        return True
+    
+    # Награда с тем же ключом уже начислена — повтор отбрасываем, как в job_queue.enqueue
+    try:
+        with db.session.begin_nested():
+            db.session.add(event)
+    except IntegrityError:
+        return False
+    return True
+
+def apply_totals(user, xp, coins):
+    old_level = user.level or 1
+    user.xp = (user.xp or 0) + xp
+    new_level = max(old_level, level_for_xp(user.xp))
+    user.coins = (user.coins or 0) + coins + LEVEL_UP_COINS * (new_level - old_level)
+    user.level = new_level
+
+def open_balances(users, exclude_ids=()):
+    # Начальный баланс — состояние строки users до событий журнала: из неё вычитаются уже применённые
+    # события (кроме exclude_ids), так что apply_totals от него воспроизводит текущие xp/level/coins
+    keys = {f'opening:{user.id}': user for user in users}
+    opened = {key for key, in db.session.query(XpEvent.idempotency_key).filter(XpEvent.idempotency_key.in_(keys))}
+    users = [user for key, user in keys.items() if key not in opened]
+    if not users:
+        return 0
+    
+    applied = {
+        user_id: (xp or 0, coins or 0)
+        for user_id, xp, coins in db.session.query(
+            XpEvent.user_id, db.func.sum(XpEvent.xp), db.func.sum(XpEvent.coins)
+        ).filter(
+            XpEvent.user_id.in_([user.id for user in users]),
+            XpEvent.applied_at.isnot(None),
+            XpEvent.id.notin_(exclude_ids)
+        ).group_by(XpEvent.user_id)
+    }
+    for user in users:
+        applied_xp, applied_coins = applied.get(user.id, (0, 0))
+        xp = (user.xp or 0) - applied_xp
+        level = user.level or 1
+        if level == level_for_xp(user.xp):
+            # Уровень мог вырасти от событий; выше опыта он бывает только у старых данных — тогда он исходный
+            level = min(level, level_for_xp(xp))
+        db.session.add(XpEvent(
+            user_id=user.id,
+            xp=xp,
+            coins=(user.coins or 0) - applied_coins - LEVEL_UP_COINS * ((user.level or 1) - level),
+            level=level,
+            reason='opening',
+            idempotency_key=f'opening:{user.id}',
+            applied_at=datetime.utcnow()
+        ))
+    return len(users)
+
+Balance = namedtuple('Balance', ['id', 'level', 'xp', 'coins'])
+
+class XpLedger:
+    # Периодически применяет накопленные события журнала к users пачками
+    def __init__(self, interval=5, batch_size=1000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker_pid = None
+
+    def notify(self):
+        self._ensure_worker()
+        self._wake.set()
+
+    def _ensure_worker(self):
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, name='xp-ledger', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    while self.apply_pending() == self.batch_size:
+                        pass
+            except Exception as e:
+                app.logger.warning('Не удалось применить журнал опыта: %s', e)
+
+    def apply_pending(self):
+        event_ids = [event_id for event_id, in db.session.query(XpEvent.id).filter(
+            XpEvent.applied_at.is_(None)
+        ).order_by(XpEvent.id).limit(self.batch_size)]
+        if not event_ids:
+            db.session.rollback()
+            return 0
         
-        <h1 class="auth-title">СОЗДАТЬ АККАУНТ</h1>
+        try:
+            # Захват пачки условным UPDATE: если другой процесс успел раньше, отступаем
+            claimed = XpEvent.query.filter(
+                XpEvent.id.in_(event_ids), XpEvent.applied_at.is_(None)
+            ).update({XpEvent.applied_at: datetime.utcnow()}, synchronize_session=False)
+            if claimed != len(event_ids):
+                db.session.rollback()
+                return 0
+            
+            totals = {
+                user_id: (xp or 0, coins or 0)
+                for user_id, xp, coins in db.session.query(
+                    XpEvent.user_id, db.func.sum(XpEvent.xp), db.func.sum(XpEvent.coins)
+                ).filter(XpEvent.id.in_(event_ids)).group_by(XpEvent.user_id)
+            }
+            
+            users = User.query.filter(User.id.in_(sorted(totals))).order_by(User.id).with_for_update().all()
+            # Первое применённое событие пользователя открывает его баланс в той же транзакции
+            open_balances(users, exclude_ids=event_ids)
+            balances = []
+            leveled = False
+            for user in users:
+                level = user.level
+                apply_totals(user, *totals[user.id])
+                leveled = leveled or user.level != level
+                # Значения до фиксации: после commit строки истекают и перечитывались бы по одной
+                balances.append(Balance(user.id, user.level, user.xp, user.coins))
+            
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
         
-        {% with messages = get_flashed_messages(with_categories=true) %}
-            {% if messages %}
-                {% for category, message in messages %}
-                    <div class="flash-message flash-{{ category }}">
-                        {{ message }}
-                    </div>
-                {% endfor %}
-            {% endif %}
-        {% endwith %}
+        update_leaderboards(balances)
+        if leveled:
+            # Уровень участвует в ранжировании подсказок имён
+            cache.invalidate('usernames')
+        return len(event_ids)
+
+xp_ledger = XpLedger(
+    interval=float(os.environ.get('XP_APPLY_INTERVAL', 5)),
+    batch_size=int(os.environ.get('XP_APPLY_BATCH', 1000))
+)
+
+def open_ledger(chunk_size=1000):
+    # Начальные балансы всем, у кого их ещё нет, в том числе пользователям с уже начисленными событиями
+    opened = 0
+    last_id = 0
+    while True:
+        users = User.query.filter(User.id > last_id).order_by(User.id).limit(chunk_size).with_for_update().all()
+        if not users:
+            break
+        opened += open_balances(users)
+        db.session.commit()
+        last_id = users[-1].id
+    return opened
+
+@app.cli.command('xp-open-ledger')
+def xp_open_ledger():
+    print(f'Открыто балансов: {open_ledger()}')
+
+@app.cli.command('xp-rebuild')
+def xp_rebuild():
+    # Пересчёт xp/level/coins всех пользователей из журнала: от начального баланса по тому же
+    # правилу apply_totals, что и при начислении (уровень не понижается)
+    while xp_ledger.apply_pending():
+        pass
+    open_ledger()
+    
+    rebuilt = 0
+    last_id = 0
+    while True:
+        users = User.query.filter(User.id > last_id).order_by(User.id).limit(1000).with_for_update().all()
+        if not users:
+            break
+        
+        user_ids = [user.id for user in users]
+        openings = {event.user_id: event for event in XpEvent.query.filter(
+            XpEvent.idempotency_key.in_([f'opening:{user_id}' for user_id in user_ids])
+        )}
+        # Суммы включают начальный баланс — его вычитаем ниже; неприменённые события применит журнал
+        totals = dict(
+            (user_id, (xp or 0, coins or 0, events)) for user_id, xp, coins, events in db.session.query(
+                XpEvent.user_id, db.func.sum(XpEvent.xp), db.func.sum(XpEvent.coins), db.func.count(XpEvent.id)
+            ).filter(XpEvent.user_id.in_(user_ids), XpEvent.applied_at.isnot(None)).group_by(XpEvent.user_id)
+        )
+        for user in users:
+            opening = openings[user.id]
+            xp, coins, events = totals[user.id]
+            user.xp, user.level, user.coins = opening.xp, opening.level, opening.coins
+            if events > 1:
+                apply_totals(user, xp - opening.xp, coins - opening.coins)
+        
+        db.session.commit()
+        rebuilt += len(users)
+        last_id = users[-1].id
+    
+    for _, leaderboard in LEADERBOARDS.values():
+        leaderboard.invalidate()
+    print(f'Пересчитано пользователей: {rebuilt}')
+
+# ============ МИГРАЦИИ ============
+# Выпущенная миграция не меняется: новые колонки и индексы — только новой версией со своим списком.
+# Типы и колонки индексов записаны прямо в миграции, а не берутся из моделей, которые живут дальше
+def add_columns(connection, columns):
+    # create_all() не добавляет колонки в существующие таблицы
+    inspector = db.inspect(connection)
+    for table_name, column_name, column_type in columns:
+        if column_name in {column['name'] for column in inspector.get_columns(table_name)}:
+            continue
+        connection.exec_driver_sql(
+            f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type.compile(dialect=connection.dialect)}'
+        )
+
+def create_indexes(connection, indexes):
+    # На Postgres строим CONCURRENTLY, чтобы не блокировать запись; секционированные таблицы так не умеют
+    inspector = db.inspect(connection)
+    postgres = connection.dialect.name == 'postgresql'
+    for table_name, name, columns, unique in indexes:
+        if name in {index['name'] for index in inspector.get_indexes(table_name)}:
+            continue
+        concurrently = postgres and connection.exec_driver_sql(
+            'SELECT relkind FROM pg_class WHERE relname = %(table)s', {'table': table_name}
+        ).scalar() != 'p'
+        # IF NOT EXISTS — для индексов по выражениям, которых инспектор SQLite не видит
+        connection.exec_driver_sql(
+            f'CREATE {"UNIQUE " if unique else ""}INDEX {"CONCURRENTLY " if concurrently else ""}'
+            f'IF NOT EXISTS {name} ON {table_name} ({", ".join(columns)})'
+        )
+
+def add_legacy_columns(connection):
+    add_columns(connection, [
+        ('users', 'xp', db.Integer()),
+        ('users', 'cover_color', db.String(7)),
+        ('posts', 'unique_viewers', db.Integer()),
+        ('posts', 'viewers_hll', db.LargeBinary()),
+    ])
+
+def create_hot_query_indexes(connection):
+    create_indexes(connection, [
+        ('users', 'ix_users_coins_rank', ('coins', 'id'), False),
+        ('users', 'ix_users_level_rank', ('level', 'id'), False),
+        ('users', 'ix_users_xp_rank', ('xp', 'id'), False),
+        ('friendships', 'ix_friendships_friend_status', ('friend_id', 'status'), False),
+        ('friendships', 'uq_friendships_pair', ('user_id', 'friend_id'), True),
+        ('messages', 'ix_messages_receiver_created', ('receiver_id', 'created_at'), False),
+        ('messages', 'ix_messages_sender_created', ('sender_id', 'created_at'), False),
+        ('notifications', 'ix_notifications_user_created', ('user_id', 'created_at'), False),
+        ('posts', 'ix_posts_created', ('created_at', 'id'), False),
+        ('posts', 'ix_posts_privacy_created', ('privacy', 'created_at', 'id'), False),
+        ('posts', 'ix_posts_user_created', ('user_id', 'created_at', 'id'), False),
+        ('xp_events', 'ix_xp_events_pending', ('applied_at', 'id'), False),
+        ('xp_events', 'ix_xp_events_user_id', ('user_id',), False),
+        ('comments', 'ix_comments_post_created', ('post_id', 'created_at'), False),
+        ('comments', 'ix_comments_user', ('user_id',), False),
+        ('likes', 'ix_likes_post', ('post_id',), False),
+        ('likes', 'ix_likes_user_post', ('user_id', 'post_id'), False),
+        ('poll_options', 'ix_poll_options_post_id', ('post_id',), False),
+        ('poll_votes', 'ix_poll_votes_option_id', ('option_id',), False),
+        ('poll_votes', 'ix_poll_votes_user_id', ('user_id',), False),
+        ('poll_votes', 'uq_poll_votes_post_user', ('post_id', 'user_id'), True),
+    ])
+
+def create_archive_indexes(connection):
+    create_indexes(connection, [
+        ('jobs', 'ix_jobs_kind_status', ('kind', 'status', 'run_at'), False),
+        ('jobs', 'ix_jobs_status_run_at', ('status', 'run_at', 'id'), False),
+        ('jobs', 'uq_jobs_idempotency_key', ('idempotency_key',), True),
+        ('comments_archive', 'ix_comments_archive_post_created', ('post_id', 'created_at'), False),
+        ('likes_archive', 'ix_likes_archive_post', ('post_id',), False),
+        ('likes_archive', 'ix_likes_archive_user_post', ('user_id', 'post_id'), False),
+        ('notifications', 'ix_notifications_read_created', ('is_read', 'created_at', 'id'), False),
+        ('notifications_archive', 'ix_notifications_archive_user_created', ('user_id', 'created_at'), False),
+        ('posts_archive', 'ix_posts_archive_user_created', ('user_id', 'created_at'), False),
+    ])
+
+def add_hot_scores(connection):
+    add_columns(connection, [('posts', 'hot_score', db.Float())])
+    create_indexes(connection, [
+        ('posts', 'ix_posts_privacy_hot', ('privacy', 'hot_score', 'id'), False),
+        ('posts', 'ix_posts_user_hot', ('user_id', 'hot_score', 'id'), False),
+    ])
+    
+    # Формула балла — как при выпуске миграции, а не текущая hot_score: её изменения пересчитывает
+    # refresh_hot_scores, и результат уже применённой миграции от них не зависит
+    epoch = datetime(2024, 1, 1)
+    decay = float(os.environ.get('HOT_SCORE_DECAY', 45000))
+    
+    def score(row):
+        engagement = (row.likes_count or 0) + 2 * (row.comments_count or 0) + 3 * (row.shares_count or 0)
+        return math.log10(max(engagement, 1)) + ((row.created_at or epoch) - epoch).total_seconds() / decay
+    
+    posts = db.table(
+        'posts', db.column('id'), db.column('likes_count'), db.column('comments_count'),
+        db.column('shares_count'), db.column('created_at', db.DateTime), db.column('hot_score')
+    )
+    while True:
+        rows = connection.execute(db.select(
+            posts.c.id, posts.c.likes_count, posts.c.comments_count, posts.c.shares_count, posts.c.created_at
+        ).where(posts.c.hot_score.is_(None)).limit(1000)).all()
+        if not rows:
+            break
+        connection.execute(
+            posts.update().where(posts.c.id == db.bindparam('post_id')).values(hot_score=db.bindparam('score')),
+            [{'post_id': row.id, 'score': score(row)} for row in rows]
+        )
+
+def add_rendered_content(connection):
+    add_columns(connection, [
+        ('posts', 'content_html', db.Text()),
+        ('posts', 'content_html_version', db.Integer()),
+        ('posts_archive', 'content_html', db.Text()),
+        ('posts_archive', 'content_html_version', db.Integer()),
+    ])
+
+def add_geolocation(connection):
+    # Старое текстовое поле location остаётся подписью места: геокодировать его без внешних сервисов нечем
+    add_columns(connection, [
+        ('posts', 'latitude', db.Float()),
+        ('posts', 'longitude', db.Float()),
+        ('posts', 'geohash', db.String(12)),
+        ('posts_archive', 'latitude', db.Float()),
+        ('posts_archive', 'longitude', db.Float()),
+        ('posts_archive', 'geohash', db.String(12)),
+    ])
+    create_indexes(connection, [('posts', 'ix_posts_geohash_created', ('geohash', 'created_at', 'id'), False)])
+
+def create_friend_feed_indexes(connection):
+    create_indexes(connection, [
+        ('posts', 'ix_posts_user_privacy_created', ('user_id', 'privacy', 'created_at', 'id'), False),
+        ('posts', 'ix_posts_user_privacy_hot', ('user_id', 'privacy', 'hot_score', 'id'), False),
+    ])
+
+def drop_indexes(connection, indexes):
+    postgres = connection.dialect.name == 'postgresql'
+    for name in indexes:
+        connection.exec_driver_sql(f'DROP INDEX {"CONCURRENTLY " if postgres else ""}IF EXISTS {name}')
+
+def add_geohash_cells(connection):
+    # Равенство по ячейке фиксированной точности вместо диапазона по префиксу geohash: индекс
+    # (geohash_cell, created_at, id) отдаёт строки уже в порядке ленты
+    add_columns(connection, [
+        ('posts', 'geohash_cell', db.String(12)),
+        ('posts_archive', 'geohash_cell', db.String(12)),
+    ])
+    for table_name in ('posts', 'posts_archive'):
+        connection.exec_driver_sql(
+            f'UPDATE {table_name} SET geohash_cell = substr(geohash, 1, 5) WHERE geohash IS NOT NULL AND geohash_cell IS NULL'
+        )
+    create_indexes(connection, [('posts', 'ix_posts_geohash_cell_created', ('geohash_cell', 'created_at', 'id'), False)])
+    drop_indexes(connection, ['ix_posts_geohash_created'])
+
+def add_media_variants(connection):
+    # Варианты картинок уже опубликованных постов проверит и при необходимости досоздаст обработчик задач
+    add_columns(connection, [
+        ('posts', 'media_variants', db.String(50)),
+        ('posts_archive', 'media_variants', db.String(50)),
+    ])
+    connection.exec_driver_sql(
+        "INSERT INTO jobs (kind, payload, status, attempts, max_attempts, run_at, created_at) "
+        "SELECT 'media_variants', '{\"post_id\": ' || id || '}', 'queued', 0, 5, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP "
+        "FROM posts WHERE media_type = 'image' AND media_url IS NOT NULL AND media_variants IS NULL"
+    )
+
+def add_xp_ledger_keys(connection):
+    add_columns(connection, [
+        ('xp_events', 'level', db.Integer()),
+        ('xp_events', 'idempotency_key', db.String(200)),
+    ])
+    # Начальные балансы прежнего формата хранили монеты сверх стартовых и бонусов за уровень, а уровень
+    # не хранили вовсе — переводим в абсолютные значения с уровнем по опыту, как считал прежний пересчёт
+    connection.exec_driver_sql(
+        "UPDATE xp_events SET level = xp / 100 + 1, coins = coins + 100 + 50 * (xp / 100), "
+        "idempotency_key = 'opening:' || user_id WHERE reason = 'opening' AND level IS NULL"
+    )
+    # Уже начисленный опыт за лайк не даём получить повторно: ключ у первого события каждой пары
+    connection.exec_driver_sql(
+        "UPDATE xp_events SET idempotency_key = 'like-xp:' || user_id || ':' || reference_id "
+        "WHERE id IN (SELECT min(id) FROM xp_events WHERE reason = 'like' GROUP BY user_id, reference_id) "
+        "AND idempotency_key IS NULL"
+    )
+    create_indexes(connection, [('xp_events', 'uq_xp_events_idempotency_key', ('idempotency_key',), True)])
+
+def add_profile_updated_at(connection):
+    # Существующие строки остаются NULL: их загружает первая полная загрузка индекса имён
+    add_columns(connection, [('users', 'profile_updated_at', db.DateTime())])
+    create_indexes(connection, [('users', 'ix_users_profile_updated', ('profile_updated_at', 'id'), False)])
+
+def create_export_indexes(connection):
+    # Выгрузка идёт по хвосту индекса владельца и id. У архивов ключ составной (id, created_at),
+    # id в индексе не подразумевается — добавляем его явно; новые индексы заменяют старые
+    create_indexes(connection, [
+        ('comments', 'ix_comments_user_id', ('user_id', 'id'), False),
+        ('comments_archive', 'ix_comments_archive_user_id', ('user_id', 'id'), False),
+        ('posts_archive', 'ix_posts_archive_user_created_id', ('user_id', 'created_at', 'id'), False),
+        ('likes_archive', 'ix_likes_archive_user_post_id', ('user_id', 'post_id', 'id'), False),
+    ])
+    drop_indexes(connection, ['ix_comments_user', 'ix_posts_archive_user_created', 'ix_likes_archive_user_post'])
+
+def create_friendship_pair_index(connection):
+    # Встречные строки одной пары сливаем в первую: две заявки навстречу — это согласие обоих,
+    # поэтому пара становится дружбой; счётчики друзей затронутых пользователей пересчитываем
+    reverse = (
+        'EXISTS (SELECT 1 FROM friendships r WHERE r.user_id = friendships.friend_id '
+        'AND r.friend_id = friendships.user_id AND r.id {} friendships.id)'
+    )
+    affected = {
+        user_id for pair in connection.exec_driver_sql(
+            f'SELECT user_id, friend_id FROM friendships WHERE {reverse.format("<>")}'
+        ) for user_id in pair
+    }
+    connection.exec_driver_sql(f"UPDATE friendships SET status = 'accepted' WHERE {reverse.format('>')}")
+    connection.exec_driver_sql(f'DELETE FROM friendships WHERE {reverse.format("<")}')
+    
+    users = db.table('users', db.column('id'), db.column('friends_count'))
+    friendships = db.table('friendships', db.column('user_id'), db.column('friend_id'), db.column('status'))
+    accepted = db.select(db.func.count()).where(
+        friendships.c.status == 'accepted',
+        db.or_(friendships.c.user_id == users.c.id, friendships.c.friend_id == users.c.id)
+    ).scalar_subquery()
+    affected = sorted(affected)
+    for start in range(0, len(affected), 1000):
+        connection.execute(users.update().where(users.c.id.in_(affected[start:start + 1000])).values(friends_count=accepted))
+    
+    create_indexes(connection, [(
+        'friendships', 'uq_friendships_unordered',
+        (
+            '(CASE WHEN user_id < friend_id THEN user_id ELSE friend_id END)',
+            '(CASE WHEN user_id < friend_id THEN friend_id ELSE user_id END)',
+        ),
+        True
+    )])
+
+SCHEMA_MIGRATIONS = [
+    (1, 'add columns missing from create_all', add_legacy_columns),
+    (2, 'hot query indexes', create_hot_query_indexes),
+    (3, 'archive indexes', create_archive_indexes),
+    (4, 'hot score', add_hot_scores),
+    (5, 'rendered post content', add_rendered_content),
+    (6, 'post geolocation', add_geolocation),
+    (7, 'friend feed indexes', create_friend_feed_indexes),
+    (8, 'geohash cells', add_geohash_cells),
+    (9, 'media variants', add_media_variants),
+    (10, 'xp ledger keys', add_xp_ledger_keys),
+    (11, 'profile updated at', add_profile_updated_at),
+    (12, 'export indexes', create_export_indexes),
+    (13, 'friendship pair index', create_friendship_pair_index),
+]
+
+def run_migrations():
+    db.create_all()
+    applied = {version for version, in db.session.query(SchemaMigration.version)}
+    db.session.rollback()
+    
+    done = []
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        for version, name, migrate in SCHEMA_MIGRATIONS:
+            if version in applied:
+                continue
+            migrate(connection)
+            connection.execute(SchemaMigration.__table__.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+            done.append(name)
+        if connection.dialect.name == 'sqlite':
+            # Статистика индексов для планировщика (в Postgres её собирает autovacuum). Без неё SQLite
+            # оценивает все индексы одинаково и может выбрать не тот; analysis_limit ограничивает чтение
+            connection.exec_driver_sql('PRAGMA analysis_limit=1000')
+            connection.exec_driver_sql('ANALYZE')
+    return done
+
+@app.cli.command('migrate')
+def migrate_command():
+    done = run_migrations()
+    for name in done:
+        print(f'Применена миграция: {name}')
+    if not done:
+        print('Схема актуальна')
+
+# ============ МЕТРИКИ ============
+# В gunicorn задайте PROMETHEUS_MULTIPROC_DIR (см. gunicorn.conf.py) — тогда /metrics суммирует все воркеры
+REQUEST_LATENCY = Histogram(
+    'netta_request_latency_seconds', 'Время обработки запроса', ['endpoint', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'netta_requests_in_progress', 'Запросы в обработке', ['endpoint'], multiprocess_mode='livesum'
+)
+SQL_STATEMENTS = Histogram(
+    'netta_sql_statements_per_request', 'SQL-запросов на HTTP-запрос', ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+)
+SQL_TIME = Histogram(
+    'netta_sql_seconds_per_request', 'Время в SQL на HTTP-запрос', ['endpoint'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    'netta_db_pool_checkout_seconds', 'Ожидание соединения из пула', ['bind'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+CACHE_REQUESTS = PrometheusCounter(
+    'netta_cache_requests_total', 'Обращения к кэшам', ['cache', 'result']
+)
+
+def record_cache(cache, hits=0, misses=0):
+    if hits:
+        CACHE_REQUESTS.labels(cache, 'hit').inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache, 'miss').inc(misses)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def sql_started(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def sql_finished(connection, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - connection.info['query_started'].pop()
+    if has_request_context() and 'sql_count' in g:
+        g.sql_count += 1
+        g.sql_time += elapsed
+        if 'profiler' in g and elapsed * 1000 >= PROFILE_SLOW_QUERY_MS:
+            g.profiler.slow_queries.append((elapsed, statement))
+
+@event.listens_for(Engine, 'handle_error')
+def sql_failed(context):
+    # При ошибке after_cursor_execute не вызывается — снимаем отметку сами, иначе стек соединения растёт
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started and context.execution_context is not None:
+        started.pop()
+
+def instrument_pool(bind, engine):
+    pool = engine.pool
+    if getattr(pool, 'checkout_timed', False):
+        return
+    connect = pool.connect
+    
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(bind).observe(time.perf_counter() - started)
+    
+    pool.connect = timed_connect
+    pool.checkout_timed = True
+
+_pools_instrumented = False
+
+@app.before_request
+def start_request_metrics():
+    global _pools_instrumented
+    if not _pools_instrumented:
+        for bind, engine in db.engines.items():
+            instrument_pool(bind or 'primary', engine)
+        _pools_instrumented = True
+    
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    g.metrics_endpoint = request.endpoint or 'unknown'
+    REQUESTS_IN_PROGRESS.labels(g.metrics_endpoint).inc()
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'request_started' not in g:
+        return
+    endpoint = g.metrics_endpoint
+    REQUESTS_IN_PROGRESS.labels(endpoint).dec()
+    REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - g.request_started)
+    SQL_STATEMENTS.labels(endpoint).observe(g.sql_count)
+    SQL_TIME.labels(endpoint).observe(g.sql_time)
+
+@app.route('/metrics')
+def metrics():
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(404)
+    
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+# ============ ПРОФИЛИРОВАНИЕ ============
+# Профиль запроса: заголовок X-Profile от администратора или случайная выборка PROFILE_SAMPLE_RATE
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'netta-profiles'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 2)) / 1000
+PROFILE_SLOW_QUERY_MS = float(os.environ.get('PROFILE_SLOW_QUERY_MS', 10))
+# Администраторы задаются только явно: по умолчанию X-Profile не принимается ни от кого
+ADMIN_USERNAMES = set(filter(None, os.environ.get('ADMIN_USERNAMES', '').split(',')))
+# В каталоге хранятся только последние PROFILE_MAX_FILES профилей, старые удаляются
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+PROFILE_SUFFIXES = ('.collapsed', '.speedscope.json', '.summary.json')
+PROFILE_SQL_PATHS = ('sqlalchemy', 'sqlite3', 'psycopg2')
+PROFILE_TEMPLATE_PATHS = ('jinja2', 'markupsafe')
+
+def classify_stack(stack):
+    kind = 'python'
+    for name, filename, _ in stack:
+        if any(path in filename for path in PROFILE_SQL_PATHS):
+            return 'sql'
+        if any(path in filename for path in PROFILE_TEMPLATE_PATHS) or name.endswith('_html'):
+            kind = 'template'
+    return kind
+
+class RequestSampler:
+    # Снимает стек потока запроса из отдельного потока через заданный интервал
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.kinds = Counter()
+        self.slow_queries = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append((frame.f_code.co_name, frame.f_code.co_filename, frame.f_code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                stack = tuple(reversed(stack))
+                self.stacks[stack] += 1
+                self.kinds[classify_stack(stack)] += 1
+
+    def collapsed(self):
+        return ''.join(
+            ';'.join(f'{name} ({os.path.basename(filename)}:{line})' for name, filename, line in stack) + f' {count}\n'
+            for stack, count in self.stacks.most_common()
+        )
+
+    def speedscope(self, name):
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, count in self.stacks.items():
+            sample = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                sample.append(index[frame])
+            samples.append(sample)
+            weights.append(count * self.interval)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'netta',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+
+def rotate_profiles():
+    profiles = {}
+    for entry in os.scandir(PROFILE_DIR):
+        for suffix in PROFILE_SUFFIXES:
+            if entry.name.endswith(suffix):
+                profile_id = entry.name[:-len(suffix)]
+                profiles.setdefault(profile_id, []).append(entry)
+                break
+    # Сначала самые свежие профили — по времени последней записи их файлов
+    ordered = sorted(profiles.values(), key=lambda files: max(f.stat().st_mtime for f in files), reverse=True)
+    for files in ordered[PROFILE_MAX_FILES:]:
+        for entry in files:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+def profiling_requested():
+    if 'X-Profile' in request.headers:
+        return current_user.is_authenticated and current_user.username in ADMIN_USERNAMES
+    return PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE
+
+@app.before_request
+def start_profiling():
+    if 'X-Profile' not in request.headers and not PROFILE_SAMPLE_RATE:
+        return
+    if not profiling_requested():
+        return
+    
+    g.profile_id = f'{datetime.utcnow():%Y%m%d-%H%M%S}-{request.endpoint or "unknown"}-{os.getpid()}-{random.getrandbits(32):08x}'
+    g.profiler = RequestSampler(threading.get_ident(), PROFILE_INTERVAL)
+    g.profiler.start()
+
+@app.after_request
+def add_profile_header(response):
+    if 'profiler' in g:
+        response.headers['X-Profile-Id'] = g.profile_id
+    return response
+
+@app.teardown_request
+def finish_profiling(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    profiler.stop()
+    
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, g.profile_id)
+        with open(base + '.collapsed', 'w', encoding='utf-8') as out:
+            out.write(profiler.collapsed())
+        with open(base + '.speedscope.json', 'w', encoding='utf-8') as out:
+            json.dump(profiler.speedscope(g.profile_id), out)
+        
+        total = sum(profiler.kinds.values()) or 1
+        with open(base + '.summary.json', 'w', encoding='utf-8') as out:
+            json.dump({
+                'endpoint': request.endpoint,
+                'method': request.method,
+                'path': request.full_path,
+                'duration': profiler.duration,
+                'sql_statements': g.get('sql_count', 0),
+                'sql_time': g.get('sql_time', 0.0),
+                'samples': dict(profiler.kinds),
+                'split': {kind: round(count / total, 3) for kind, count in profiler.kinds.items()},
+                'slow_queries': [
+                    {'seconds': round(seconds, 6), 'statement': statement}
+                    for seconds, statement in sorted(profiler.slow_queries, reverse=True)
+                ],
+            }, out, ensure_ascii=False, indent=2)
+        rotate_profiles()
+    except OSError as e:
+        app.logger.warning('Не удалось сохранить профиль %s: %s', g.profile_id, e)
+
+# ============ JSON API ============
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 50
+API_POST_FIELDS = {
+    'id': lambda post, context: post.id,
+    'content': lambda post, context: post.content,
+    'content_html': lambda post, context: post_html(post),
+    'created_at': lambda post, context: post.created_at.isoformat(),
+    'privacy': lambda post, context: post.privacy,
+    'likes_count': lambda post, context: post.likes_count or 0,
+    'comments_count': lambda post, context: post.comments_count or 0,
+    'views_count': lambda post, context: post.views_count or 0,
+    'media_type': lambda post, context: post.media_type,
+    'media_url': lambda post, context: post.media_url,
+    'location': lambda post, context: {
+        'latitude': post.latitude,
+        'longitude': post.longitude,
+        'name': post.location,
+    } if post.latitude is not None else None,
+    'author': lambda post, context: {
+        'id': post.author.id,
+        'username': post.author.username,
+        'full_name': post.author.full_name,
+        'avatar_color': post.author.avatar_color,
+        'level': post.author.level,
+    },
+    'liked': lambda post, context: post.id in context['liked'],
+    'archived': lambda post, context: isinstance(post, PostArchive),
+    'poll': lambda post, context: poll_json(post.id, context['polls']),
+}
+# Опрос требует отдельных запросов, поэтому отдаётся только по явному ?fields=poll
+API_DEFAULT_FIELDS = tuple(field for field in API_POST_FIELDS if field != 'poll')
+
+def api_login_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def api_fields():
+    requested = request.args.get('fields')
+    if not requested:
+        return API_DEFAULT_FIELDS
+    fields = tuple(field for field in requested.split(',') if field in API_POST_FIELDS)
+    return fields or API_DEFAULT_FIELDS
+
+def serialize_posts(posts, fields):
+    post_ids = [post.id for post in posts]
+    archived_ids = [post.id for post in posts if isinstance(post, PostArchive)]
+    context = {
+        'liked': liked_post_ids(current_user.id, post_ids, archived_ids) if 'liked' in fields else set(),
+        'polls': load_polls(post_ids, current_user.id) if 'poll' in fields else ({}, {}),
+    }
+    return [{field: API_POST_FIELDS[field](post, context) for field in fields} for post in posts]
+
+def encode_cursor(post):
+    return base64.urlsafe_b64encode(f'{post.created_at.isoformat()}|{post.id}'.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    created_at, post_id = raw.split('|')
+    return datetime.fromisoformat(created_at), int(post_id)
+
+def conditional_json(data, status=200):
+    # ETag по телу ответа: при совпадении If-None-Match клиент получает пустой 304
+    response = jsonify(data)
+    response.status_code = status
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/v1/feed')
+@api_login_required
+def api_feed():
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+    before = None
+    if request.args.get('cursor'):
+        try:
+            before = decode_cursor(request.args['cursor'])
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({'error': 'bad cursor'}), 400
+    
+    posts = feed_query(current_user.id, limit=limit, before=before).all()
+    view_counter.record([post.id for post in posts], current_user.id)
+    return conditional_json({
+        'posts': serialize_posts(posts, api_fields()),
+        'next_cursor': encode_cursor(posts[-1]) if len(posts) == limit else None,
+    })
+
+@app.route('/api/v1/posts/<int:post_id>')
+@api_login_required
+def api_post(post_id):
+    # Постоянная ссылка работает и для постов, перенесённых в архив
+    post = visible_post(post_id, current_user.id) or archived_post(post_id, current_user.id)
+    if not post:
+        return jsonify({'error': 'not found'}), 404
+    return conditional_json({'post': serialize_posts([post], api_fields())[0]})
+
+@app.route('/api/v1/posts/<int:post_id>/like', methods=['POST'])
+@api_login_required
+def api_like(post_id):
+    post = visible_post(post_id, current_user.id)
+    if not post:
+        return jsonify({'error': 'not found'}), 404
+    
+    liked = toggle_like(post, current_user)
+    # Счётчик в posts обновит фоновая задача; клиенту отдаём точное значение по индексу likes
+    likes_count = Like.query.filter_by(post_id=post_id).count()
+    return jsonify({'liked': liked, 'likes_count': likes_count})
+
+@app.route('/api/v1/posts', methods=['POST'])
+@api_login_required
+def api_create_post():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'json object required'}), 400
+    content = str(data.get('content', ''))
+    if not content.strip():
+        return jsonify({'error': 'content required'}), 400
+    
+    try:
+        coordinates = parse_coordinates(data.get('latitude'), data.get('longitude'))
+    except ValueError:
+        return jsonify({'error': 'bad coordinates'}), 400
+    
+    poll_options = data.get('poll_options') or []
+    post = publish_post(
+        current_user,
+        content,
+        privacy=data.get('privacy', 'public'),
+        poll_options=parse_poll_options('\n'.join(map(str, poll_options)) if isinstance(poll_options, list) else ''),
+        media_url=str(data.get('media_url', '')),
+        coordinates=coordinates,
+        location=str(data.get('location') or '')
+    )
+    return jsonify({'post': serialize_posts([post], api_fields())[0]}), 201
+
+# ============ ФОНОВЫЕ ЗАДАЧИ ============
+JOB_HANDLERS = {}
+# Типы, которые берёт только отдельный обработчик (flask jobs-worker), но не потоки веб-процесса
+WORKER_ONLY_JOB_KINDS = set()
+
+def job_handler(kind, batch_size=1, worker_only=False):
+    # Обработчик получает список payload'ов задач одного типа. worker_only — для тяжёлой работы
+    # (CPU, большие файлы), которая не должна отнимать время у воркеров gunicorn
+    def register(handler):
+        JOB_HANDLERS[kind] = (handler, batch_size)
+        if worker_only:
+            WORKER_ONLY_JOB_KINDS.add(kind)
+        return handler
+    return register
+
+class JobQueue:
+    # Очередь в таблице jobs: задача пишется в той же транзакции, что и запрос
+    def __init__(self, poll_interval=1, lock_timeout=300, retry_base=5, retention=86400, threads=1):
+        self.poll_interval = poll_interval
+        self.lock_timeout = lock_timeout
+        self.retry_base = retry_base
+        self.retention = retention
+        self.threads = threads
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._worker_pid = None
+        self._cleaned_at = 0
+
+    def enqueue(self, kind, payload=None, key=None, delay=0, max_attempts=5):
+        job = Job(
+            kind=kind,
+            payload=json.dumps(payload or {}),
+            idempotency_key=key,
+            max_attempts=max_attempts,
+            run_at=datetime.utcnow() + timedelta(seconds=delay)
+        )
+        if key is None:
+            db.session.add(job)
+            return True
+        
+        # Повтор с тем же ключом отбрасываем, не ломая внешнюю транзакцию
+        try:
+            with db.session.begin_nested():
+                db.session.add(job)
+        except IntegrityError:
+            return False
+        return True
+
+    def notify(self):
+        if not self.threads:
+            return
+        self._ensure_workers()
+        self._wake.set()
+
+    def _ensure_workers(self):
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        for number in range(self.threads):
+            threading.Thread(
+                target=self.work, args=(f'{os.getpid()}-{number}', True), name='job-worker', daemon=True
+            ).start()
+
+    def work(self, worker_id, inline=False):
+        while True:
+            try:
+                with app.app_context():
+                    while self.run_once(worker_id, inline):
+                        pass
+            except Exception as e:
+                app.logger.warning('Ошибка обработчика задач: %s', e)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _claim(self, worker_id, inline=False):
+        now = datetime.utcnow()
+        Job.query.filter(
+            Job.status == 'running', Job.locked_at < now - timedelta(seconds=self.lock_timeout)
+        ).update({Job.status: 'queued', Job.locked_by: None}, synchronize_session=False)
+        
+        # Только типы, которые знает этот процесс: задачу нового типа от уже обновлённого веба
+        # не помечаем ошибкой и не даём ей заслонить очередь — её заберёт обновлённый обработчик.
+        # Потоки веб-процесса (inline) не берут и тяжёлые типы, оставляя их flask jobs-worker
+        kinds = [kind for kind in JOB_HANDLERS if not (inline and kind in WORKER_ONLY_JOB_KINDS)]
+        first = db.session.query(Job.kind).filter(
+            Job.status == 'queued', Job.run_at <= now, Job.kind.in_(kinds)
+        ).order_by(Job.run_at, Job.id).first()
+        if first is None:
+            db.session.commit()
+            return None, []
+        
+        kind = first.kind
+        candidate_ids = [job_id for job_id, in db.session.query(Job.id).filter(
+            Job.kind == kind, Job.status == 'queued', Job.run_at <= now
+        ).order_by(Job.run_at, Job.id).limit(JOB_HANDLERS[kind][1]).with_for_update(skip_locked=True)]
         
-        <form method="POST" action="/register">
-            <div class="form-group">
-                <input type="text" name="username" class="form-control" required placeholder="👤 Имя пользователя">
-            </div>
-            
-            <div class="form-group">
-                <input type="email" name="email" class="form-control" required placeholder="📧 Email адрес">
-            </div>
-            
-            <div class="form-group">
-                <input type="password" name="password" class="form-control" required placeholder="🔒 Пароль">
-            </div>
-            
-            <div class="form-group">
-                <input type="password" name="confirm_password" class="form-control" required placeholder="🔁 Подтвердите пароль">
-            </div>
-            
-            <div class="form-group">
-                <input type="text" name="full_name" class="form-control" placeholder="🌟 Ваше имя (необязательно)">
-            </div>
-            
-            <button type="submit" class="btn-primary">🚀 СОЗДАТЬ АККАУНТ</button>
-        </form>
+        Job.query.filter(Job.id.in_(candidate_ids), Job.status == 'queued').update(
+            {Job.status: 'running', Job.locked_by: worker_id, Job.locked_at: now}, synchronize_session=False
+        )
+        db.session.commit()
+        return kind, Job.query.filter(Job.id.in_(candidate_ids), Job.locked_by == worker_id, Job.status == 'running').all()
+
+    def run_once(self, worker_id, inline=False):
+        kind, jobs = self._claim(worker_id, inline)
+        if not jobs:
+            self._cleanup()
+            return 0
         
-        <div class="auth-switch">
-            Уже есть аккаунт? <a href="/login" class="auth-link">Войти</a>
-        </div>
-    </div>
-</body>
-</html>'''
+        handler = JOB_HANDLERS[kind][0]
+        job_ids = [job.id for job in jobs]
+        try:
+            # Побочные эффекты и отметка о выполнении фиксируются одной транзакцией
+            handler([json.loads(job.payload or '{}') for job in jobs])
+            Job.query.filter(Job.id.in_(job_ids)).update(
+                {Job.status: 'done', Job.finished_at: datetime.utcnow(), Job.attempts: Job.attempts + 1},
+                synchronize_session=False
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for job in Job.query.filter(Job.id.in_(job_ids)).all():
+                job.attempts += 1
+                job.last_error = repr(e)[:2000]
+                job.locked_by = None
+                if job.attempts >= job.max_attempts:
+                    job.status = 'failed'
+                    job.finished_at = datetime.utcnow()
+                else:
+                    job.status = 'queued'
+                    job.run_at = datetime.utcnow() + timedelta(seconds=self.retry_base * 2 ** (job.attempts - 1) * random.uniform(1, 1.5))
+            db.session.commit()
+            app.logger.warning('Задачи %s (%s) завершились ошибкой: %r', kind, job_ids, e)
+        return len(jobs)
 
-@app.route('/')
-def index():
-    if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
+    def _cleanup(self):
+        if time.monotonic() - self._cleaned_at < 600:
+            return
+        self._cleaned_at = time.monotonic()
+        Job.query.filter(
+            Job.status == 'done', Job.finished_at < datetime.utcnow() - timedelta(seconds=self.retention)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+job_queue = JobQueue(
+    poll_interval=float(os.environ.get('JOB_POLL_INTERVAL', 1)),
+    threads=int(os.environ.get('JOB_INLINE_WORKERS', 1))
+)
+
+def after_commit(callback):
+    # Кэши сбрасываем только после фиксации, иначе параллельное чтение закэширует старые данные
+    db.session.info.setdefault('after_commit', []).append(callback)
+
+@event.listens_for(RoutingSession, 'after_commit')
+def run_after_commit(session):
+    for callback in session.info.pop('after_commit', []):
+        callback()
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def drop_after_commit(session):
+    session.info.pop('after_commit', None)
+
+@app.cli.command('jobs-worker')
+def jobs_worker():
+    # Отдельный процесс-обработчик (Procfile: worker) — единственный, кто выполняет задачи worker_only;
+    # остальные типы берут и потоки веб-процесса, если не задано JOB_INLINE_WORKERS=0
+    print('Обработчик задач запущен')
+    job_queue.work(f'cli-{os.getpid()}')
+
+@job_handler('post_counters', batch_size=200)
+def recount_post_likes(payloads):
+    # Пересчёт, а не +1: повтор задачи или пачка дублей дают тот же результат
+    post_ids = sorted({payload['post_id'] for payload in payloads})
+    counts = dict(db.session.query(Like.post_id, db.func.count(Like.id)).filter(
+        Like.post_id.in_(post_ids)
+    ).group_by(Like.post_id).all())
+    
+    posts_table = Post.__table__
+    db.session.execute(
+        posts_table.update().where(posts_table.c.id == db.bindparam('post_id')).values(
+            likes_count=db.bindparam('likes'), updated_at=posts_table.c.updated_at
+        ),
+        [{'post_id': post_id, 'likes': counts.get(post_id, 0)} for post_id in post_ids]
+    )
+    refresh_hot_scores(Post.id.in_(post_ids))
+    after_commit(lambda: hot_feed.invalidate_posts(post_ids))
+
+@job_handler('user_counters', batch_size=200)
+def recount_user_posts(payloads):
+    user_ids = sorted({payload['user_id'] for payload in payloads})
+    counts = Counter()
+    for model in (Post, PostArchive):
+        counts.update(dict(db.session.query(model.user_id, db.func.count(model.id)).filter(
+            model.user_id.in_(user_ids)
+        ).group_by(model.user_id).all()))
+    
+    users_table = User.__table__
+    db.session.execute(
+        users_table.update().where(users_table.c.id == db.bindparam('user_id')).values(posts_count=db.bindparam('posts')),
+        [{'user_id': user_id, 'posts': counts.get(user_id, 0)} for user_id in user_ids]
+    )
+
+@job_handler('notify', batch_size=500)
+def create_notifications(payloads):
+    db.session.add_all([
+        Notification(
+            user_id=payload['user_id'],
+            type=payload['type'],
+            content=payload.get('content'),
+            reference_id=payload.get('reference_id')
+        )
+        for payload in payloads
+    ])
+
+@job_handler('media_variants', worker_only=True)
+def render_post_media(payloads):
+    # Превью и веб-размер делает только отдельный обработчик (Procfile: worker): Pillow занял бы
+    # процессор воркера gunicorn. Без него пост показывает оригинал, пока варианты не готовы
+    for payload in payloads:
+        post = db.session.get(Post, payload['post_id'])
+        if not post or post.media_type != 'image' or not post.media_url:
+            continue
+        render_media_variants(media_path(post.media_url.rsplit('/', 1)[-1]))
+        Post.query.filter_by(id=post.id).update(
+            {Post.media_variants: ','.join(MEDIA_VARIANTS), Post.updated_at: Post.updated_at}, synchronize_session=False
+        )
+        after_commit(lambda post_id=post.id: hot_feed.invalidate_posts([post_id]))
+
+# ============ СВЕРКА СЧЁТЧИКОВ ============
+# Счётчик: (модель-владелец, колонка, [(ссылка на владельца, доп. условия)])
+COUNTERS = {
+    'users.posts_count': (User, 'posts_count', lambda: [(Post.user_id, []), (PostArchive.user_id, [])]),
+    'users.friends_count': (User, 'friends_count', lambda: [
+        (Friendship.user_id, [Friendship.status == 'accepted']),
+        (Friendship.friend_id, [Friendship.status == 'accepted']),
+    ]),
+    'posts.likes_count': (Post, 'likes_count', lambda: [(Like.post_id, [])]),
+    'posts.comments_count': (Post, 'comments_count', lambda: [(Comment.post_id, [])]),
+}
+
+def actual_counts(name, low, high):
+    # Одна агрегирующая выборка на диапазон id: LEFT JOIN даёт и нулевые счётчики
+    model, column, sources = COUNTERS[name]
+    refs = db.union_all(*[
+        db.select(ref.label('ref_id')).where(ref.between(low, high), *conditions)
+        for ref, conditions in sources()
+    ]).subquery()
+    table = model.__table__
+    return db.select(
+        table.c.id.label('id'),
+        db.func.count(refs.c.ref_id).label('actual')
+    ).select_from(
+        table.outerjoin(refs, refs.c.ref_id == table.c.id)
+    ).where(table.c.id.between(low, high)).group_by(table.c.id).subquery()
+
+def reconcile_chunk(name, low, high, dry_run=False):
+    model, column, sources = COUNTERS[name]
+    table = model.__table__
+    stored = table.c[column]
+    actual = actual_counts(name, low, high)
+    drifted = db.func.coalesce(stored, -1) != actual.c.actual
+    values = {column: actual.c.actual}
+    if 'updated_at' in table.c:
+        values['updated_at'] = table.c.updated_at
+    
+    rows, drift, worst = db.session.execute(
+        db.select(
+            db.func.count(),
+            db.func.coalesce(db.func.sum(db.func.abs(db.func.coalesce(stored, 0) - actual.c.actual)), 0),
+            db.func.coalesce(db.func.max(db.func.abs(db.func.coalesce(stored, 0) - actual.c.actual)), 0)
+        ).select_from(table.join(actual, actual.c.id == table.c.id)).where(drifted)
+    ).one()
+    
+    if rows and not dry_run:
+        # UPDATE ... FROM: пересчёт и запись одним запросом, только расходящиеся строки
+        db.session.execute(
+            table.update().values(values).where(table.c.id == actual.c.id, drifted)
+        )
+        if model is Post:
+            refresh_hot_scores(Post.id.between(low, high))
+    db.session.commit()
+    return rows, drift, worst
+
+def reconcile_counters(names=None, chunk_size=5000, pause=0, dry_run=False):
+    report = {}
+    for name in names or COUNTERS:
+        model = COUNTERS[name][0]
+        low, high = db.session.query(db.func.min(model.id), db.func.max(model.id)).one()
         db.session.commit()
+        totals = {'rows': 0, 'drift': 0, 'max': 0}
         
-        posts = Post.query.order_by(Post.created_at.desc()).limit(10).all()
-        liked_posts = [like.post_id for like in current_user.user_likes]
+        # Короткая транзакция на каждый диапазон id, чтобы не держать блокировки
+        start = low or 0
+        while high is not None and start <= high:
+            rows, drift, worst = reconcile_chunk(name, start, start + chunk_size - 1, dry_run)
+            totals['rows'] += rows
+            totals['drift'] += drift
+            totals['max'] = max(totals['max'], worst)
+            start += chunk_size
+            if pause:
+                time.sleep(pause)
+        report[name] = totals
+    return report
+
+@app.cli.command('reconcile-counters')
+@click.option('--counter', 'names', multiple=True, type=click.Choice(sorted(COUNTERS)))
+@click.option('--chunk-size', default=5000, show_default=True)
+@click.option('--pause', default=0.0, help='Пауза между диапазонами, секунд')
+@click.option('--dry-run', is_flag=True, help='Только отчёт о расхождениях')
+def reconcile_counters_command(names, chunk_size, pause, dry_run):
+    report = reconcile_counters(names or None, chunk_size, pause, dry_run)
+    for name, totals in report.items():
+        print(f"{name}: строк с расхождением {totals['rows']}, суммарно {totals['drift']}, максимум {totals['max']}")
+    if dry_run:
+        print('Пробный запуск: изменения не записаны')
+
+# ============ ЗАПУСК ============
+_app_ready = False
+
+def create_app():
+    # Фабрика для gunicorn (gunicorn.conf.py, preload_app): всё, что не зависит от воркера,
+    # делается один раз в мастере до fork и делится между воркерами через copy-on-write
+    global _app_ready
+    if _app_ready:
+        return app
+    
+    configure_mappers()
+    app.url_map.update()
+    for name in PAGES:
+        page_template(name)
+    with app.test_request_context('/'):
+        for name in STATIC_PAGES:
+            render_page(name)
+    with app.app_context():
+        try:
+            username_index.ensure_fresh()
+        except Exception as e:
+            app.logger.warning('Индекс имён не прогрет: %s', e)
+    _app_ready = True
+    return app
+
+STARTUP_PROBE = '''
+import json, resource, time
+started = time.perf_counter()
+import netta
+imported = time.perf_counter()
+netta.create_app()
+created = time.perf_counter()
+client = netta.app.test_client()
+client.get('/login')
+first_request = time.perf_counter()
+client.get('/login')
+second_request = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (first_request - created) * 1000,
+    'warm_request_ms': (second_request - first_request) * 1000,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+'''
+
+@app.cli.command('startup-benchmark')
+@click.option('--runs', default=5, show_default=True)
+def startup_benchmark(runs):
+    # Каждый замер — новый интерпретатор, как у только что поднятого дино
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        )
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    
+    for key in samples[0]:
+        values = sorted(sample[key] for sample in samples)
+        print(f'{key}: медиана {statistics.median(values):.1f}, мин {values[0]:.1f}, макс {values[-1]:.1f}')
+
+# ============ АРХИВ ============
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+
+def ensure_archive_partitions(table_name, low, high):
+    # Помесячные партиции создаются по мере надобности; на SQLite архив — обычная таблица
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql' or low is None:
+        return
+    month = datetime(low.year, low.month, 1)
+    while month <= high:
+        next_month = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {table_name}_{month:%Y_%m} PARTITION OF {table_name} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month:%Y-%m-%d}')"
+        )
+        month = next_month
+
+def move_rows(model, archive_model, *criteria):
+    # INSERT ... SELECT в архив и DELETE одним набором условий, без выборки строк в Python
+    table = model.__table__
+    names = [column.name for column in archive_model.__table__.columns if column.name != 'archived_at']
+    created_at = db.func.coalesce(table.c.created_at, db.func.current_timestamp())
+    low, high = db.session.query(db.func.min(created_at), db.func.max(created_at)).select_from(table).filter(*criteria).one()
+    if low is None:
+        return 0
+    
+    ensure_archive_partitions(archive_model.__tablename__, low, high)
+    db.session.execute(archive_model.__table__.insert().from_select(
+        names,
+        db.select(*[created_at if name == 'created_at' else table.c[name] for name in names]).where(*criteria)
+    ))
+    return db.session.execute(table.delete().where(*criteria)).rowcount
+
+def archive_posts(cutoff, chunk_size=1000):
+    # Пост уезжает вместе с лайками и комментариями (на них ссылаются внешние ключи);
+    # посты с опросами остаются в горячей таблице
+    moved = 0
+    while True:
+        post_ids = [post_id for post_id, in db.session.query(Post.id).filter(
+            Post.created_at < cutoff,
+            ~db.exists().where(PollOption.post_id == Post.id)
+        ).order_by(Post.created_at, Post.id).limit(chunk_size)]
+        if not post_ids:
+            break
         
-        return render_template_string('''
-        <!DOCTYPE html>
-        <html lang="ru">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Netta | Главная</title>
-            <style>
-                :root {
-                    --purple-neon: #bf00ff;
-                    --purple-deep: #7c3aed;
-                    --purple-light: #a855f7;
-                    --purple-dark: #5b21b6;
-                    --space-bg: #0a0a1a;
-                    --card-bg: rgba(20, 15, 40, 0.9);
-                }
-                * { margin: 0; padding: 0; box-sizing: border-box; }
-                body {
-                    font-family: 'Segoe UI', sans-serif;
-                    background: var(--space-bg);
-                    color: white;
-                }
-                .header {
-                    background: rgba(10, 5, 25, 0.95);
-                    border-bottom: 2px solid #7c3aed;
-                    padding: 1rem 0;
-                }
-                .container {
-                    max-width: 1200px;
-                    margin: 0 auto;
-                    padding: 0 1rem;
-                }
-                .navbar {
-                    display: flex;
-                    justify-content: space-between;
-                    align-items: center;
-                }
-                .logo {
-                    display: flex;
-                    align-items: center;
-                    gap: 10px;
-                    font-size: 1.5rem;
-                    font-weight: 800;
-                    color: white;
-                    text-decoration: none;
-                }
-                .logo-icon {
-                    width: 40px;
-                    height: 40px;
-                    background: linear-gradient(135deg, #7c3aed, #bf00ff);
-                    border-radius: 10px;
-                    display: flex;
-                    align-items: center;
-                    justify-content: center;
-                    font-size: 1.5rem;
-                    font-weight: 900;
-                    color: white;
-                }
-                .main-layout {
-                    display: grid;
-                    grid-template-columns: 250px 1fr 300px;
-                    gap: 2rem;
-                    padding: 2rem 0;
-                }
-                .card {
-                    background: var(--card-bg);
-                    border: 2px solid rgba(124, 58, 237, 0.3);
-                    border-radius: 15px;
-                    padding: 1.5rem;
-                    margin-bottom: 1.5rem;
-                }
-                .post-editor {
-                    width: 100%;
-                    min-height: 100px;
-                    padding: 1rem;
-                    background: rgba(255, 255, 255, 0.05);
-                    border: 2px solid rgba(124, 58, 237, 0.3);
-                    border-radius: 10px;
-                    color: white;
-                    margin-bottom: 1rem;
-                }
-                .btn {
-                    padding: 0.8rem 2rem;
-                    background: linear-gradient(135deg, #7c3aed, #5b21b6);
-                    border: none;
-                    border-radius: 10px;
-                    color: white;
-                    font-weight: 600;
-                    cursor: pointer;
-                }
-                .user-avatar {
-                    width: 50px;
-                    height: 50px;
-                    border-radius: 50%;
-                    background: ''' + current_user.avatar_color + ''';
-                    display: flex;
-                    align-items: center;
-                    justify-content: center;
-                    font-weight: bold;
-                    font-size: 1.2rem;
-                }
-            </style>
-        </head>
-        <body>
-            <header class="header">
-                <div class="container">
-                    <nav class="navbar">
-                        <a href="/" class="logo">
-                            <div class="logo-icon">N</div>
-                            <span>Netta</span>
-                        </a>
-                        <div>
-                            <a href="/logout" style="color: #a855f7; text-decoration: none;">Выйти</a>
-                        </div>
-                    </nav>
-                </div>
-            </header>
+        move_rows(Like, LikeArchive, Like.post_id.in_(post_ids))
+        move_rows(Comment, CommentArchive, Comment.post_id.in_(post_ids))
+        moved += move_rows(Post, PostArchive, Post.id.in_(post_ids))
+        db.session.commit()
+    return moved
+
+def archive_notifications(cutoff, chunk_size=1000):
+    moved = 0
+    while True:
+        notification_ids = [notification_id for notification_id, in db.session.query(Notification.id).filter(
+            Notification.is_read.is_(True), Notification.created_at < cutoff
+        ).order_by(Notification.created_at, Notification.id).limit(chunk_size)]
+        if not notification_ids:
+            break
+        moved += move_rows(Notification, NotificationArchive, Notification.id.in_(notification_ids))
+        db.session.commit()
+    return moved
+
+def archived_post(post_id, viewer_id):
+    return PostArchive.query.filter(PostArchive.id == post_id, visible_to(viewer_id, PostArchive)).first()
+
+@app.cli.command('archive-cold-data')
+@click.option('--days', default=ARCHIVE_AFTER_DAYS, show_default=True, help='Возраст, после которого данные уходят в архив')
+@click.option('--chunk-size', default=1000, show_default=True)
+def archive_cold_data(days, chunk_size):
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    posts = archive_posts(cutoff, chunk_size)
+    notifications = archive_notifications(cutoff, chunk_size)
+    if posts:
+        hot_feed.invalidate()
+    print(f'В архив перенесено постов: {posts}, прочитанных уведомлений: {notifications}')
+
+# ============ ЭКСПОРТ ============
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+EXPORT_EXCLUDED_COLUMNS = {'password_hash', 'viewers_hll'}
+# Раздел: (имя, модель, условие принадлежности пользователю, ключ порядка); порядок разделов входит в курсор.
+# Ключ — хвост индекса по владельцу, чтобы порция читалась диапазоном индекса без сортировки
+EXPORT_SECTIONS = [
+    ('profile', User, lambda user_id: User.id == user_id, ('id',)),
+    ('post', Post, lambda user_id: Post.user_id == user_id, ('created_at', 'id')),
+    ('post', PostArchive, lambda user_id: PostArchive.user_id == user_id, ('created_at', 'id')),
+    ('comment', Comment, lambda user_id: Comment.user_id == user_id, ('id',)),
+    ('comment', CommentArchive, lambda user_id: CommentArchive.user_id == user_id, ('id',)),
+    ('like', Like, lambda user_id: Like.user_id == user_id, ('post_id', 'id')),
+    ('like', LikeArchive, lambda user_id: LikeArchive.user_id == user_id, ('post_id', 'id')),
+    ('message_sent', Message, lambda user_id: Message.sender_id == user_id, ('created_at', 'id')),
+    ('message_received', Message, lambda user_id: Message.receiver_id == user_id, ('created_at', 'id')),
+    # Дружбы читаются двумя индексами и сортируются, но их у пользователя немного
+    ('friendship', Friendship, lambda user_id: db.or_(Friendship.user_id == user_id, Friendship.friend_id == user_id), ('id',)),
+]
+
+def encode_export_cursor(section, after=None):
+    # Курсор — номер раздела и значения ключа последней выгруженной строки
+    raw = json.dumps([section, [export_value(value) for value in after] if after else None])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_export_cursor(cursor):
+    section, after = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    if not isinstance(section, int) or not 0 <= section <= len(EXPORT_SECTIONS):
+        raise ValueError(cursor)
+    if after is None or section == len(EXPORT_SECTIONS):
+        return section, None
+    
+    table = EXPORT_SECTIONS[section][1].__table__
+    key = EXPORT_SECTIONS[section][3]
+    if not isinstance(after, list) or len(after) != len(key):
+        raise ValueError(cursor)
+    return section, [
+        datetime.fromisoformat(value) if isinstance(table.c[name].type, db.DateTime) else int(value)
+        for name, value in zip(key, after)
+    ]
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def export_after(columns, values):
+    # Строго после строки с ключом values: (a, b) > (x, y) как a > x OR (a = x AND b > y)
+    if len(columns) == 1:
+        return columns[0] > values[0]
+    return db.or_(columns[0] > values[0], db.and_(columns[0] == values[0], export_after(columns[1:], values[1:])))
+
+def export_query(section, user_id, after=None, chunk_size=EXPORT_CHUNK_SIZE):
+    _, model, belongs_to, key = EXPORT_SECTIONS[section]
+    table = model.__table__
+    columns = [column for column in table.columns if column.name not in EXPORT_EXCLUDED_COLUMNS]
+    key_columns = [table.c[name] for name in key]
+    query = db.select(*columns).where(belongs_to(user_id))
+    if after:
+        query = query.where(export_after(key_columns, after))
+    return query.order_by(*key_columns).limit(chunk_size)
+
+def export_chunks(user_id, section=0, after=None, chunk_size=EXPORT_CHUNK_SIZE):
+    # Порция строк NDJSON и строка-курсор после неё; между порциями транзакция закрывается,
+    # поэтому медленный клиент не держит снимок БД, а память не зависит от размера аккаунта
+    for index in range(section, len(EXPORT_SECTIONS)):
+        name, _, _, key = EXPORT_SECTIONS[index]
+        while True:
+            rows = db.session.execute(export_query(index, user_id, after, chunk_size)).all()
+            db.session.rollback()
+            if not rows:
+                break
             
-            <main class="container">
-                <div class="main-layout">
-                    <aside>
-                        <div class="card">
-                            <div style="text-align: center;">
-                                <div class="user-avatar" style="margin: 0 auto 1rem;">
-                                    ''' + current_user.username[0].upper() + '''
-                                </div>
-                                <h3>''' + (current_user.full_name or current_user.username) + '''</h3>
-                                <p style="color: #a855f7;">@''' + current_user.username + '''</p>
-                                <p>Уровень: ''' + str(current_user.level) + '''</p>
-                                <p>Монеты: ''' + str(current_user.coins) + '''</p>
-                            </div>
-                        </div>
-                    </aside>
-                    
-                    <section>
-                        <div class="card">
-                            <form method="POST" action="/create_post">
-                                <textarea name="content" class="post-editor" placeholder="Что нового?"></textarea>
-                                <button type="submit" class="btn">Опубликовать</button>
-                            </form>
-                        </div>
-                        
-                        ''' + ''.join([f'''
-                        <div class="card">
-                            <div style="display: flex; align-items: center; margin-bottom: 1rem;">
-                                <div class="user-avatar" style="background: {post.author.avatar_color}; margin-right: 1rem;">
-                                    {post.author.username[0].upper()}
-                                </div>
-                                <div>
-                                    <div style="font-weight: bold;">{post.author.full_name or post.author.username}</div>
-                                    <div style="color: #9ca3af; font-size: 0.9rem;">
-                                        {post.created_at.strftime('%d %b в %H:%M')}
-                                    </div>
-                                </div>
-                            </div>
-                            <div style="margin-bottom: 1rem;">
-                                {post.content}
-                            </div>
-                            <div>
-                                <form method="POST" action="/like/{post.id}" style="display: inline;">
-                                    <button type="submit" style="background: none; border: none; color: {'#bf00ff' if post.id in liked_posts else 'white'}; cursor: pointer;">
-                                        ❤️ {post.likes_count}
-                                    </button>
-                                </form>
-                                <span style="margin-left: 1rem;">💬 {post.comments_count}</span>
-                            </div>
-                        </div>
-                        ''' for post in posts]) + '''
-                    </section>
-                    
-                    <aside>
-                        <div class="card">
-                            <h3>Онлайн сейчас</h3>
-                            <p>Друзья в сети скоро здесь</p>
-                        </div>
-                        <div class="card">
-                            <h3>Тренды</h3>
-                            <p>#NettaLaunch</p>
-                            <p>#ФиолетоваяВселенная</p>
-                        </div>
-                    </aside>
-                </div>
-            </main>
-        </body>
-        </html>
-        ''')
+            after = [getattr(rows[-1], column) for column in key]
+            lines = [
+                json.dumps({'type': name, 'data': {column: export_value(value) for column, value in row._mapping.items()}}, ensure_ascii=False)
+                for row in rows
+            ]
+            lines.append(json.dumps({'type': 'cursor', 'cursor': encode_export_cursor(index, after)}))
+            yield '\n'.join(lines) + '\n'
+            if len(rows) < chunk_size:
+                break
+        after = None
+    yield json.dumps({'type': 'end', 'cursor': encode_export_cursor(len(EXPORT_SECTIONS))}) + '\n'
+
+def gzip_chunks(chunks):
+    # Сброс после каждой порции: оборванная загрузка распаковывается до последнего курсора
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+@app.route('/api/v1/export')
+@api_login_required
+def api_export():
+    # ?cursor= продолжает выгрузку с последней полученной строки-курсора, ?gzip=1 сжимает поток
+    try:
+        section, after = decode_export_cursor(request.args['cursor']) if request.args.get('cursor') else (0, None)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return jsonify({'error': 'invalid cursor'}), 400
+    
+    body = export_chunks(current_user.id, section, after)
+    filename = f'netta-{current_user.username}.ndjson'
+    mimetype = 'application/x-ndjson'
+    if request.args.get('gzip') == '1':
+        body = gzip_chunks(body)
+        filename += '.gz'
+        mimetype = 'application/gzip'
     
-    return LOGIN_HTML
+    response = app.response_class(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if current_user.is_authenticated:
-        return redirect('/')
+@app.cli.command('export-user')
+@click.argument('username')
+@click.option('--output', type=click.Path(dir_okay=False), help='Файл; по умолчанию stdout')
+@click.option('--gzip', 'compress', is_flag=True)
+@click.option('--cursor', help='Продолжить с курсора из прошлой выгрузки')
+def export_user(username, output, compress, cursor):
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f'Пользователь {username} не найден')
     
-    if request.method == 'POST':
-        username = request.form['username']
-        password = request.form['password']
-        
-        user = User.query.filter((User.username == username) | (User.email == username)).first()
-        
-        if user and user.check_password(password):
-            user.last_seen = datetime.utcnow()
-            db.session.commit()
-            login_user(user)
-            flash('Добро пожаловать в Netta!', 'success')
-            return redirect('/')
-        else:
-            flash('Неверный логин или пароль', 'error')
+    section, after = decode_export_cursor(cursor) if cursor else (0, None)
+    body = export_chunks(user.id, section, after)
+    if compress:
+        body = gzip_chunks(body)
+    else:
+        body = (chunk.encode() for chunk in body)
     
-    return LOGIN_HTML
+    with (open(output, 'ab' if cursor else 'wb') if output else click.get_binary_stream('stdout')) as f:
+        for chunk in body:
+            f.write(chunk)
 
-@app.route('/register', methods=['GET', 'POST'])
-def register():
-    if current_user.is_authenticated:
-        return redirect('/')
+# ============ ГОРЯЧЕЕ ============
+HOT_EPOCH = datetime(2024, 1, 1)
+# Секунд свежести, равноценных десятикратному росту вовлечённости
+HOT_SCORE_DECAY = float(os.environ.get('HOT_SCORE_DECAY', 45000))
+
+def hot_score(likes, comments, shares, created_at):
+    # Затухание без пересчёта по времени: к логарифму вовлечённости прибавляется момент публикации,
+    # поэтому балл меняется только вместе со счётчиками, а новые посты со временем вытесняют старые
+    engagement = (likes or 0) + 2 * (comments or 0) + 3 * (shares or 0)
+    return math.log10(max(engagement, 1)) + ((created_at or HOT_EPOCH) - HOT_EPOCH).total_seconds() / HOT_SCORE_DECAY
+
+def refresh_hot_scores(*criteria):
+    rows = db.session.query(
+        Post.id, Post.likes_count, Post.comments_count, Post.shares_count, Post.created_at
+    ).filter(*criteria).all()
+    if not rows:
+        return 0
     
-    if request.method == 'POST':
-        username = request.form['username']
-        email = request.form['email']
-        password = request.form['password']
-        confirm_password = request.form['confirm_password']
-        full_name = request.form.get('full_name', '')
+    posts_table = Post.__table__
+    db.session.execute(
+        posts_table.update().where(posts_table.c.id == db.bindparam('post_id')).values(
+            hot_score=db.bindparam('score'), updated_at=posts_table.c.updated_at
+        ),
+        [{'post_id': row.id, 'score': hot_score(row.likes_count, row.comments_count, row.shares_count, row.created_at)} for row in rows]
+    )
+    return len(rows)
+
+@event.listens_for(Post, 'before_insert')
+def set_initial_hot_score(mapper, connection, post):
+    if post.created_at is None:
+        post.created_at = datetime.utcnow()
+    post.hot_score = hot_score(post.likes_count, post.comments_count, post.shares_count, post.created_at)
+
+# ============ РАЗМЕТКА ПОСТОВ ============
+# Увеличивается при любом изменении render_content; затем flask rerender-posts
+CONTENT_RENDERER_VERSION = 2
+CONTENT_TOKEN_RE = re.compile(r'(https?://[^\s<>"\']+)|(?<![\w&#])#(\w{1,50})|(?<![\w@])@(\w{1,50})')
+URL_TRAILING_PUNCTUATION = '.,!?;:)»'
+
+def render_content(text):
+    # Экранирование, ссылки, #теги и @упоминания, переводы строк — один раз при записи поста
+    parts = []
+    position = 0
+    text = text.replace('\r\n', '\n')
+    known = username_index.resolve(extract_mentions(text))
+    for match in CONTENT_TOKEN_RE.finditer(text):
+        parts.append(escape(text[position:match.start()]))
+        url, tag, username = match.groups()
+        if url:
+            stripped = url.rstrip(URL_TRAILING_PUNCTUATION)
+            parts.append(f'<a href="{escape(stripped)}" rel="nofollow noopener" target="_blank">{escape(stripped)}</a>')
+            parts.append(escape(url[len(stripped):]))
+        elif tag:
+            parts.append(f'<span class="hashtag">#{escape(tag)}</span>')
+        elif username in known:
+            parts.append(f'<a class="mention" href="/u/{escape(username)}">@{escape(username)}</a>')
+        else:
+            parts.append(escape(match.group(0)))
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return ''.join(str(part) for part in parts).replace('\n', '<br>\n')
+
+def post_html(post):
+    # Сохранённый HTML, если он отрисован текущей версией; старые строки рендерятся на лету до rerender-posts
+    if getattr(post, 'content_html_version', None) == CONTENT_RENDERER_VERSION:
+        return post.content_html
+    return render_content(post.content)
+
+@app.cli.command('rerender-posts')
+@click.option('--chunk-size', default=1000, show_default=True)
+def rerender_posts(chunk_size):
+    # Пересборка content_html порциями по id для постов, отрисованных другой версией рендерера,
+    # в горячей таблице и в архиве. Пост от этого не редактируется: updated_at остаётся прежним
+    rendered = 0
+    for model in (Post, PostArchive):
+        table = model.__table__
+        last_id = 0
+        while True:
+            rows = db.session.query(model.id, model.content).filter(
+                model.id > last_id,
+                db.or_(model.content_html_version.is_(None), model.content_html_version != CONTENT_RENDERER_VERSION)
+            ).order_by(model.id).limit(chunk_size).all()
+            if not rows:
+                break
+            
+            db.session.execute(
+                table.update().where(table.c.id == db.bindparam('post_id')).values(
+                    content_html=db.bindparam('html'), content_html_version=CONTENT_RENDERER_VERSION,
+                    updated_at=table.c.updated_at
+                ),
+                [{'post_id': row.id, 'html': render_content(row.content)} for row in rows]
+            )
+            db.session.commit()
+            rendered += len(rows)
+            last_id = rows[-1].id
+    
+    hot_feed.invalidate()
+    print(f'Перерисовано постов: {rendered} (версия {CONTENT_RENDERER_VERSION})')
+
+# ============ УПОМИНАНИЯ ============
+MAX_MENTIONS_PER_POST = 20
+
+class UsernameIndex:
+    # Пользователи в памяти процесса: username -> id для упоминаний и отсортированный массив
+    # префиксных ключей (username и слова full_name) для подсказок. Полная загрузка — только первая;
+    # дальше догружаются строки с profile_updated_at позже прошлой синхронизации: регистрация,
+    # смена имени или уровня. Сдвиг версии 'usernames' в общем кэше запускает догрузку сразу
+    def __init__(self, refresh_interval=60, overlap=60):
+        self.refresh_interval = refresh_interval
+        # Транзакция может зафиксироваться позже, чем индекс прочитал более новые строки: читаем с запасом
+        self.overlap = timedelta(seconds=overlap)
+        self._ids = {}
+        self._users = {}
+        self._prefixes = []
+        self._synced_at = None
+        self._version = None
+        self._refreshed_at = 0
+        self._loaded = False
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _stale(self):
+        return self._version != cache.version('usernames') or time.monotonic() - self._refreshed_at > self.refresh_interval
+
+    def ensure_fresh(self):
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self._load()
+            return
+        if self._refreshing or not self._stale():
+            return
         
-        if password != confirm_password:
-            flash('Пароли не совпадают', 'error')
-            return REGISTER_HTML
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
         
-        if User.query.filter_by(username=username).first():
-            flash('Имя пользователя уже занято', 'error')
-            return REGISTER_HTML
+        def refresh():
+            try:
+                with app.app_context():
+                    self._load()
+            except Exception as e:
+                app.logger.warning('Не удалось обновить индекс имён: %s', e)
+            finally:
+                self._refreshing = False
+        threading.Thread(target=refresh, name='username-index', daemon=True).start()
+
+    def _load(self):
+        version = cache.version('usernames')
+        started_at = datetime.utcnow()
+        query = db.session.query(
+            User.id, User.username, User.full_name, User.level, User.avatar_color, User.profile_updated_at
+        )
+        if self._synced_at is not None:
+            query = query.filter(User.profile_updated_at > self._synced_at - self.overlap)
+        rows = query.order_by(User.id).all()
+        db.session.rollback()
         
-        if User.query.filter_by(email=email).first():
-            flash('Email уже используется', 'error')
-            return REGISTER_HTML
+        if self._synced_at is None:
+            # Первая загрузка строится в стороне и подменяется целиком
+            users = {row.id: tuple(row[:5]) for row in rows}
+            prefixes = sorted((key, row.id) for row in rows for key in typeahead_keys(row.username, row.full_name))
+            with self._lock:
+                self._users = users
+                self._ids = {row.username: row.id for row in rows}
+                self._prefixes = prefixes
+        else:
+            for row in rows:
+                self._insert(tuple(row[:5]))
         
-        colors = ['#7c3aed', '#a855f7', '#bf00ff', '#5b21b6', '#8b5cf6']
+        self._synced_at = max((row.profile_updated_at for row in rows if row.profile_updated_at), default=self._synced_at or started_at)
+        self._version = version
+        self._refreshed_at = time.monotonic()
+        self._loaded = True
+
+    def _insert(self, user):
+        # Новая запись или замена прежней: ключи старого имени убираем из массива
+        user_id, username, full_name = user[:3]
+        with self._lock:
+            previous = self._users.get(user_id)
+            if previous == user:
+                return
+            if previous is not None:
+                if self._ids.get(previous[1]) == user_id:
+                    del self._ids[previous[1]]
+                for key in typeahead_keys(*previous[1:3]):
+                    position = bisect.bisect_left(self._prefixes, (key, user_id))
+                    if position < len(self._prefixes) and self._prefixes[position] == (key, user_id):
+                        del self._prefixes[position]
+            self._users[user_id] = user
+            self._ids[username] = user_id
+            for key in typeahead_keys(username, full_name):
+                bisect.insort(self._prefixes, (key, user_id))
+
+    def add(self, user):
+        # После регистрации или смены имени: свой процесс обновляем сразу, остальные — по версии
+        self._insert((user.id, user.username, user.full_name, user.level, user.avatar_color))
+        cache.invalidate('usernames')
+
+    def resolve(self, usernames):
+        # Неизвестные имена отсеиваются по словарю, без запроса на каждое упоминание
+        self.ensure_fresh()
+        return {username: self._ids[username] for username in usernames if username in self._ids}
+
+    def suggest(self, query, viewer_id=None, limit=8):
+        key = typeahead_key(query)
+        if not key:
+            return []
+        self.ensure_fresh()
         
-        user = User(
-            username=username,
-            email=email,
-            full_name=full_name,
-            avatar_color=random.choice(colors),
-            cover_color=random.choice(colors)
+        # Диапазон в отсортированном массиве по префиксу; друзья проверяются отдельно,
+        # чтобы попасть в выдачу даже при обрезке длинного диапазона
+        prefixes, users = self._prefixes, self._users
+        low = bisect.bisect_left(prefixes, (key,))
+        high = bisect.bisect_left(prefixes, (key + '\uffff',))
+        candidates = {user_id for _, user_id in prefixes[low:min(high, low + TYPEAHEAD_SCAN_LIMIT)]}
+        # Друзей берём только из общего кэша: подсказка не идёт в БД, без кэша — просто без приоритета друзей
+        friends = (friend_graph.cached(viewer_id) if viewer_id else None) or frozenset()
+        candidates.update(
+            friend_id for friend_id in friends
+            if friend_id in users and any(item.startswith(key) for item in typeahead_keys(*users[friend_id][1:3]))
         )
-        user.set_password(password)
+        candidates.discard(viewer_id)
         
-        db.session.add(user)
-        db.session.commit()
+        def rank(user_id):
+            user = users[user_id]
+            return (user_id in friends, typeahead_key(user[1]).startswith(key), user[3] or 0, -len(user[1]))
         
-        flash('Аккаунт создан! Войдите в систему', 'success')
-        return redirect('/login')
-    
-    return REGISTER_HTML
+        return [
+            {
+                'id': user_id,
+                'username': users[user_id][1],
+                'full_name': users[user_id][2],
+                'level': users[user_id][3],
+                'avatar_color': users[user_id][4],
+                'friend': user_id in friends,
+            }
+            for user_id in heapq.nlargest(limit, candidates, key=rank)
+        ]
 
-@app.route('/logout')
-@login_required
-def logout():
-    logout_user()
-    flash('Вы вышли из системы', 'success')
-    return redirect('/login')
+username_index = UsernameIndex(refresh_interval=float(os.environ.get('USERNAME_INDEX_REFRESH', 60)))
 
-@app.route('/create_post', methods=['POST'])
-@login_required
-def create_post():
-    content = request.form.get('content', '')
-    if content.strip():
-        post = Post(
-            content=content,
-            user_id=current_user.id
-        )
-        current_user.posts_count += 1
-        db.session.add(post)
-        db.session.commit()
-        flash('Пост опубликован!', 'success')
+@event.listens_for(User, 'before_update')
+def touch_profile(mapper, connection, user):
+    state = db.inspect(user)
+    if any(state.attrs[name].history.has_changes() for name in ('username', 'full_name', 'level', 'avatar_color')):
+        user.profile_updated_at = datetime.utcnow()
+
+def extract_mentions(text):
+    usernames = []
+    for match in CONTENT_TOKEN_RE.finditer(text):
+        username = match.group(3)
+        if username and username not in usernames:
+            usernames.append(username)
+    return usernames[:MAX_MENTIONS_PER_POST]
+
+@job_handler('mentions', batch_size=100)
+def notify_mentions(payloads):
+    # Уведомление получает только тот, кому пост виден; все строки — одним executemany
+    rows = []
+    for payload in payloads:
+        user_ids = [user_id for user_id in payload['user_ids'] if user_id != payload['author_id']]
+        if payload['privacy'] == 'private' or not user_ids:
+            continue
+        if payload['privacy'] == 'friends':
+            friends = set()
+            for sender_id, friend_id in db.session.query(Friendship.user_id, Friendship.friend_id).filter(
+                Friendship.status == 'accepted',
+                db.or_(
+                    db.and_(Friendship.user_id == payload['author_id'], Friendship.friend_id.in_(user_ids)),
+                    db.and_(Friendship.friend_id == payload['author_id'], Friendship.user_id.in_(user_ids))
+                )
+            ):
+                friends.update((sender_id, friend_id))
+            user_ids = [user_id for user_id in user_ids if user_id in friends]
+        
+        rows.extend({
+            'user_id': user_id,
+            'type': 'mention',
+            'content': f"@{payload['author']} упомянул вас в посте",
+            'reference_id': payload['post_id'],
+            'is_read': False,
+            'created_at': datetime.utcnow(),
+        } for user_id in user_ids)
     
-    return redirect('/')
+    if rows:
+        db.session.execute(Notification.__table__.insert(), rows)
 
-@app.route('/like/<int:post_id>', methods=['POST'])
+@app.route('/u/<username>')
 @login_required
-def like_post(post_id):
-    post = Post.query.get(post_id)
-    if post:
-        existing_like = Like.query.filter_by(user_id=current_user.id, post_id=post_id).first()
-        
-        if existing_like:
-            db.session.delete(existing_like)
-            post.likes_count = max(0, post.likes_count - 1)
+def profile(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    posts = Post.query.filter(Post.user_id == user.id, visible_to(current_user.id)).order_by(
+        Post.created_at.desc(), Post.id.desc()
+    ).limit(20).all()
+    
+    cards = ''.join([f'''
+            <div class="post">
+                <div style="color: #9ca3af; font-size: 0.9rem; margin-bottom: 0.5rem;">{post.created_at.strftime('%d %b в %H:%M')} · ❤️ {post.likes_count or 0}</div>
+                <div class="post-content">{post_html(post)}</div>
+            </div>''' for post in posts]) or '<p style="color: #9ca3af;">Постов пока нет</p>'
+    
+    return f'''
+    <!DOCTYPE html>
+    <html lang="ru">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Netta | @{escape(user.username)}</title>
+        <style>
+            body {{ background: #0a0a1a; color: white; font-family: 'Segoe UI', sans-serif; margin: 0; padding: 2rem; }}
+            .card {{ max-width: 700px; margin: 0 auto; background: rgba(20, 15, 40, 0.9); border: 2px solid rgba(124, 58, 237, 0.3); border-radius: 15px; padding: 1.5rem; }}
+            .post {{ border-top: 1px solid rgba(124, 58, 237, 0.3); padding: 1rem 0; }}
+            a, .hashtag, .mention {{ color: #a855f7; text-decoration: none; }}
+        </style>
+    </head>
+    <body>
+        <div class="card">
+            <a href="/">← На главную</a>
+            <h2 style="margin: 1rem 0 0.3rem;">{escape(user.full_name or user.username)}</h2>
+            <p style="color: #a855f7;">@{escape(user.username)} · Уровень {user.level}</p>
+            <p style="color: #9ca3af; margin-bottom: 1rem;">{escape(user.bio or '')}</p>
+            {cards}
+        </div>
+    </body>
+    </html>
+    '''
+
+# ============ ПОДСКАЗКИ ИМЁН ============
+TYPEAHEAD_SCAN_LIMIT = 2000
+
+def typeahead_key(text):
+    # Без учёта регистра и различия е/ё
+    return (text or '').strip().casefold().replace('ё', 'е')
+
+def typeahead_keys(username, full_name):
+    keys = {typeahead_key(username)}
+    keys.update(typeahead_key(word) for word in (full_name or '').split())
+    keys.discard('')
+    return keys
+
+@app.route('/api/users/suggest')
+@app.route('/api/v1/users/suggest')
+@api_login_required
+def api_user_suggest():
+    # Ответ из памяти процесса и общего кэша друзей: нажатия клавиш не доходят до БД
+    query = request.args.get('q', '')[:50]
+    limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+    return jsonify({'users': username_index.suggest(query, current_user.id, limit)})
+
+# ============ ПОСТЫ РЯДОМ ============
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+# Ячейка ленты «рядом»: около 4.9 x 4.9 км на экваторе, уже к полюсам
+GEOHASH_CELL_PRECISION = 5
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+NEARBY_RADIUS_KM = float(os.environ.get('NEARBY_RADIUS_KM', 5))
+NEARBY_MAX_RADIUS_KM = float(os.environ.get('NEARBY_MAX_RADIUS_KM', 10))
+NEARBY_MAX_CELLS = int(os.environ.get('NEARBY_MAX_CELLS', 49))
+
+def parse_coordinates(latitude, longitude):
+    if latitude in (None, '') and longitude in (None, ''):
+        return None
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError('bad coordinates')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('bad coordinates')
+    return latitude, longitude
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    # Биты чередуются: чётные делят долготу, нечётные — широту; пять бит на символ
+    bounds = {True: [-180.0, 180.0], False: [-90.0, 90.0]}
+    chars = []
+    value = bits = 0
+    is_longitude = True
+    while len(chars) < precision:
+        low, high = bounds[is_longitude]
+        middle = (low + high) / 2
+        if (longitude if is_longitude else latitude) >= middle:
+            value = value << 1 | 1
+            bounds[is_longitude][0] = middle
         else:
-            like = Like(user_id=current_user.id, post_id=post_id)
-            db.session.add(like)
-            post.likes_count += 1
-            current_user.add_xp(5)
-        
-        db.session.commit()
+            value <<= 1
+            bounds[is_longitude][1] = middle
+        is_longitude = not is_longitude
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            value = bits = 0
+    return ''.join(chars)
+
+def geohash_cell_size(precision):
+    # Высота и ширина ячейки в градусах
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+def geohash_cells(latitude, longitude, radius_km, precision=GEOHASH_CELL_PRECISION):
+    # Ячейки фиксированной точности, покрывающие описанный вокруг круга прямоугольник: шагаем на ячейку
+    # от нижнего края и последней точкой берём верхний. Ширину считаем на самой дальней от экватора широте
+    height, width = geohash_cell_size(precision)
+    latitude_delta = radius_km / KM_PER_DEGREE
+    far_latitude = min(90.0, abs(latitude) + latitude_delta)
+    longitude_delta = min(180.0, radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(far_latitude)), 1e-6)))
     
-    return redirect('/')
+    low_latitude, high_latitude = max(-90.0, latitude - latitude_delta), min(90.0, latitude + latitude_delta)
+    rows = int((high_latitude - low_latitude) / height) + 2
+    columns = int(2 * longitude_delta / width) + 2
+    if rows * columns > 4 * NEARBY_MAX_CELLS:
+        raise ValueError('radius too large')
+    
+    latitudes = [min(high_latitude, low_latitude + height * index) for index in range(rows - 1)] + [high_latitude]
+    longitudes = [min(longitude + longitude_delta, longitude - longitude_delta + width * index) for index in range(columns - 1)]
+    longitudes.append(longitude + longitude_delta)
+    cells = {
+        geohash_encode(cell_latitude, (cell_longitude + 180) % 360 - 180, precision)
+        for cell_latitude in latitudes for cell_longitude in longitudes
+    }
+    if len(cells) > NEARBY_MAX_CELLS:
+        raise ValueError('radius too large')
+    return sorted(cells)
+
+def distance_km(latitude, longitude, other_latitude, other_longitude):
+    latitude, longitude, other_latitude, other_longitude = map(math.radians, (latitude, longitude, other_latitude, other_longitude))
+    a = math.sin((other_latitude - latitude) / 2) ** 2 + \
+        math.cos(latitude) * math.cos(other_latitude) * math.sin((other_longitude - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def nearby_query(latitude, longitude, radius_km, limit=20, before=None):
+    # Каждая ячейка — равенство по geohash_cell и упорядоченный диапазон индекса (geohash_cell, created_at, id)
+    # не дальше limit строк после keyset-условия; других условий в ветке нет, чтобы планировщик не ушёл
+    # на индексы приватности. Объединение и сортировка — в том же запросе, как в feed_query
+    def branch(cell):
+        query = db.select(Post.id).where(Post.geohash_cell == cell)
+        if before:
+            query = query.where(db.or_(
+                Post.created_at < before[0],
+                db.and_(Post.created_at == before[0], Post.id < before[1])
+            ))
+        return db.select(query.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit).subquery())
+    
+    candidates = db.union_all(*[branch(cell) for cell in geohash_cells(latitude, longitude, radius_km)]).subquery()
+    return Post.query.options(db.joinedload(Post.author)).join(candidates, Post.id == candidates.c.id).order_by(
+        Post.created_at.desc(), Post.id.desc()
+    ).limit(limit)
+
+def nearby_posts(viewer_id, latitude, longitude, radius_km, limit=20, before=None):
+    # Видимость и расстояние проверяем только для кандидатов страницы. Возвращает подходящие посты
+    # и последний просмотренный кандидат — от него строится курсор следующей страницы
+    scanned = nearby_query(latitude, longitude, radius_km, limit=limit, before=before).all()
+    friend_ids = accepted_friend_ids(viewer_id) if any(
+        post.privacy == 'friends' and post.user_id != viewer_id for post in scanned
+    ) else frozenset()
+    posts = [
+        post for post in scanned
+        if can_view(post, viewer_id, friend_ids) and distance_km(latitude, longitude, post.latitude, post.longitude) <= radius_km
+    ]
+    return posts, scanned[-1] if len(scanned) == limit else None
+
+@app.route('/api/v1/posts/nearby')
+@api_login_required
+def api_nearby():
+    try:
+        coordinates = parse_coordinates(request.args.get('lat'), request.args.get('lon'))
+    except ValueError:
+        return jsonify({'error': 'bad coordinates'}), 400
+    if not coordinates:
+        return jsonify({'error': 'lat and lon required'}), 400
+    
+    radius_km = request.args.get('radius', NEARBY_RADIUS_KM, type=float)
+    if not 0 < radius_km <= NEARBY_MAX_RADIUS_KM:
+        return jsonify({'error': f'radius must be between 0 and {NEARBY_MAX_RADIUS_KM:g} km'}), 400
+    try:
+        geohash_cells(*coordinates, radius_km)
+    except ValueError:
+        # Ближе к полюсам ячейки узкие, и тот же радиус покрывает слишком много ячеек
+        return jsonify({'error': 'radius too large for this latitude'}), 400
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+    before = None
+    if request.args.get('cursor'):
+        try:
+            before = decode_cursor(request.args['cursor'])
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({'error': 'bad cursor'}), 400
+    
+    # Страница может быть короче limit (углы ячеек за пределами круга), но курсор всё равно продолжает обход
+    posts, last_scanned = nearby_posts(current_user.id, *coordinates, radius_km, limit=limit, before=before)
+    view_counter.record([post.id for post in posts], current_user.id)
+    return conditional_json({
+        'posts': [
+            dict(item, distance_km=round(distance_km(*coordinates, post.latitude, post.longitude), 2))
+            for item, post in zip(serialize_posts(posts, api_fields()), posts)
+        ],
+        'next_cursor': encode_cursor(last_scanned) if last_scanned else None,
+    })
 
 @app.errorhandler(404)
 def not_found(error):
@@ -1679,7 +4676,7 @@ def not_found(error):
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        run_migrations()
         
         if not User.query.first():
             users = [
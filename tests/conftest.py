@@ -0,0 +1,64 @@
+import contextvars
+import os
+import sys
+import tempfile
+
+import pytest
+from flask.testing import FlaskClient
+
+# База задаётся до импорта netta: приложение читает DATABASE_URL при импорте
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'netta-test.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import netta
+from netta import db, User
+
+
+@pytest.fixture(autouse=True)
+def isolated_workers(monkeypatch):
+    # Фоновые потоки очереди задач и журнала опыта не запускаем — тесты применяют их явно;
+    # корзины лимитера свои на каждый тест
+    monkeypatch.setattr(netta.job_queue, 'threads', 0)
+    monkeypatch.setattr(netta.xp_ledger, 'notify', lambda: None)
+    monkeypatch.setattr(netta, 'rate_limit_store', netta.MemoryBucketStore())
+
+
+@pytest.fixture
+def app_context():
+    # Контекст приложения с актуальной схемой; незавершённая транзакция теста откатывается
+    with netta.app.app_context():
+        netta.run_migrations()
+        yield
+        db.session.rollback()
+
+
+@pytest.fixture
+def make_user(app_context):
+    # База общая для всех модулей: пользователь с тем же именем возвращается как есть
+    def make_user(name, **values):
+        user = User.query.filter_by(username=name).first()
+        if user is None:
+            user = User(username=name, email=f'{name}@netta.test', password_hash='x', **values)
+            db.session.add(user)
+            db.session.commit()
+        return user
+    return make_user
+
+
+class IsolatedClient(FlaskClient):
+    # Каждый запрос — в своём контексте приложения, как на сервере: своя сессия БД и свой g,
+    # а не контекст теста, который Flask иначе переиспользует
+    def open(self, *args, **kwargs):
+        return contextvars.Context().run(super().open, *args, **kwargs)
+
+
+@pytest.fixture
+def login(app_context):
+    # Тестовый клиент, вошедший как user
+    def login(user):
+        client = IsolatedClient(netta.app, netta.app.response_class)
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        return client
+    return login
+
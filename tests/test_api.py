@@ -0,0 +1,52 @@
+import pytest
+import netta
+
+
+@pytest.fixture
+def client(make_user, login):
+    return login(make_user('api_user'))
+
+
+@pytest.mark.parametrize('body', ['[1, 2]', '"text"', '42', 'null', 'not json'])
+def test_create_post_requires_json_object(client, body):
+    response = client.post('/api/v1/posts', data=body, content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'json object required'}
+
+
+def test_create_post(client):
+    response = client.post('/api/v1/posts', json={'content': 'hello'})
+    assert response.status_code == 201
+    assert response.get_json()['post']['content'] == 'hello'
+
+
+def test_post_rate_limit(client):
+    # Корзина пользователя на посты — 5 запросов, шестой отклоняется
+    for _ in range(5):
+        assert client.post('/api/v1/posts', json={'content': 'hello'}).status_code == 201
+    response = client.post('/api/v1/posts', json={'content': 'hello'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['error'] == 'rate limited'
+
+
+def test_rate_limit_fails_open(client, monkeypatch):
+    # Недоступное хранилище корзин не должно ронять запросы
+    class BrokenStore:
+        def take(self, key, rate, capacity):
+            raise ConnectionError('redis down')
+
+    monkeypatch.setattr(netta, 'rate_limit_store', BrokenStore())
+    for _ in range(6):
+        assert client.post('/api/v1/posts', json={'content': 'hello'}).status_code == 201
+
+
+def test_bucket_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(netta.time, 'monotonic', lambda: now[0])
+    store = netta.MemoryBucketStore()
+    assert store.take('k', 0.5, 2) == (True, 0)
+    assert store.take('k', 0.5, 2) == (True, 0)
+    assert store.take('k', 0.5, 2) == (False, 2.0)
+    now[0] += 2
+    assert store.take('k', 0.5, 2) == (True, 0)
@@ -0,0 +1,79 @@
+import json
+from datetime import datetime
+
+import pytest
+import netta
+from netta import db, Comment, CommentArchive, Like, LikeArchive, PollOption, Post, PostArchive
+
+# Старше любых постов других тестов: архивация по этой границе трогает только посты фикстуры
+CREATED_AT = datetime(1990, 1, 1)
+UPDATED_AT = datetime(1990, 1, 2)
+CUTOFF = datetime(1991, 1, 1)
+
+
+@pytest.fixture
+def archived(make_user):
+    author, reader = make_user('archive_author'), make_user('archive_reader')
+    post = Post(content='старый пост', user_id=author.id, created_at=CREATED_AT, updated_at=UPDATED_AT,
+                likes_count=1, comments_count=1)
+    poll = Post(content='старый опрос', user_id=author.id, created_at=CREATED_AT, updated_at=UPDATED_AT)
+    db.session.add_all([post, poll])
+    db.session.flush()
+    like = Like(user_id=reader.id, post_id=post.id)
+    comment = Comment(content='старый комментарий', user_id=reader.id, post_id=post.id)
+    db.session.add_all([like, comment, PollOption(post_id=poll.id, text='да')])
+    db.session.commit()
+    ids = post.id, poll.id, like.id, comment.id
+
+    netta.archive_posts(CUTOFF)
+    db.session.expire_all()
+    return author, reader, *ids
+
+
+def test_archive_moves_likes_and_comments_with_post(archived):
+    author, reader, post_id, poll_id, like_id, comment_id = archived
+    assert db.session.get(Post, post_id) is None
+    assert Like.query.filter_by(post_id=post_id).count() == 0
+    assert Comment.query.filter_by(post_id=post_id).count() == 0
+
+    assert PostArchive.query.filter_by(id=post_id).one().updated_at == UPDATED_AT
+    like = LikeArchive.query.filter_by(post_id=post_id).one()
+    assert (like.id, like.user_id, like.created_at is not None) == (like_id, reader.id, True)
+    comment = CommentArchive.query.filter_by(post_id=post_id).one()
+    assert (comment.id, comment.content) == (comment_id, 'старый комментарий')
+
+    # Посты с опросами остаются в горячей таблице
+    assert db.session.get(Post, poll_id) is not None
+    assert PostArchive.query.filter_by(id=poll_id).count() == 0
+
+
+def test_archived_post_is_served_with_archived_like(archived, login):
+    author, reader, post_id = archived[:3]
+    fields = 'id,archived,liked,likes_count,comments_count'
+    post = login(reader).get(f'/api/v1/posts/{post_id}?fields={fields}').get_json()['post']
+    assert post == {'id': post_id, 'archived': True, 'liked': True, 'likes_count': 1, 'comments_count': 1}
+    assert login(author).get(f'/api/v1/posts/{post_id}?fields=liked').get_json()['post'] == {'liked': False}
+
+
+def test_archived_likes_and_comments_are_exported(archived):
+    reader, post_id, poll_id, like_id, comment_id = archived[1:]
+    records = [json.loads(line) for chunk in netta.export_chunks(reader.id) for line in chunk.splitlines()]
+    exported = {(record['type'], record['data']['id']) for record in records if 'data' in record}
+    assert {('like', like_id), ('comment', comment_id)} <= exported
+
+
+def test_rerender_posts_includes_archive(archived):
+    post_id, poll_id = archived[2:4]
+    for model, row_id in ((PostArchive, post_id), (Post, poll_id)):
+        table = model.__table__
+        db.session.execute(table.update().where(table.c.id == row_id).values(
+            content_html=None, content_html_version=None, updated_at=table.c.updated_at
+        ))
+    db.session.commit()
+
+    netta.app.test_cli_runner().invoke(netta.rerender_posts)
+    db.session.expire_all()
+    for post in (PostArchive.query.filter_by(id=post_id).one(), db.session.get(Post, poll_id)):
+        assert post.content_html_version == netta.CONTENT_RENDERER_VERSION
+        assert post.content_html == netta.render_content(post.content)
+        assert post.updated_at == UPDATED_AT
@@ -0,0 +1,303 @@
+import os
+import socketserver
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import netta
+from netta import Cache, FileBackend, MemoryBackend, RedisBackend, RespClient
+
+
+def bulk(value):
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    # Подставной сервер: GET/SET/DEL/INCR/EVAL/PUBLISH/SUBSCRIBE поверх словаря; EVAL понимает
+    # только скрипт снятия блокировки
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                args = RespClient.read_reply(self.rfile)
+            except ConnectionError:
+                return
+            command = args[0].decode().upper()
+            if command == 'SUBSCRIBE':
+                channel = args[1].decode()
+                with server.lock:
+                    server.subscribers.setdefault(channel, []).append(self.wfile)
+                self.wfile.write(b'*3\r\n' + bulk(b'subscribe') + bulk(args[1]) + b':1\r\n')
+                continue
+            with server.lock:
+                reply = self.execute(server, command, args[1:])
+            self.wfile.write(reply)
+
+    def execute(self, server, command, args):
+        data = server.data
+        if command == 'GET':
+            value = data.get(args[0])
+            return b'$-1\r\n' if value is None else bulk(value)
+        if command == 'SET':
+            if b'NX' in args[2:] and args[0] in data:
+                return b'$-1\r\n'
+            data[args[0]] = args[1]
+            return b'+OK\r\n'
+        if command == 'EVAL':
+            key, token = args[2], args[3]
+            if data.get(key) != token:
+                return b':0\r\n'
+            del data[key]
+            return b':1\r\n'
+        if command == 'DEL':
+            return b':%d\r\n' % (data.pop(args[0], None) is not None)
+        if command == 'INCR':
+            data[args[0]] = str(int(data.get(args[0], b'0')) + 1).encode()
+            return b':%s\r\n' % data[args[0]]
+        if command == 'PUBLISH':
+            listeners = server.subscribers.get(args[0].decode(), [])
+            for wfile in listeners:
+                wfile.write(RespClient.encode([b'message', args[0], args[1]]))
+            return b':%d\r\n' % len(listeners)
+        return b'-ERR unknown command\r\n'
+
+
+@pytest.fixture
+def fake_redis():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.data = {}
+    server.subscribers = {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'redis://127.0.0.1:{server.server_address[1]}/0'
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    backend.get('a')
+    backend.set('c', 3)
+    assert (backend.get('a'), backend.get('b'), backend.get('c')) == (1, None, 3)
+
+
+def test_memory_backend_expires_entries():
+    backend = MemoryBackend()
+    backend.set('a', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get('a') is None
+
+
+def test_invalidate_bumps_namespace_version():
+    cache = Cache(MemoryBackend())
+    cache.set('feed', 'top', [1, 2])
+    cache.invalidate('feed')
+    assert cache.get('feed', 'top') is None
+    assert cache.version('feed') == 1
+
+
+def test_get_or_set_coalesces_concurrent_misses():
+    cache = Cache(MemoryBackend())
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'value'
+
+    with netta.app.app_context():
+        threads = [threading.Thread(target=cache.get_or_set, args=('feed', 'top', loader)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert len(calls) == 1
+
+
+def coalesced_calls(caches):
+    # Каждый кэш — отдельный «процесс»: у них общий только бэкенд
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'value'
+
+    with netta.app.app_context():
+        threads = [
+            threading.Thread(target=caches[number % len(caches)].get_or_set, args=('feed', 'top', loader))
+            for number in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return len(calls)
+
+
+def test_get_or_set_coalesces_misses_across_file_workers(tmp_path):
+    caches = [Cache(FileBackend(str(tmp_path)), version_ttl=0) for _ in range(4)]
+    assert coalesced_calls(caches) == 1
+    assert all(cache._fill_locks == {} for cache in caches)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.fill')]
+
+
+def test_get_or_set_coalesces_misses_across_redis_workers(fake_redis):
+    caches = [Cache(RedisBackend(RespClient.from_url(fake_redis))) for _ in range(4)]
+    assert coalesced_calls(caches) == 1
+    client = RespClient.from_url(fake_redis)
+    assert client.command('GET', caches[0].key('feed', 'top') + ':fill') is None
+
+
+def test_file_fill_lock_of_dead_worker_expires(tmp_path):
+    backend = FileBackend(str(tmp_path))
+    token = backend.acquire('feed', ttl=30)
+    assert backend.acquire('feed', ttl=30) is None
+    # Владелец упал, не сняв блокировку: по истечении ttl её забирает другой воркер
+    os.utime(token, (time.time() - 60, time.time() - 60))
+    assert backend.acquire('feed', ttl=30) is not None
+
+
+def test_result_loaded_during_invalidation_is_not_served():
+    cache = Cache(MemoryBackend())
+    cache.get_or_set('feed', 'top', lambda: cache.invalidate('feed') or 'stale')
+    assert cache.get('feed', 'top') is None
+
+
+def test_file_backend_is_shared_between_workers(tmp_path):
+    first = Cache(FileBackend(str(tmp_path)), version_ttl=0)
+    second = Cache(FileBackend(str(tmp_path)), version_ttl=0)
+    first.set('feed', 'top', {'ids': [1, 2]})
+    assert second.get('feed', 'top') == {'ids': [1, 2]}
+    second.invalidate('feed')
+    assert first.get('feed', 'top') is None
+
+
+def test_resp_client_round_trip(fake_redis):
+    client = RespClient.from_url(fake_redis)
+    assert client.command('SET', 'key', 'value') == 'OK'
+    assert client.command('GET', 'key') == b'value'
+    assert client.command('INCR', 'counter') == 1
+    assert client.command('GET', 'missing') is None
+    with pytest.raises(netta.RespError):
+        client.command('NOPE')
+
+
+def test_resp_client_reconnects_after_disconnect(fake_redis):
+    client = RespClient.from_url(fake_redis)
+    client.command('SET', 'key', 'value')
+    client._local.connection[0].close()
+    assert client.command('GET', 'key') == b'value'
+
+
+def test_redis_invalidation_reaches_other_workers(fake_redis):
+    first = Cache(RedisBackend(RespClient.from_url(fake_redis)))
+    second = Cache(RedisBackend(RespClient.from_url(fake_redis)))
+    time.sleep(0.1)
+
+    first.set('feed', 'top', [1, 2])
+    assert second.get('feed', 'top') == [1, 2]
+    first.invalidate('feed')
+    assert wait_for(lambda: second.get('feed', 'top') is None)
+
+    assert Cache(RedisBackend(RespClient.from_url(fake_redis))).version('feed') == 1
+
+    second.set('feed', 'top', [3])
+    assert first.get('feed', 'top') == [3]
+    second.delete('feed', 'top')
+    assert wait_for(lambda: first.get('feed', 'top') is None)
+
+
+def test_hot_feed_resets_only_window_with_changed_posts(monkeypatch):
+    monkeypatch.setattr(netta, 'cache', Cache(MemoryBackend()))
+    feed = netta.HotFeed(size=2)
+    window = (SimpleNamespace(id=1), SimpleNamespace(id=2))
+    netta.cache.set('hot_feed', feed.key(), window)
+
+    feed.invalidate_posts([3, 4])
+    assert netta.cache.get('hot_feed', feed.key()) == window
+    feed.invalidate_posts([2, 3])
+    assert netta.cache.get('hot_feed', feed.key()) is None
+
+
+@pytest.fixture
+def workers(app_context, tmp_path, monkeypatch):
+    # Два воркера с общим файловым бэкендом; switch(n) подменяет глобальный кэш приложения
+    caches = [Cache(FileBackend(str(tmp_path)), version_ttl=0) for _ in range(2)]
+
+    def switch(number):
+        monkeypatch.setattr(netta, 'cache', caches[number])
+
+    return switch
+
+
+def test_friend_graph_invalidation_reaches_other_workers(workers, make_user):
+    first, second = make_user('graph0').id, make_user('graph1').id
+    netta.db.session.add(netta.Friendship(user_id=first, friend_id=second, status='accepted'))
+    netta.db.session.commit()
+
+    workers(0)
+    assert netta.friend_graph.friends(first) == {second}
+    netta.Friendship.query.filter_by(user_id=first).delete()
+    netta.db.session.commit()
+    assert netta.friend_graph.friends(first) == {second}
+
+    workers(1)
+    netta.friend_graph.invalidate(first, second)
+    workers(0)
+    assert netta.friend_graph.friends(first) == frozenset()
+
+
+def test_leaderboard_update_reaches_other_workers(workers, make_user):
+    leaderboard = netta.Leaderboard(netta.User.coins, size=1)
+    user = make_user('climber', coins=0)
+
+    workers(0)
+    assert user.id not in [cached['id'] for _, _, cached in leaderboard.top()]
+
+    workers(1)
+    user.coins = 10 ** 9
+    netta.db.session.commit()
+    leaderboard.update([user])
+
+    workers(0)
+    assert leaderboard.top(1)[0][2]['id'] == user.id
+    assert leaderboard.rank(user) == (1, True)
+
+
+def test_friend_graph_drops_list_read_before_invalidation(workers, make_user, monkeypatch):
+    first, second = make_user('graph2').id, make_user('graph3').id
+    netta.db.session.add(netta.Friendship(user_id=first, friend_id=second, status='accepted'))
+    netta.db.session.commit()
+    workers(0)
+    cache_set = netta.cache.set
+    raced = []
+
+    def racing_set(namespace, key, value, *args, **kwargs):
+        # Другой воркер удаляет дружбу и сбрасывает граф после чтения из БД, но до записи в кэш
+        if namespace == 'friend_graph' and not raced:
+            raced.append(True)
+            workers(1)
+            netta.Friendship.query.filter_by(user_id=first).delete()
+            netta.db.session.commit()
+            netta.friend_graph.invalidate(first, second)
+            workers(0)
+        return cache_set(namespace, key, value, *args, **kwargs)
+
+    monkeypatch.setattr(netta.cache, 'set', racing_set)
+    assert netta.friend_graph.friends(first) == {second}
+    assert netta.friend_graph.cached(first) is None
+    assert netta.friend_graph.friends(first) == frozenset()
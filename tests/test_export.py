@@ -0,0 +1,53 @@
+import json
+from datetime import datetime
+
+import pytest
+import netta
+from netta import db, Comment, Friendship, Like, Message, Post
+
+
+@pytest.fixture
+def owner(make_user):
+    user = make_user('exporter')
+    if Post.query.filter_by(user_id=user.id).first() is None:
+        other = make_user('export_peer')
+        # Одинаковое время у части постов: порядок внутри него держит id
+        same_time = datetime(2024, 1, 1)
+        posts = [Post(content=f'post {i}', user_id=user.id, created_at=same_time if i % 2 else None) for i in range(7)]
+        db.session.add_all(posts)
+        db.session.flush()
+        db.session.add_all(Comment(content=f'comment {i}', user_id=user.id, post_id=posts[i].id) for i in range(5))
+        db.session.add_all(Like(user_id=user.id, post_id=post.id) for post in posts[:4])
+        db.session.add_all(Message(sender_id=user.id, receiver_id=other.id, content=f'm{i}') for i in range(3))
+        db.session.add(Friendship(user_id=other.id, friend_id=user.id, status='accepted'))
+        db.session.commit()
+    return user.id
+
+
+def read(chunks):
+    return [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+
+
+def rows(records):
+    return [(record['type'], record['data']['id']) for record in records if 'data' in record]
+
+
+def test_export_resumes_from_every_cursor(owner):
+    full = read(netta.export_chunks(owner, chunk_size=2))
+    assert full[-1]['type'] == 'end'
+    exported = rows(full)
+    assert len(exported) == len(set(exported)) == 1 + 7 + 5 + 4 + 3 + 1
+
+    for position, record in enumerate(full):
+        if record['type'] != 'cursor':
+            continue
+        section, after = netta.decode_export_cursor(record['cursor'])
+        resumed = read(netta.export_chunks(owner, section, after, chunk_size=3))
+        assert rows(resumed) == rows(full[position + 1:])
+
+
+def test_export_rejects_bad_cursor(owner):
+    with pytest.raises((ValueError, TypeError)):
+        netta.decode_export_cursor(netta.encode_export_cursor(len(netta.EXPORT_SECTIONS) + 1))
+    with pytest.raises((ValueError, TypeError)):
+        netta.decode_export_cursor(netta.encode_export_cursor(1, [1]))
@@ -0,0 +1,39 @@
+import pytest
+import netta
+from netta import db, Friendship, Post
+
+
+@pytest.fixture
+def friends_post(make_user):
+    viewer = make_user('feed_viewer')
+    author = make_user('feed_friend')
+    db.session.add(Friendship(user_id=author.id, friend_id=viewer.id, status='accepted'))
+    latitude, longitude = 10.0, 10.0
+    geohash = netta.geohash_encode(latitude, longitude)
+    post = Post(
+        content='для друзей', user_id=author.id, privacy='friends', latitude=latitude, longitude=longitude,
+        geohash=geohash, geohash_cell=geohash[:netta.GEOHASH_CELL_PRECISION]
+    )
+    db.session.add(post)
+    db.session.commit()
+    return viewer.id, author.id, post.id
+
+
+def visibility(viewer_id, post_id):
+    return {
+        'feed': post_id in [post.id for post in netta.feed_query(viewer_id, limit=50)],
+        'nearby': post_id in [post.id for post in netta.nearby_posts(viewer_id, 10.0, 10.0, 5)[0]],
+        'post': netta.visible_post(post_id, viewer_id) is not None,
+    }
+
+
+def test_unfriended_posts_hidden_despite_cached_graph(friends_post):
+    viewer_id, author_id, post_id = friends_post
+    # Граф друзей закэширован до удаления дружбы; в другом воркере он так и останется до TTL
+    assert netta.friend_graph.friends(viewer_id) == {author_id}
+    assert visibility(viewer_id, post_id) == {'feed': True, 'nearby': True, 'post': True}
+
+    netta.friendship_between(viewer_id, author_id).delete()
+    db.session.commit()
+    assert netta.friend_graph.friends(viewer_id) == {author_id}
+    assert visibility(viewer_id, post_id) == {'feed': False, 'nearby': False, 'post': False}
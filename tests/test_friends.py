@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import netta
+from netta import db, Friendship, User
+
+
+@pytest.fixture
+def pair(make_user, login):
+    # Два новых пользователя на тест: счётчики друзей проверяются от нуля
+    first = make_user(f'friend_a{User.query.count()}')
+    second = make_user(f'friend_b{User.query.count()}')
+    # Граф друзей уже в кэше — маршруты должны сбрасывать его сами
+    netta.friend_graph.friends(first.id)
+    netta.friend_graph.friends(second.id)
+    return first, second, login(first), login(second)
+
+
+def status(first, second):
+    # Объекты в сессии теста могли загрузиться до запросов клиента
+    db.session.expire_all()
+    friendship = netta.friendship_between(first.id, second.id).first()
+    return friendship and friendship.status
+
+
+def friends_counts(*users):
+    db.session.expire_all()
+    return [db.session.get(User, user.id).friends_count for user in users]
+
+
+def test_request_and_accept(pair):
+    first, second, first_client, second_client = pair
+    first_client.post(f'/friends/request/{second.id}')
+    assert status(first, second) == 'pending'
+    assert netta.friend_graph.friends(first.id) == frozenset()
+
+    second_client.post(f'/friends/accept/{first.id}')
+    assert status(first, second) == 'accepted'
+    assert netta.friend_graph.friends(first.id) == {second.id}
+    assert netta.friend_graph.friends(second.id) == {first.id}
+    assert friends_counts(first, second) == [1, 1]
+
+
+def test_counter_request_accepts(pair):
+    first, second, first_client, second_client = pair
+    first_client.post(f'/friends/request/{second.id}')
+    second_client.post(f'/friends/request/{first.id}')
+    assert status(first, second) == 'accepted'
+    assert netta.friend_graph.friends(second.id) == {first.id}
+    assert friends_counts(first, second) == [1, 1]
+
+
+def test_simultaneous_counter_requests_make_one_friendship(pair, monkeypatch):
+    first, second, first_client, second_client = pair
+    between = netta.friendship_between
+    raced = []
+
+    def racing(user_id, other_id):
+        # Встречная заявка записывается после проверки этого запроса, но до его вставки
+        if not raced:
+            raced.append(True)
+            query = between(user_id, other_id)
+            db.session.add(Friendship(user_id=second.id, friend_id=first.id))
+            db.session.commit()
+            return query.filter(db.false())
+        return between(user_id, other_id)
+
+    monkeypatch.setattr(netta, 'friendship_between', racing)
+    first_client.post(f'/friends/request/{second.id}')
+    assert status(first, second) == 'accepted'
+    assert friends_counts(first, second) == [1, 1]
+
+
+def test_reverse_duplicate_is_rejected(pair):
+    first, second = pair[:2]
+    db.session.add(Friendship(user_id=first.id, friend_id=second.id))
+    db.session.commit()
+    db.session.add(Friendship(user_id=second.id, friend_id=first.id))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+
+
+def test_remove_friend_and_cancel_request(pair):
+    first, second, first_client, second_client = pair
+    first_client.post(f'/friends/request/{second.id}')
+    second_client.post(f'/friends/accept/{first.id}')
+    assert netta.friend_graph.friends(second.id) == {first.id}
+
+    second_client.post(f'/friends/remove/{first.id}')
+    assert status(first, second) is None
+    assert netta.friend_graph.friends(first.id) == frozenset()
+    assert netta.friend_graph.friends(second.id) == frozenset()
+    assert friends_counts(first, second) == [0, 0]
+
+    first_client.post(f'/friends/request/{second.id}')
+    first_client.post(f'/friends/remove/{second.id}')
+    assert status(first, second) is None
+    assert friends_counts(first, second) == [0, 0]
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+import netta
+from netta import db, Comment, Job, Post
+
+STARTED = datetime(2025, 6, 1)
+
+
+@pytest.fixture
+def author(make_user):
+    # Свой автор на тест: лента «только свои непубличные» содержит ровно посты теста
+    user = make_user(f'hot_author{Post.query.count()}')
+    Job.query.delete()
+    db.session.commit()
+    return user
+
+
+def add_post(user, seconds, **counters):
+    post = Post(content='горячее', user_id=user.id, privacy='friends', created_at=STARTED + timedelta(seconds=seconds), **counters)
+    db.session.add(post)
+    db.session.commit()
+    return post
+
+
+def hot_ids(user):
+    return [post.id for post in netta.feed_query(user.id, limit=10, public=False, order='hot')]
+
+
+def run_jobs():
+    while netta.job_queue.run_once('hot-test'):
+        pass
+    db.session.expire_all()
+
+
+def test_score_trades_engagement_for_freshness():
+    score = netta.hot_score(10, 0, 0, STARTED)
+    # Десятикратный рост вовлечённости стоит HOT_SCORE_DECAY секунд свежести
+    later = STARTED + timedelta(seconds=netta.HOT_SCORE_DECAY)
+    assert netta.hot_score(100, 0, 0, STARTED) == pytest.approx(netta.hot_score(10, 0, 0, later))
+    assert netta.hot_score(0, 5, 0, STARTED) == pytest.approx(score)
+    assert netta.hot_score(1, 0, 3, STARTED) == pytest.approx(score)
+    assert netta.hot_score(0, 0, 0, STARTED) == netta.hot_score(1, 0, 0, STARTED)
+
+
+def test_hot_order_follows_stored_score(author):
+    old_popular = add_post(author, 0, likes_count=1000)
+    fresh = add_post(author, 3600)
+    old_quiet = add_post(author, 0)
+    assert old_popular.hot_score == netta.hot_score(1000, 0, 0, old_popular.created_at)
+    assert hot_ids(author) == [old_popular.id, fresh.id, old_quiet.id]
+
+
+def test_like_updates_score_and_order(author, make_user):
+    older = add_post(author, 0)
+    newer = add_post(author, 600)
+    assert hot_ids(author) == [newer.id, older.id]
+
+    for number in range(2):
+        netta.toggle_like(older, make_user(f'hot_liker{number}'))
+    run_jobs()
+    older = db.session.get(Post, older.id)
+    assert older.likes_count == 2
+    assert older.hot_score == pytest.approx(netta.hot_score(2, 0, 0, older.created_at))
+    assert hot_ids(author) == [older.id, newer.id]
+
+
+def test_comment_recount_updates_score_and_order(author, make_user):
+    older = add_post(author, 0)
+    newer = add_post(author, 600)
+    commenter = make_user('hot_commenter')
+    db.session.add_all(Comment(content='!', user_id=commenter.id, post_id=older.id) for _ in range(2))
+    db.session.commit()
+    assert hot_ids(author) == [newer.id, older.id]
+
+    netta.reconcile_chunk('posts.comments_count', older.id, newer.id)
+    db.session.expire_all()
+    older = db.session.get(Post, older.id)
+    assert older.comments_count == 2
+    assert older.hot_score == pytest.approx(netta.hot_score(0, 2, 0, older.created_at))
+    assert hot_ids(author) == [older.id, newer.id]
+
+
+def test_hot_tab_renders(author, login):
+    # Свежий и самый популярный пост — выше публичных постов других тестов
+    post = Post(content='самое горячее', user_id=author.id, likes_count=10 ** 6)
+    db.session.add(post)
+    db.session.commit()
+    response = login(author).get('/?tab=hot')
+    assert response.status_code == 200
+    assert 'самое горячее' in response.get_data(as_text=True)
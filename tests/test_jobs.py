@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+import netta
+from netta import db, Job, JOB_HANDLERS
+
+
+@pytest.fixture
+def handled(app_context, monkeypatch):
+    # Тестовый тип задач: обработчик записывает payload'ы или падает по флагу
+    calls = []
+
+    def handler(payloads):
+        if any(payload.get('fail') for payload in payloads):
+            raise RuntimeError('boom')
+        calls.append(payloads)
+
+    monkeypatch.setitem(JOB_HANDLERS, 'test_job', (handler, 2))
+    Job.query.delete()
+    db.session.commit()
+    return calls
+
+
+def enqueue(kind, payload=None, **kwargs):
+    netta.job_queue.enqueue(kind, payload, **kwargs)
+    db.session.commit()
+
+
+def test_claim_takes_batch_of_one_kind(handled):
+    for number in range(3):
+        enqueue('test_job', {'n': number})
+
+    assert netta.job_queue.run_once('w1') == 2
+    assert netta.job_queue.run_once('w1') == 1
+    assert handled == [[{'n': 0}, {'n': 1}], [{'n': 2}]]
+    assert {job.status for job in Job.query} == {'done'}
+
+
+def test_unknown_kind_does_not_block_queue(handled):
+    enqueue('not_deployed_yet')
+    enqueue('test_job', {'n': 1})
+
+    assert netta.job_queue.run_once('w1') == 1
+    assert handled == [[{'n': 1}]]
+    assert Job.query.filter_by(kind='not_deployed_yet').one().status == 'queued'
+
+
+def test_duplicate_key_is_dropped(handled):
+    enqueue('test_job', {'n': 1}, key='once')
+    enqueue('test_job', {'n': 2}, key='once')
+    assert Job.query.count() == 1
+
+
+def test_failed_job_is_retried_with_backoff(handled):
+    enqueue('test_job', {'fail': True})
+    before = datetime.utcnow()
+    assert netta.job_queue.run_once('w1') == 1
+
+    job = Job.query.one()
+    assert (job.status, job.attempts, job.locked_by) == ('queued', 1, None)
+    assert 'boom' in job.last_error
+    retry_base = netta.job_queue.retry_base
+    assert before + timedelta(seconds=retry_base) <= job.run_at <= datetime.utcnow() + timedelta(seconds=retry_base * 1.5)
+    # До срока повтора задачу не берут
+    assert netta.job_queue.run_once('w1') == 0
+
+    job.run_at = datetime.utcnow()
+    db.session.commit()
+    netta.job_queue.run_once('w1')
+    job = Job.query.one()
+    assert job.attempts == 2
+    assert job.run_at - datetime.utcnow() > timedelta(seconds=retry_base * 2 * 0.9)
+
+
+def test_job_is_dead_lettered_after_max_attempts(handled):
+    enqueue('test_job', {'fail': True}, max_attempts=2)
+    for _ in range(2):
+        Job.query.update({Job.run_at: datetime.utcnow()})
+        db.session.commit()
+        netta.job_queue.run_once('w1')
+
+    job = Job.query.one()
+    assert (job.status, job.attempts) == ('failed', 2)
+    assert job.finished_at is not None
+    assert netta.job_queue.run_once('w1') == 0
+
+
+def test_stale_lock_is_reclaimed(handled):
+    enqueue('test_job', {'n': 1})
+    Job.query.update({
+        Job.status: 'running',
+        Job.locked_by: 'dead-worker',
+        Job.locked_at: datetime.utcnow() - timedelta(seconds=netta.job_queue.lock_timeout + 1),
+    })
+    db.session.commit()
+
+    assert netta.job_queue.run_once('w1') == 1
+    assert Job.query.one().status == 'done'
+
+
+def test_web_process_leaves_media_jobs_to_worker(handled):
+    enqueue('media_variants', {'post_id': 0})
+    enqueue('test_job', {'n': 1})
+
+    # Потоки веб-процесса берут лёгкие задачи, а рендер картинок оставляют flask jobs-worker
+    assert netta.job_queue.run_once('web', inline=True) == 1
+    assert netta.job_queue.run_once('web', inline=True) == 0
+    assert Job.query.filter_by(kind='media_variants').one().status == 'queued'
+
+    assert netta.job_queue.run_once('worker') == 1
+    assert Job.query.filter_by(kind='media_variants').one().status == 'done'
+
+
+def test_web_process_threads_claim_inline(monkeypatch):
+    started = []
+    monkeypatch.setattr(netta.threading, 'Thread', lambda target, args, **kwargs: SimpleNamespace(start=lambda: started.append(args)))
+    monkeypatch.setattr(netta.job_queue, 'threads', 2)
+    monkeypatch.setattr(netta.job_queue, '_worker_pid', None)
+    netta.job_queue.notify()
+    assert [inline for _, inline in started] == [True, True]
@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import event
+
+import netta
+from netta import db, Friendship, Job, Notification
+
+
+@pytest.fixture
+def index(make_user, monkeypatch):
+    for name in ('mention_author', 'mention_friend', 'mention_stranger'):
+        make_user(name)
+    # Свой прогретый индекс имён: общий мог загрузиться до появления пользователей
+    index = netta.UsernameIndex(refresh_interval=3600)
+    index.ensure_fresh()
+    monkeypatch.setattr(netta, 'username_index', index)
+    Job.query.delete()
+    db.session.commit()
+    return index
+
+
+@pytest.fixture
+def statements():
+    executed = []
+    listener = lambda conn, cursor, statement, *args: executed.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+def mention_jobs():
+    return Job.query.filter_by(kind='mentions').count()
+
+
+def test_unknown_names_are_rejected_without_query(index, statements, make_user):
+    friend_id = make_user('mention_friend').id
+    del statements[:]
+    known = index.resolve(['mention_friend', 'mention_nobody', 'mention_ghost'])
+    assert known == {'mention_friend': friend_id}
+    assert index.resolve(['mention_nobody']) == {}
+    assert statements == []
+
+    netta.publish_post(make_user('mention_author'), 'привет @mention_nobody и @mention_ghost')
+    assert mention_jobs() == 0
+
+
+def test_mention_notifications_are_inserted_in_bulk(index, statements, make_user):
+    author, friend, stranger = (make_user(name) for name in ('mention_author', 'mention_friend', 'mention_stranger'))
+    if netta.friendship_between(author.id, friend.id).first() is None:
+        db.session.add(Friendship(user_id=author.id, friend_id=friend.id, status='accepted'))
+        db.session.commit()
+
+    public = netta.publish_post(author, '@mention_friend @mention_stranger @mention_author @mention_nobody смотрите')
+    friends_only = netta.publish_post(author, '@mention_friend @mention_stranger только друзьям', privacy='friends')
+    assert mention_jobs() == 2
+
+    del statements[:]
+    while netta.job_queue.run_once('mentions-test'):
+        pass
+    inserts = [statement for statement in statements if statement.startswith('INSERT INTO notifications')]
+    assert len(inserts) == 1
+
+    notified = {
+        (notification.reference_id, notification.user_id)
+        for notification in Notification.query.filter_by(type='mention').filter(
+            Notification.reference_id.in_([public.id, friends_only.id])
+        )
+    }
+    # Автор себя не уведомляет; пост «для друзей» видит и получает уведомление только друг
+    assert notified == {(public.id, friend.id), (public.id, stranger.id), (friends_only.id, friend.id)}
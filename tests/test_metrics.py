@@ -0,0 +1,11 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from netta import db
+
+
+def test_failed_query_does_not_leak_timing(app_context):
+    connection = db.session.connection()
+    with pytest.raises(OperationalError):
+        connection.exec_driver_sql('SELECT * FROM no_such_table')
+    assert connection.info['query_started'] == []
@@ -0,0 +1,56 @@
+import pytest
+from netta import db, PollOption, PollVote, Post
+
+
+@pytest.fixture
+def polls(make_user):
+    # Два опроса: голос за вариант чужого опроса должен отклоняться
+    author = make_user('poll_author')
+    posts = [Post(content='poll', user_id=author.id) for _ in range(2)]
+    db.session.add_all(posts)
+    db.session.flush()
+    options = [
+        PollOption(post_id=post.id, position=position, text=text)
+        for post in posts for position, text in enumerate(('да', 'нет'))
+    ]
+    db.session.add_all(options)
+    db.session.commit()
+    return posts, options
+
+
+def results(client, post_id):
+    poll = client.get(f'/poll/{post_id}').get_json()
+    return poll['voted_option_id'], [option['votes'] for option in poll['options']], poll['total']
+
+
+def test_votes_are_counted(polls, make_user, login):
+    posts, options = polls
+    voters = [login(make_user(f'poll_voter{i}')) for i in range(3)]
+    for voter, option in zip(voters, (options[0], options[1], options[1])):
+        voter.post(f'/poll/{posts[0].id}/vote/{option.id}')
+
+    assert results(voters[0], posts[0].id) == (options[0].id, [1, 2], 3)
+    assert results(voters[0], posts[1].id) == (None, [0, 0], 0)
+
+
+def test_second_vote_is_rejected(polls, make_user, login):
+    posts, options = polls
+    voter = make_user('poll_twice')
+    client = login(voter)
+    client.post(f'/poll/{posts[0].id}/vote/{options[0].id}')
+    client.post(f'/poll/{posts[0].id}/vote/{options[0].id}')
+    client.post(f'/poll/{posts[0].id}/vote/{options[1].id}')
+
+    assert results(client, posts[0].id) == (options[0].id, [1, 0], 1)
+    assert PollVote.query.filter_by(user_id=voter.id).count() == 1
+
+
+def test_vote_for_option_of_another_poll_is_rejected(polls, make_user, login):
+    posts, options = polls
+    voter = make_user('poll_cross')
+    client = login(voter)
+    client.post(f'/poll/{posts[0].id}/vote/{options[2].id}')
+
+    assert results(client, posts[0].id) == (None, [0, 0], 0)
+    assert results(client, posts[1].id) == (None, [0, 0], 0)
+    assert PollVote.query.filter_by(user_id=voter.id).count() == 0
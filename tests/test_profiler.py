@@ -0,0 +1,46 @@
+import os
+
+import netta
+
+
+def profile_files(directory):
+    return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def test_non_admin_profile_header_is_ignored(make_user, login, monkeypatch, tmp_path):
+    monkeypatch.setattr(netta, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    monkeypatch.setattr(netta, 'ADMIN_USERNAMES', {'profile_admin'})
+    client = login(make_user('profile_user'))
+
+    response = client.get('/', headers={'X-Profile': '1'})
+    assert 'X-Profile-Id' not in response.headers
+    assert profile_files(netta.PROFILE_DIR) == []
+
+
+def test_no_admins_by_default(make_user, login, monkeypatch, tmp_path):
+    monkeypatch.setattr(netta, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    client = login(make_user('admin'))
+
+    response = client.get('/', headers={'X-Profile': '1'})
+    assert 'X-Profile-Id' not in response.headers
+    assert profile_files(netta.PROFILE_DIR) == []
+
+
+def test_admin_profiles_are_rotated(make_user, login, monkeypatch, tmp_path):
+    monkeypatch.setattr(netta, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    monkeypatch.setattr(netta, 'ADMIN_USERNAMES', {'profile_admin'})
+    monkeypatch.setattr(netta, 'PROFILE_MAX_FILES', 2)
+    client = login(make_user('profile_admin'))
+
+    profile_ids = []
+    for _ in range(4):
+        response = client.get('/', headers={'X-Profile': '1'})
+        profile_ids.append(response.headers['X-Profile-Id'])
+        # Уже записанные профили «состариваем»: порядок не зависит от точности меток времени
+        for name in profile_files(netta.PROFILE_DIR):
+            path = os.path.join(netta.PROFILE_DIR, name)
+            os.utime(path, (os.path.getmtime(path) - 10, os.path.getmtime(path) - 10))
+
+    kept = {name.split('.')[0] for name in profile_files(netta.PROFILE_DIR)}
+    assert kept == set(profile_ids[-2:])
+    assert len(profile_files(netta.PROFILE_DIR)) == 2 * len(netta.PROFILE_SUFFIXES)
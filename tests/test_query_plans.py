@@ -0,0 +1,270 @@
+import os
+import re
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+import netta
+from netta import db, Comment, Friendship, Like, Message, Notification, PollOption, PollVote, Post, PostArchive, User, XpEvent
+
+
+@pytest.fixture(scope='module', autouse=True)
+def schema(tmp_path_factory):
+    # Своя база и своё приложение: планы зависят от данных и статистики, строки других модулей их искажают.
+    # PLANS_DATABASE_URL — пустая база Postgres для проверки планов на нём; таблицы удаляются после модуля
+    plans_app = Flask('netta_plans')
+    plans_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'PLANS_DATABASE_URL', 'sqlite:///' + str(tmp_path_factory.mktemp('plans') / 'plans.db')
+    )
+    db.init_app(plans_app)
+    with pytest.MonkeyPatch.context() as monkeypatch, plans_app.app_context():
+        # id пользователей совпадают с id основной базы — кэш графа друзей не должен быть общим
+        monkeypatch.setattr(netta, 'cache', netta.Cache(netta.MemoryBackend()))
+        netta.run_migrations()
+        users = [User(username=f'user{i}', email=f'user{i}@netta.test', password_hash='x') for i in range(30)]
+        db.session.add_all(users)
+        db.session.flush()
+        # Распределение как в ленте: у каждого автора свои посты, большинство публичные
+        posts = [Post(
+            content='post', user_id=users[i % 30].id, privacy=('public', 'public', 'friends', 'private')[i % 4]
+        ) for i in range(600)]
+        db.session.add_all(posts)
+        db.session.flush()
+        db.session.add_all(Comment(content='comment', user_id=users[i % 30].id, post_id=posts[i].id) for i in range(300))
+        # Кольцо дружб: у каждого два друга (ветка ленты «для друзей» — IN по списку) и входящая заявка
+        for i, user in enumerate(users):
+            db.session.add(Friendship(user_id=user.id, friend_id=users[(i + 1) % 30].id, status='accepted'))
+            db.session.add(Friendship(user_id=user.id, friend_id=users[(i + 7) % 30].id, status='pending'))
+        db.session.commit()
+        # Повторный прогон собирает статистику индексов по уже заполненным таблицам;
+        # SQLite читает её при открытии соединения, поэтому открытые соединения пула закрываем
+        netta.run_migrations()
+        db.session.remove()
+        db.engine.dispose()
+        if db.engine.dialect.name == 'postgresql':
+            # На маленьких таблицах Postgres всегда выбирает Seq Scan — проверяем доступность индекса
+            db.session.execute(db.text('SET enable_seqscan = off'))
+        yield
+        db.session.rollback()
+        db.drop_all()
+        db.engine.dispose()
+
+
+def viewer_id():
+    return User.query.filter_by(username='user0').one().id
+
+
+def query_plan(query):
+    # Строки плана как (деталь, деталь родителя); у Postgres дерево не разбираем — родитель пустой
+    connection = db.session.connection()
+    compiled = getattr(query, 'statement', query).compile(
+        dialect=connection.dialect, compile_kwargs={'render_postcompile': True}
+    )
+    if connection.dialect.name == 'sqlite':
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).all()
+        details = {row[0]: row[-1] for row in rows}
+        return [(row[-1], details.get(row[1], '')) for row in rows]
+    rows = connection.exec_driver_sql('EXPLAIN ' + str(compiled), compiled.params)
+    return [(row[-1], '') for row in rows]
+
+
+def plan_text(plan):
+    return '\n'.join(detail for detail, parent in plan)
+
+
+def full_scans(plan, index_walk=False):
+    # Полный проход по индексу — тоже полный скан, если это не упорядоченный обход с LIMIT (index_walk)
+    tables = set(db.metadata.tables)
+    scans = []
+    for detail, parent in plan:
+        match = re.match(r'\s*SCAN (\w+)( USING (COVERING )?INDEX \w+)?\s*$', detail) or re.search(r'Seq Scan on (\w+)', detail)
+        if match and match.group(1) in tables and not (index_walk and 'INDEX' in detail):
+            scans.append(detail)
+    return scans
+
+
+def branch_sorts(plan):
+    # Сортировка внутри ветки (или всего простого запроса) означает, что индекс не отдаёт строки
+    # в нужном порядке и сортируется весь диапазон. Сортировка объединения веток по limit строк — допустима
+    return [
+        detail for detail, parent in plan
+        if 'TEMP B-TREE' in detail and (not parent or parent.startswith(('MATERIALIZE', 'CO-ROUTINE')))
+    ]
+
+
+# Имя запроса -> (запрос, ожидаемые индексы). Кортеж внутри списка — допустимые варианты: имена в SQLite
+# и Postgres или равноценные индексы, между которыми планировщик выбирает по порядку их создания
+HOT_QUERIES = {
+    'feed': (
+        lambda: netta.feed_query(viewer_id(), limit=10),
+        ['ix_posts_privacy_created', 'ix_posts_user_created', 'ix_posts_user_privacy_created'],
+    ),
+    'feed_next_page': (
+        lambda: netta.feed_query(viewer_id(), limit=10, before=(datetime.utcnow(), 100)),
+        ['ix_posts_privacy_created', 'ix_posts_user_created', 'ix_posts_user_privacy_created'],
+    ),
+    'hot_feed': (
+        lambda: netta.feed_query(viewer_id(), limit=10, order='hot'),
+        ['ix_posts_privacy_hot', 'ix_posts_user_hot', 'ix_posts_user_privacy_hot'],
+    ),
+    'hot_feed_next_page': (
+        lambda: netta.feed_query(viewer_id(), limit=10, before=(1000.0, 100), order='hot'),
+        ['ix_posts_privacy_hot', 'ix_posts_user_hot', 'ix_posts_user_privacy_hot'],
+    ),
+    'nearby': (lambda: netta.nearby_query(55.75, 37.62, 5), ['ix_posts_geohash_cell_created']),
+    'nearby_next_page': (
+        lambda: netta.nearby_query(55.75, 37.62, 5, before=(datetime.utcnow(), 100)),
+        ['ix_posts_geohash_cell_created'],
+    ),
+    'visible_post': (
+        lambda: Post.query.filter(Post.id == 1, netta.visible_to(1)),
+        [('uq_friendships_pair', 'ix_friendships_friend_status')],
+    ),
+    'liked_state': (
+        lambda: db.session.query(Like.post_id).filter(Like.user_id == 1, Like.post_id.in_([1, 2, 3])),
+        ['ix_likes_user_post'],
+    ),
+    'like_toggle': (lambda: Like.query.filter_by(user_id=1, post_id=1), ['ix_likes_user_post']),
+    'login': (
+        lambda: User.query.filter((User.username == 'user1') | (User.email == 'user1')),
+        [('sqlite_autoindex_users_1', 'users_username_key'), ('sqlite_autoindex_users_2', 'users_email_key')],
+    ),
+    'post_comments': (
+        lambda: Comment.query.filter_by(post_id=1).order_by(Comment.created_at.desc()).limit(20),
+        ['ix_comments_post_created'],
+    ),
+    'inbox': (
+        lambda: Message.query.filter_by(receiver_id=1).order_by(Message.created_at.desc()).limit(20),
+        ['ix_messages_receiver_created'],
+    ),
+    'notifications': (
+        lambda: Notification.query.filter_by(user_id=1).order_by(Notification.created_at.desc()).limit(20),
+        ['ix_notifications_user_created'],
+    ),
+    'friend_adjacency': (
+        lambda: db.session.query(Friendship.user_id, Friendship.friend_id).filter(
+            Friendship.status == 'accepted',
+            db.or_(Friendship.user_id.in_([1, 2]), Friendship.friend_id.in_([1, 2]))
+        ),
+        ['uq_friendships_pair', 'ix_friendships_friend_status'],
+    ),
+    'friendship_between': (lambda: netta.friendship_between(1, 2), ['uq_friendships_pair']),
+    'leaderboard_level': (
+        lambda: User.query.order_by(User.level.desc(), User.id.desc()).limit(100),
+        ['ix_users_level_rank'],
+    ),
+    'leaderboard_coins': (
+        lambda: User.query.order_by(User.coins.desc(), User.id.desc()).limit(100),
+        ['ix_users_coins_rank'],
+    ),
+    'xp_pending': (
+        lambda: db.session.query(XpEvent.id).filter(XpEvent.applied_at.is_(None)).order_by(XpEvent.id).limit(1000),
+        ['ix_xp_events_pending'],
+    ),
+    'poll_options': (lambda: PollOption.query.filter(PollOption.post_id.in_([1, 2])), ['ix_poll_options_post_id']),
+    'poll_votes': (
+        lambda: db.session.query(PollVote.post_id, PollVote.option_id).filter(
+            PollVote.user_id == 1, PollVote.post_id.in_([1, 2])
+        ),
+        ['uq_poll_votes_post_user'],
+    ),
+    'archived_post': (
+        lambda: PostArchive.query.filter(PostArchive.id == 1, netta.visible_to(1, PostArchive)),
+        [('sqlite_autoindex_posts_archive_1', 'posts_archive_pkey'), ('uq_friendships_pair', 'ix_friendships_friend_status')],
+    ),
+    'archive_posts_batch': (
+        lambda: db.session.query(Post.id).filter(Post.created_at < datetime.utcnow()).order_by(
+            Post.created_at, Post.id
+        ).limit(1000),
+        ['ix_posts_created'],
+    ),
+    'archive_notifications_batch': (
+        lambda: db.session.query(Notification.id).filter(
+            Notification.is_read.is_(True), Notification.created_at < datetime.utcnow()
+        ).order_by(Notification.created_at, Notification.id).limit(1000),
+        ['ix_notifications_read_created'],
+    ),
+    'export_posts': (
+        lambda: netta.export_query(1, viewer_id(), [datetime.utcnow(), 100]),
+        ['ix_posts_user_created'],
+    ),
+    'export_archived_posts': (
+        lambda: netta.export_query(2, viewer_id(), [datetime.utcnow(), 100]),
+        ['ix_posts_archive_user_created_id'],
+    ),
+    'export_comments': (lambda: netta.export_query(3, viewer_id(), [100]), ['ix_comments_user_id']),
+    'export_archived_comments': (lambda: netta.export_query(4, viewer_id(), [100]), ['ix_comments_archive_user_id']),
+    'export_likes': (lambda: netta.export_query(5, viewer_id(), [100, 100]), ['ix_likes_user_post']),
+    'export_archived_likes': (lambda: netta.export_query(6, viewer_id(), [100, 100]), ['ix_likes_archive_user_post_id']),
+    'export_messages_sent': (
+        lambda: netta.export_query(7, viewer_id(), [datetime.utcnow(), 100]),
+        ['ix_messages_sender_created'],
+    ),
+}
+
+# Запросы с keyset-пагинацией или top-N: индекс должен отдавать строки в порядке выдачи.
+# Значение — сколько сортировок внутри веток допустимо: в ленте это ветка IN по друзьям,
+# где сортируются только посты друзей «для друзей»
+KEYSET_QUERIES = {
+    'feed': 1,
+    'feed_next_page': 1,
+    'hot_feed': 1,
+    'hot_feed_next_page': 1,
+    'nearby': 0,
+    'nearby_next_page': 0,
+    'post_comments': 0,
+    'inbox': 0,
+    'notifications': 0,
+    'leaderboard_level': 0,
+    'leaderboard_coins': 0,
+    'xp_pending': 0,
+    'archive_posts_batch': 0,
+    'archive_notifications_batch': 0,
+    'export_posts': 0,
+    'export_archived_posts': 0,
+    'export_comments': 0,
+    'export_archived_comments': 0,
+    'export_likes': 0,
+    'export_archived_likes': 0,
+    'export_messages_sent': 0,
+}
+
+# Упорядоченный обход индекса с LIMIT: читается только начало индекса
+INDEX_WALKS = {'leaderboard_level', 'leaderboard_coins'}
+
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_hot_query_uses_indexes(name):
+    query, expected = HOT_QUERIES[name]
+    plan = query_plan(query())
+    text = plan_text(plan)
+    assert not full_scans(plan, index_walk=name in INDEX_WALKS), text
+    for index in expected:
+        names = index if isinstance(index, tuple) else (index,)
+        assert any(re.search(rf'\b{name}\b', text) for name in names), f'{names} не используется:\n{text}'
+
+
+@pytest.mark.parametrize('name', sorted(KEYSET_QUERIES))
+def test_keyset_query_reads_index_in_order(name):
+    if db.engine.dialect.name != 'sqlite':
+        pytest.skip('дерево плана разбирается только для SQLite')
+    plan = query_plan(HOT_QUERIES[name][0]())
+    assert len(branch_sorts(plan)) <= KEYSET_QUERIES[name], plan_text(plan)
+
+
+def test_full_scan_is_detected():
+    assert full_scans(query_plan(Post.query.filter(Post.content == 'post')))
+    assert full_scans(query_plan(db.session.query(Post.id).filter(Post.privacy.like('%ub%'))))
+
+
+def test_branch_sort_is_detected():
+    if db.engine.dialect.name != 'sqlite':
+        pytest.skip('дерево плана разбирается только для SQLite')
+    plan = query_plan(Post.query.filter(Post.privacy == 'public').order_by(Post.hot_score.desc(), Post.created_at.desc()).limit(10))
+    assert branch_sorts(plan)
+
+
+def test_migrations_are_idempotent():
+    assert netta.run_migrations() == []
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import netta
+from netta import db, Comment, Friendship, Like, Post, PostArchive, User
+
+
+def counters(user_id, post_id):
+    db.session.expire_all()
+    user = db.session.get(User, user_id)
+    post = db.session.get(Post, post_id)
+    return user.posts_count, user.friends_count, post.likes_count, post.comments_count
+
+
+def test_reconcile_fixes_drift(make_user):
+    author = make_user('drift_author')
+    friend = make_user('drift_friend')
+    stranger = make_user('drift_stranger')
+    edited = datetime(2024, 5, 1, 12, 0)
+    posts = [Post(content='post', user_id=author.id, updated_at=edited) for _ in range(3)]
+    db.session.add_all(posts)
+    db.session.flush()
+    # Архивные посты тоже входят в счётчик автора
+    archived_id = db.session.query(db.func.max(Post.id)).scalar() + 100000
+    db.session.add(PostArchive(id=archived_id, created_at=datetime(2020, 1, 1), content='old', user_id=author.id))
+    db.session.add_all([
+        Friendship(user_id=author.id, friend_id=friend.id, status='accepted'),
+        Friendship(user_id=stranger.id, friend_id=author.id, status='pending'),
+        Like(user_id=friend.id, post_id=posts[0].id),
+        Comment(content='comment', user_id=friend.id, post_id=posts[0].id),
+        Comment(content='comment', user_id=author.id, post_id=posts[0].id),
+    ])
+    db.session.flush()
+    author.posts_count, author.friends_count = 9, None
+    Post.query.filter_by(id=posts[0].id).update({Post.likes_count: 5, Post.comments_count: 0, Post.updated_at: Post.updated_at})
+    db.session.commit()
+
+    report = netta.reconcile_counters(chunk_size=100, dry_run=True)
+    assert all(report[name]['rows'] >= 1 for name in netta.COUNTERS)
+    assert counters(author.id, posts[0].id) == (9, None, 5, 0)
+
+    netta.reconcile_counters(chunk_size=100)
+    assert counters(author.id, posts[0].id) == (4, 1, 1, 2)
+    assert db.session.get(Post, posts[1].id).likes_count == 0
+    # Исправление счётчика — не правка поста
+    assert {post.updated_at for post in posts} == {edited}
+    assert all(totals['rows'] == 0 for totals in netta.reconcile_counters().values())
+
+
+def test_like_recount_keeps_updated_at(make_user):
+    author = make_user('recount_author')
+    edited = datetime(2024, 5, 1, 12, 0)
+    post = Post(content='post', user_id=author.id, updated_at=edited)
+    db.session.add(post)
+    db.session.flush()
+    db.session.add(Like(user_id=author.id, post_id=post.id))
+    db.session.commit()
+
+    netta.recount_post_likes([{'post_id': post.id}])
+    db.session.commit()
+    db.session.expire_all()
+    assert (post.likes_count, post.updated_at) == (1, edited)
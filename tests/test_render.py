@@ -0,0 +1,46 @@
+import pytest
+import netta
+
+
+@pytest.fixture(autouse=True)
+def index(make_user, monkeypatch):
+    make_user('render_known')
+    # Свой индекс имён: общий мог загрузиться до появления пользователя
+    monkeypatch.setattr(netta, 'username_index', netta.UsernameIndex(refresh_interval=3600))
+
+
+@pytest.mark.parametrize('text, html', [
+    ('<script>alert(1)</script>', '&lt;script&gt;alert(1)&lt;/script&gt;'),
+    ('<img src=x onerror=alert(1)>', '&lt;img src=x onerror=alert(1)&gt;'),
+    ('javascript:alert(1)', 'javascript:alert(1)'),
+    ('#<b>tag', '#&lt;b&gt;tag'),
+    ('&#123; #ok', '&amp;#123; <span class="hashtag">#ok</span>'),
+    ('@nobody_here <i>', '@nobody_here &lt;i&gt;'),
+    ('a\r\nb', 'a<br>\nb'),
+])
+def test_render_escapes_text(text, html):
+    assert netta.render_content(text) == html
+
+
+@pytest.mark.parametrize('text, html', [
+    # Кавычка не входит в ссылку, поэтому не может закрыть атрибут href
+    (
+        'http://x.test/"onmouseover="alert(1)',
+        '<a href="http://x.test/" rel="nofollow noopener" target="_blank">http://x.test/</a>&#34;onmouseover=&#34;alert(1)',
+    ),
+    (
+        "https://x.test/a?b=1&c='x'",
+        '<a href="https://x.test/a?b=1&amp;c=" rel="nofollow noopener" target="_blank">https://x.test/a?b=1&amp;c=</a>&#39;x&#39;',
+    ),
+    (
+        'see https://x.test/page.',
+        'see <a href="https://x.test/page" rel="nofollow noopener" target="_blank">https://x.test/page</a>.',
+    ),
+])
+def test_render_links_stay_inside_attribute(text, html):
+    assert netta.render_content(text) == html
+
+
+def test_render_mentions_known_users_only():
+    html = netta.render_content('@render_known и @render_unknown')
+    assert html == '<a class="mention" href="/u/render_known">@render_known</a> и @render_unknown'
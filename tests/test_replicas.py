@@ -0,0 +1,68 @@
+import time
+
+import pytest
+from flask import Flask, g, session
+
+import netta
+from netta import db, User
+
+
+@pytest.fixture
+def replica_app(tmp_path, monkeypatch):
+    # Основная база и «реплика» — два файла SQLite; у одного и того же пользователя в них разные имена,
+    # по имени видно, откуда прочитана строка
+    app = Flask('netta_replicas')
+    app.config['SECRET_KEY'] = 'test'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "primary.db"}'
+    app.config['SQLALCHEMY_BINDS'] = {'replica_0': f'sqlite:///{tmp_path / "replica.db"}'}
+    # init_app заводит в общем db метаданные ключа replica_0 — после теста их не должно остаться
+    monkeypatch.setattr(db, 'metadatas', dict(db.metadatas))
+    db.init_app(app)
+    monkeypatch.setattr(netta, 'REPLICA_BINDS', {'replica_0': app.config['SQLALCHEMY_BINDS']['replica_0']})
+    with app.app_context():
+        for engine, username in ((db.engine, 'on_primary'), (db.engines['replica_0'], 'on_replica')):
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(User.__table__.insert().values(id=1, username=username, email='r@netta.test', password_hash='x'))
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def read_username():
+    return db.session.get(User, 1).username
+
+
+def test_get_reads_from_replica(replica_app):
+    with replica_app.test_request_context('/', method='GET'):
+        assert read_username() == 'on_replica'
+    # Вне запроса (фоновые задачи, CLI) — всегда основная
+    with replica_app.app_context():
+        assert read_username() == 'on_primary'
+
+
+def test_write_request_reads_from_primary(replica_app):
+    with replica_app.test_request_context('/', method='POST'):
+        assert read_username() == 'on_primary'
+
+
+def test_read_after_write_in_same_request_goes_to_primary(replica_app):
+    with replica_app.test_request_context('/', method='GET'):
+        db.session.add(User(username='written', email='written@netta.test', password_hash='x'))
+        db.session.flush()
+        assert g.use_primary
+        assert read_username() == 'on_primary'
+        db.session.rollback()
+
+
+def test_session_is_pinned_to_primary_after_write(replica_app):
+    # После своей записи пользователь несколько секунд читает с основной (read-your-writes)
+    with replica_app.test_request_context('/', method='POST'):
+        netta.pin_writer_to_primary(replica_app.response_class())
+        pinned_until = session['primary_until']
+    assert pinned_until > time.time()
+
+    with replica_app.test_request_context('/', method='GET'):
+        session['primary_until'] = pinned_until
+        assert read_username() == 'on_primary'
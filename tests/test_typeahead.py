@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy import event
+
+import netta
+from netta import db, Friendship, User
+
+
+@pytest.fixture
+def index(app_context):
+    index = netta.UsernameIndex(refresh_interval=3600)
+    index.ensure_fresh()
+    return index
+
+
+def usernames(index, query, viewer_id=None):
+    return [user['username'] for user in index.suggest(query, viewer_id)]
+
+
+def test_index_picks_up_new_and_renamed_users(index):
+    user = User(username='zebra_old', email='zebra@netta.test', password_hash='x', full_name='Зоя')
+    db.session.add(user)
+    db.session.commit()
+    index._load()
+    assert usernames(index, 'zebra') == ['zebra_old']
+
+    user.username = 'quokka'
+    db.session.commit()
+    index._load()
+    assert usernames(index, 'zebra') == []
+    assert usernames(index, 'quok') == ['quokka']
+    assert usernames(index, 'зоя') == ['quokka']
+    assert index.resolve(['quokka', 'zebra_old']) == {'quokka': user.id}
+
+
+def test_incremental_load_reads_only_changed_users(index):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        index._load()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert any('profile_updated_at >' in statement for statement in statements)
+
+
+def test_suggest_does_not_query_database(index):
+    users = [User(username=f'typeahead{i}', email=f'typeahead{i}@netta.test', password_hash='x') for i in range(3)]
+    db.session.add_all(users)
+    db.session.flush()
+    db.session.add(Friendship(user_id=users[0].id, friend_id=users[2].id, status='accepted'))
+    db.session.commit()
+    index._load()
+    netta.friend_graph.invalidate(users[0].id)
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        # Друзей нет в кэше — подсказка без их приоритета, но и без запроса
+        assert len(index.suggest('typeahead', users[0].id)) == 2
+        netta.friend_graph.friends(users[0].id)
+        statements.clear()
+        suggested = index.suggest('typeahead', users[0].id)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert statements == []
+    assert suggested[0]['id'] == users[2].id and suggested[0]['friend']
@@ -0,0 +1,25 @@
+from datetime import datetime
+
+import netta
+from netta import db, Post
+
+
+def test_flush_counts_views_without_touching_updated_at(make_user):
+    author = make_user('viewed_author')
+    edited = datetime(2024, 5, 1, 12, 0)
+    posts = [Post(content='post', user_id=author.id, updated_at=edited) for _ in range(2)]
+    db.session.add_all(posts)
+    db.session.commit()
+
+    # Интервал в час: фоновый поток счётчика не сбросит показы раньше теста
+    counter = netta.ViewCounter(flush_interval=3600)
+    for viewer_id in (1, 2, 2):
+        counter.record([posts[0].id, posts[1].id], viewer_id)
+    counter.record([posts[0].id], 3)
+    assert counter.flush() == 2
+
+    db.session.expire_all()
+    first, second = db.session.get(Post, posts[0].id), db.session.get(Post, posts[1].id)
+    assert (first.views_count, first.unique_viewers) == (4, 3)
+    assert (second.views_count, second.unique_viewers) == (3, 2)
+    assert first.updated_at == second.updated_at == edited
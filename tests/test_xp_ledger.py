@@ -0,0 +1,71 @@
+import netta
+from netta import db, Post, User, XpEvent
+
+
+def apply_all():
+    while netta.xp_ledger.apply_pending():
+        pass
+
+
+def balance(user_id):
+    user = db.session.get(User, user_id)
+    db.session.refresh(user)
+    return user.xp, user.level, user.coins
+
+
+def test_first_award_opens_legacy_balance(make_user):
+    # Уровень выше опыта бывает у старых данных — начисление его не понижает
+    user = make_user('legacy', xp=250, level=7, coins=900)
+    netta.award(user.id, xp=30, reason='test')
+    db.session.commit()
+    apply_all()
+
+    opening = XpEvent.query.filter_by(idempotency_key=f'opening:{user.id}').one()
+    assert (opening.xp, opening.level, opening.coins) == (250, 7, 900)
+    assert balance(user.id) == (280, 7, 900)
+
+
+def test_rebuild_reproduces_applied_balance(make_user):
+    grown = make_user('grown', xp=90, level=1, coins=100)
+    legacy = make_user('legacy_rebuild', xp=10, level=4, coins=40)
+    idle = make_user('idle', xp=500, level=3, coins=70)
+    for user in (grown, legacy):
+        netta.award(user.id, xp=20, reason='test')
+        netta.award(user.id, xp=100, coins=5, reason='test')
+    db.session.commit()
+    apply_all()
+    expected = {user.id: balance(user.id) for user in (grown, legacy, idle)}
+    assert expected[grown.id] == (210, 3, 205)
+
+    netta.app.test_cli_runner().invoke(netta.xp_rebuild)
+    assert {user_id: balance(user_id) for user_id in expected} == expected
+
+
+def test_ledger_opened_after_events_were_applied(make_user):
+    # Пользователь, которому события применили до появления начальных балансов
+    user = make_user('early', xp=95, level=1, coins=100)
+    db.session.add(XpEvent(user_id=user.id, xp=10, reason='test'))
+    db.session.commit()
+    event_ids = [event.id for event in XpEvent.query.filter_by(user_id=user.id)]
+    netta.apply_totals(db.session.get(User, user.id), 10, 0)
+    XpEvent.query.filter(XpEvent.id.in_(event_ids)).update({XpEvent.applied_at: db.func.current_timestamp()})
+    db.session.commit()
+    assert balance(user.id) == (105, 2, 150)
+
+    netta.app.test_cli_runner().invoke(netta.xp_open_ledger)
+    opening = XpEvent.query.filter_by(idempotency_key=f'opening:{user.id}').one()
+    assert (opening.xp, opening.level, opening.coins) == (95, 1, 100)
+    netta.app.test_cli_runner().invoke(netta.xp_rebuild)
+    assert balance(user.id) == (105, 2, 150)
+
+
+def test_like_awards_xp_once(make_user):
+    author = make_user('liked_author')
+    fan = make_user('fan')
+    post = Post(content='post', user_id=author.id)
+    db.session.add(post)
+    db.session.commit()
+
+    for _ in range(3):
+        netta.toggle_like(post, fan)
+    assert XpEvent.query.filter_by(user_id=fan.id, reason='like').count() == 1